@@ -1,15 +1,17 @@
 # app/__init__.py
-from flask import Flask
 import logging
 
-# Import the filters
-from config import get_config
-from app.utils.filters import format_filesize, format_filedate
-
 
 def create_app():
+    # Flask and the template filters are imported here rather than at module level,
+    # so the CLI and the services can import app.* without loading the web stack
+    from flask import Flask
+    from config import get_config, ensure_directories
+    from app.utils.filters import format_filesize, format_filedate, format_pagecount
+
     app = Flask(__name__)
     app.config.from_object(get_config())
+    ensure_directories(app.config)
 
     # Configure logging
     logging.basicConfig(
@@ -20,6 +22,7 @@ def create_app():
     # Register Jinja2 filters
     app.jinja_env.filters['filesize'] = format_filesize
     app.jinja_env.filters['filedate'] = format_filedate
+    app.jinja_env.filters['pagecount'] = format_pagecount
 
     # Register blueprints
     from app.routes.main import main_bp
@@ -30,4 +33,15 @@ def create_app():
     app.register_blueprint(exams_bp, url_prefix='/exams')
     app.register_blueprint(analysis_bp, url_prefix='/analysis')
 
-    return app
\ No newline at end of file
+    # Opt-in request profiling (PROFILE_MODE or ?profile=...&profile_token=...)
+    from app.utils import profiling
+    profiling.init_app(app)
+
+    # Connect to the configured models in the background so the first grading request does not pay for it.
+    # Not in child processes (e.g. spawned render workers re-importing run.py), which never call the models
+    import multiprocessing
+    if multiprocessing.parent_process() is None:
+        from app.services.model_calls import warm_up_models
+        warm_up_models(app.config)
+
+    return app
@@ -0,0 +1,397 @@
+# app/cli.py
+"""Command line entry points that run without the web server.
+
+Usage:
+    python -m app.cli grade --answer-key data/answers/key.pdf --exams "data/exams/*.pdf" --workers 8
+    python -m app.cli regrade --exam-id midterm
+    python -m app.cli watch --exam-id midterm --answer-key data/answers/key.pdf --inbox /mnt/scans
+    python -m app.cli convert --to msgpack
+    python -m app.cli queue submit --answer-key data/answers/key.pdf --exams "data/exams/*.pdf"
+    python -m app.cli worker --threads 8
+"""
+import os
+import sys
+import glob
+import json
+import argparse
+import logging
+
+from config import load_config
+from app.utils.profiling import profiled
+from app.utils.file_utils import validate_exam_id
+from app.services.model_calls import warm_up_models
+
+logger = logging.getLogger(__name__)
+
+# File types the grader accepts, matching the upload form
+EXAM_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png')
+
+
+def collect_exam_paths(patterns):
+    """Expand exam directories, glob patterns and file paths into a sorted file list.
+
+    Args:
+        patterns (list): Directories, glob patterns or file paths
+
+    Returns:
+        list: Unique exam file paths, in the order the patterns were given
+    """
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(os.path.join(pattern, name) for name in os.listdir(pattern))
+        else:
+            matches = sorted(glob.glob(pattern)) or [pattern]
+
+        for path in matches:
+            if os.path.isfile(path) and path.lower().endswith(EXAM_EXTENSIONS) and path not in paths:
+                paths.append(path)
+    return paths
+
+
+def format_stats(stats):
+    """Render pipeline stats as a short human-readable report."""
+    stages = stats['stages']
+    lines = [
+        f"Exam {stats['exam_id']}: graded {stats['graded']}/{stats['exams']} exams "
+        f"({stats['failed']} failed, {stats['answers']} answers) with {stats['workers']} workers",
+    ]
+    if stats.get('claimed'):
+        lines.append(f"  claimed:     {stats['claimed']} exams were graded by other workers")
+    if stats.get('run_id'):
+        lines.append(f"  run:         {stats['run_id']} ({stats['resumed']} exams resumed from checkpoints)")
+    lines += [
+        f"  wall time:   {stats['wall_seconds']:.2f}s ({stats['exams_per_minute']} exams/min)",
+        f"  answer key:  {stages['answer_key']:.2f}s",
+    ]
+    for stage in ('extraction', 'evaluation'):
+        summary = stages[stage]
+        lines.append(f"  {stage + ':':<12} mean {summary['mean']:.2f}s  p50 {summary['p50']:.2f}s  "
+                     f"p95 {summary['p95']:.2f}s  max {summary['max']:.2f}s")
+    lines.append(f"  analysis:    {stages['analysis']:.2f}s")
+    if stats.get('usage'):
+        totals = stats['usage']['totals']
+        lines.append(f"  model usage: {totals['calls']} calls ({totals['retries']} retries), "
+                     f"{totals['prompt_tokens']} prompt + {totals['output_tokens']} output tokens, "
+                     f"{totals['cost']:.4f} {stats['usage']['currency']}")
+    return '\n'.join(lines)
+
+
+def grade(args):
+    """Grade a batch of exams against an answer key and print throughput stats."""
+    from app.services.grading_pipeline import GradingPipeline
+
+    if not os.path.isfile(args.answer_key):
+        print(f"Answer key not found: {args.answer_key}", file=sys.stderr)
+        return 2
+
+    exam_paths = collect_exam_paths(args.exams)
+    if not exam_paths:
+        print(f"No exam files matched: {' '.join(args.exams)}", file=sys.stderr)
+        return 2
+
+    overrides = {}
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        overrides['RESULTS_DIR'] = os.path.abspath(args.output)
+    if args.api_key:
+        overrides['GEMINI_API_KEY'] = args.api_key
+    config = load_config(args.config, **overrides)
+
+    exam_id = args.exam_id or os.path.splitext(os.path.basename(args.answer_key))[0]
+    try:
+        validate_exam_id(exam_id)
+    except ValueError as e:
+        print(f"{e} (pass --exam-id)", file=sys.stderr)
+        return 2
+    warm_up_models(config)
+    pipeline = GradingPipeline(config, workers=args.workers)
+    result = pipeline.run(exam_id, args.answer_key, exam_paths, args.subject, resume=not args.fresh)
+
+    if args.json:
+        print(json.dumps(dict(result['stats'], failures=result['failures']), indent=2))
+    else:
+        print(format_stats(result['stats']))
+        for failure in result['failures']:
+            print(f"  failed: {failure['file']}: {failure['error']}")
+        print(f"Results written to {config['RESULTS_DIR']}")
+
+    return 1 if result['failures'] else 0
+
+
+def watch(args):
+    """Grade exams continuously as they are dropped into an inbox folder."""
+    from app.services.exam_watcher import ExamWatcher
+
+    config = load_config(args.config, **({'GEMINI_API_KEY': args.api_key} if args.api_key else {}))
+    exam_id = args.exam_id or config.get('WATCH_EXAM_ID')
+    answer_key = args.answer_key or config.get('WATCH_ANSWER_KEY')
+
+    if not exam_id or not answer_key:
+        print("An exam ID and answer key are required (--exam-id/--answer-key or "
+              "WATCH_EXAM_ID/WATCH_ANSWER_KEY)", file=sys.stderr)
+        return 2
+    try:
+        validate_exam_id(exam_id)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    if not os.path.isfile(answer_key):
+        print(f"Answer key not found: {answer_key}", file=sys.stderr)
+        return 2
+
+    warm_up_models(config)
+    watcher = ExamWatcher(config, exam_id, answer_key, inbox_dir=args.inbox, settle_seconds=args.settle,
+                          poll_interval=args.poll_interval, workers=args.workers, use_polling=args.polling,
+                          exam_subject=args.subject)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        watcher.stop()
+    return 0
+
+
+def regrade(args):
+    """Retry failed answers of a graded exam, or regrade the questions changed in a corrected key."""
+    from app.services.regrader import Regrader
+
+    overrides = {}
+    if args.output:
+        overrides['RESULTS_DIR'] = os.path.abspath(args.output)
+    if args.api_key:
+        overrides['GEMINI_API_KEY'] = args.api_key
+    config = load_config(args.config, **overrides)
+
+    try:
+        if args.answer_key:
+            summary = Regrader(config).regrade_with_key_file(args.exam_id, args.answer_key, args.subject)
+        else:
+            summary = Regrader(config).regrade(args.exam_id, args.subject, reextract=not args.no_reextract)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    elif args.answer_key:
+        diff = summary['diff']
+        print(f"Exam {summary['exam_id']}: key changed {diff['changed'] or '-'}, added {diff['added'] or '-'}, "
+              f"removed {diff['removed'] or '-'}; re-evaluated {summary['evaluated']}/{summary['answers']} "
+              f"answers and cleared {summary['cleared']} answers to removed questions "
+              f"for {summary['students']} students")
+    else:
+        print(f"Exam {summary['exam_id']}: re-evaluated {summary['evaluated']}/{summary['answers']} answers "
+              f"for {summary['students']} students, re-extracted {summary['reextracted']} exams, "
+              f"refreshed {summary['questions']} questions")
+    return 0 if summary['evaluated'] == summary['answers'] else 1
+
+
+def convert(args):
+    """Rewrite stored results in another format (json or msgpack)."""
+    from app.services.result_store import ResultStore
+
+    config = load_config(args.config, **({'RESULTS_DIR': os.path.abspath(args.output)} if args.output else {}))
+    try:
+        stats = ResultStore.from_config(config).convert(args.to, exam_id=args.exam_id)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+
+    if args.json:
+        print(json.dumps(stats, indent=2))
+    else:
+        ratio = stats['bytes_after'] / stats['bytes_before'] if stats['bytes_before'] else 1.0
+        print(f"Converted {stats['converted']} result files to {args.to} ({stats['skipped']} already were): "
+              f"{stats['bytes_before']} -> {stats['bytes_after']} bytes ({ratio:.0%} of the original size)")
+        if args.to != config.get('RESULT_FORMAT', 'json'):
+            print(f"Set RESULT_FORMAT={args.to} to write new results in this format too")
+    return 0
+
+
+def queue_submit(args):
+    """Queue exams for the queue workers instead of grading them here."""
+    from app.services.work_queue import WorkQueue
+    from app.services.queue_worker import submit_exam
+
+    exam_paths = collect_exam_paths(args.exams)
+    if not exam_paths:
+        print(f"No exam files matched: {' '.join(args.exams)}", file=sys.stderr)
+        return 2
+    if not os.path.isfile(args.answer_key):
+        print(f"Answer key not found: {args.answer_key}", file=sys.stderr)
+        return 2
+
+    config = load_config(args.config)
+    exam_id = args.exam_id or os.path.splitext(os.path.basename(args.answer_key))[0]
+    try:
+        validate_exam_id(exam_id)
+    except ValueError as e:
+        print(f"{e} (pass --exam-id)", file=sys.stderr)
+        return 2
+    queue = WorkQueue.from_config(config)
+    try:
+        summary = submit_exam(queue, exam_id, args.answer_key, exam_paths, args.subject, config)
+    finally:
+        queue.close()
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"Exam {exam_id}: queued {summary['queued']} tasks for {summary['exams']} exams "
+              f"(already queued or done work is not queued again)")
+    return 0
+
+
+def queue_status(args):
+    """Print the task counts of the work queue and its failed tasks."""
+    from app.services.work_queue import WorkQueue
+
+    queue = WorkQueue.from_config(load_config(args.config))
+    try:
+        counts = queue.counts(args.exam_id)
+        failures = queue.failures(args.exam_id)
+    finally:
+        queue.close()
+
+    if args.json:
+        print(json.dumps({'counts': counts, 'failures': failures}, indent=2))
+        return 0
+    if not counts:
+        print("The queue is empty")
+    for kind, statuses in sorted(counts.items()):
+        print(f"{kind:<12} " + ', '.join(f"{count} {status}" for status, count in sorted(statuses.items())))
+    for failure in failures:
+        print(f"  failed: {failure['task_key']} after {failure['attempts']} attempts: {failure['error']}")
+    return 0
+
+
+def worker(args):
+    """Run grading tasks from the shared work queue until stopped (or idle)."""
+    from app.services.queue_worker import QueueWorker
+
+    config = load_config(args.config, **({'GEMINI_API_KEY': args.api_key} if args.api_key else {}))
+    warm_up_models(config)
+    queue_worker = QueueWorker(config)
+    try:
+        stats = queue_worker.run(threads=args.threads, exam_id=args.exam_id, max_tasks=args.max_tasks,
+                                 idle_exit=args.idle_exit)
+    except KeyboardInterrupt:
+        queue_worker.stop()
+        return 130
+    finally:
+        queue_worker.queue.close()
+
+    print(json.dumps(stats) if args.json else
+          f"Worker finished: {stats['done']} done, {stats['retried']} retried, {stats['failed']} failed, "
+          f"{stats['lost']} lost leases")
+    return 0
+
+
+def build_parser():
+    """Build the argument parser for all subcommands."""
+    parser = argparse.ArgumentParser(prog='python -m app.cli', description='Smart Assess command line tools')
+    parser.add_argument('--config', choices=['development', 'testing', 'production', 'default'],
+                        help='Configuration to use (defaults to FLASK_ENV)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log progress to stderr')
+    parser.add_argument('--profile', choices=['cprofile', 'sampling'],
+                        help='Profile the command and write the profile to PROFILE_DIR (default PROFILE_MODE)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    grade_parser = subparsers.add_parser('grade', help='Grade exams against an answer key')
+    grade_parser.add_argument('--answer-key', required=True, help='Answer key PDF or image')
+    grade_parser.add_argument('--exams', required=True, nargs='+',
+                              help='Exam files, directories or glob patterns (quote globs)')
+    grade_parser.add_argument('--exam-id', help='Exam ID (defaults to the answer key filename)')
+    grade_parser.add_argument('--workers', type=int, help='Exams processed concurrently (default GRADING_WORKERS)')
+    grade_parser.add_argument('--output', help='Directory results are written to (default RESULTS_DIR)')
+    grade_parser.add_argument('--subject', default='English', help='Exam subject used in evaluation prompts')
+    grade_parser.add_argument('--api-key', help='Gemini API key (default GEMINI_API_KEY)')
+    grade_parser.add_argument('--json', action='store_true', help='Print stats as JSON')
+    grade_parser.add_argument('--fresh', action='store_true',
+                              help='Start a new run instead of resuming an interrupted one')
+    grade_parser.set_defaults(handler=grade)
+
+    regrade_parser = subparsers.add_parser('regrade', help='Retry failed answers or apply a corrected answer key')
+    regrade_parser.add_argument('--exam-id', required=True, help='Exam to regrade')
+    regrade_parser.add_argument('--answer-key',
+                                help='Corrected answer key; only questions whose answer changed are re-evaluated')
+    regrade_parser.add_argument('--output', help='Directory holding the results (default RESULTS_DIR)')
+    regrade_parser.add_argument('--subject', default='English', help='Exam subject used in evaluation prompts')
+    regrade_parser.add_argument('--no-reextract', action='store_true',
+                                help='Do not re-run extraction for exams whose answers could not be parsed')
+    regrade_parser.add_argument('--api-key', help='Gemini API key (default GEMINI_API_KEY)')
+    regrade_parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+    regrade_parser.set_defaults(handler=regrade)
+
+    watch_parser = subparsers.add_parser('watch', help='Grade exams as they arrive in an inbox folder')
+    watch_parser.add_argument('--exam-id', help='Exam ID the papers belong to (default WATCH_EXAM_ID)')
+    watch_parser.add_argument('--answer-key', help='Answer key PDF or image (default WATCH_ANSWER_KEY)')
+    watch_parser.add_argument('--inbox', help='Folder to watch (default WATCH_INBOX_DIR, i.e. data/inbox)')
+    watch_parser.add_argument('--workers', type=int, help='Exams graded concurrently (default GRADING_WORKERS)')
+    watch_parser.add_argument('--settle', type=float,
+                              help='Seconds a file must stay unchanged before grading (default WATCH_SETTLE_SECONDS)')
+    watch_parser.add_argument('--poll-interval', type=float, help='Seconds between checks (default WATCH_POLL_INTERVAL)')
+    watch_parser.add_argument('--polling', action='store_true',
+                              help='Poll instead of using filesystem events (e.g. on network shares)')
+    watch_parser.add_argument('--subject', default='English', help='Exam subject used in evaluation prompts')
+    watch_parser.add_argument('--api-key', help='Gemini API key (default GEMINI_API_KEY)')
+    watch_parser.set_defaults(handler=watch)
+
+    convert_parser = subparsers.add_parser('convert', help='Convert stored results between json and msgpack')
+    convert_parser.add_argument('--to', required=True, choices=['json', 'msgpack'], help='Target format')
+    convert_parser.add_argument('--exam-id', help='Only convert the results of this exam')
+    convert_parser.add_argument('--output', help='Directory holding the results (default RESULTS_DIR)')
+    convert_parser.add_argument('--json', action='store_true', help='Print the counts as JSON')
+    convert_parser.set_defaults(handler=convert)
+
+    queue_parser = subparsers.add_parser('queue', help='Queue exams for queue workers, or show the queue')
+    queue_subparsers = queue_parser.add_subparsers(dest='queue_command', required=True)
+    submit_parser = queue_subparsers.add_parser('submit', help='Queue exams for grading by the workers')
+    submit_parser.add_argument('--answer-key', required=True, help='Answer key PDF or image')
+    submit_parser.add_argument('--exams', required=True, nargs='+',
+                               help='Exam files, directories or glob patterns (quote globs), at paths the '
+                                    'workers can read')
+    submit_parser.add_argument('--exam-id', help='Exam ID (defaults to the answer key filename)')
+    submit_parser.add_argument('--subject', default='English', help='Exam subject used in evaluation prompts')
+    submit_parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+    submit_parser.set_defaults(handler=queue_submit)
+    status_parser = queue_subparsers.add_parser('status', help='Show task counts and failed tasks')
+    status_parser.add_argument('--exam-id', help='Only show tasks of this exam')
+    status_parser.add_argument('--json', action='store_true', help='Print the counts as JSON')
+    status_parser.set_defaults(handler=queue_status)
+
+    worker_parser = subparsers.add_parser('worker', help='Run grading tasks from the shared work queue')
+    worker_parser.add_argument('--threads', type=int, help='Tasks run concurrently (default GRADING_WORKERS)')
+    worker_parser.add_argument('--exam-id', help='Only run tasks of this exam')
+    worker_parser.add_argument('--max-tasks', type=int, help='Exit after this many tasks')
+    worker_parser.add_argument('--idle-exit', type=float,
+                               help='Exit once no task has been available for this many seconds')
+    worker_parser.add_argument('--api-key', help='Gemini API key (default GEMINI_API_KEY)')
+    worker_parser.add_argument('--json', action='store_true', help='Print the task counts as JSON')
+    worker_parser.set_defaults(handler=worker)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'exam_id', None):
+        try:
+            validate_exam_id(args.exam_id)
+        except ValueError as e:
+            parser.error(str(e))
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    config = load_config(args.config)
+    mode = args.profile or config.get('PROFILE_MODE')
+    with profiled(config, mode, 'run', args.command, getattr(args, 'exam_id', None)):
+        return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,6 +3,7 @@
 # Import all models here for easy access
 
 from app.models.data_model import (
+    AnswerLocation,
     QuestionAnswer,
     StudentExam,
     AnswerKey,
@@ -1,31 +1,120 @@
 # data_model.py
+import os
+import sys
+import typing
+import dataclasses
 from dataclasses import dataclass, field
 from typing import Dict, List, Optional, Tuple, Any
-import json
-import os
 
-
-@dataclass
+from app.utils import fast_json
+
+# Slotted instances have no per-instance __dict__, so each answer and location object is
+# smaller and attribute access is faster; dataclass(slots=True) needs Python 3.10
+SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+
+def _model_type(annotation):
+    """Return (kind, model class) for a field annotation: 'model', 'list' or 'dict' of a model, or None."""
+    if dataclasses.is_dataclass(annotation):
+        return 'model', annotation
+    origin, args = typing.get_origin(annotation), typing.get_args(annotation)
+    if origin is typing.Union:
+        members = [arg for arg in args if arg is not type(None)]
+        return _model_type(members[0]) if len(members) == 1 else (None, None)
+    if origin is list and args and dataclasses.is_dataclass(args[0]):
+        return 'list', args[0]
+    if origin is dict and len(args) == 2 and dataclasses.is_dataclass(args[1]):
+        return 'dict', args[1]
+    return None, None
+
+
+def codec(cls):
+    """Generate to_dict/from_dict for a dataclass from its fields.
+
+    The methods are compiled once per class into straight-line code (one
+    dict literal / one positional constructor call) rather than walking
+    dataclasses.fields() per object. Nested models, and lists or dicts of
+    them, are converted recursively. A missing value takes the field's
+    default, or `metadata={'missing': value}` for required fields; fields
+    with a default factory (lists, dicts, nested models) never come back as
+    None. Methods defined in the class body are kept.
+    """
+    hints = typing.get_type_hints(cls)
+    namespace = {}
+    dump_items = []
+    load_items = []
+
+    for index, f in enumerate(f for f in dataclasses.fields(cls) if f.init):
+        kind, model = _model_type(hints[f.name])
+        if model is not None:
+            namespace[f"_model{index}"] = model
+
+        value = f"self.{f.name}"
+        if kind == 'model':
+            value = f"(None if {value} is None else {value}.to_dict())"
+        elif kind == 'list':
+            value = f"[item.to_dict() for item in {value}]"
+        elif kind == 'dict':
+            value = f"{{key: item.to_dict() if hasattr(item, 'to_dict') else item for key, item in {value}.items()}}"
+        dump_items.append(f"{f.name!r}: {value}")
+
+        raw = f"get({f.name!r})"
+        if f.default_factory is not dataclasses.MISSING:
+            namespace[f"_factory{index}"] = f.default_factory
+            if kind == 'model':
+                value = f"(_model{index}.from_dict(v) if (v := {raw}) is not None else _factory{index}())"
+            elif kind == 'list':
+                value = f"[_model{index}.from_dict(item) for item in {raw} or ()]"
+            elif kind == 'dict':
+                value = f"{{key: _model{index}.from_dict(item) for key, item in ({raw} or {{}}).items()}}"
+            else:
+                value = f"({raw} or _factory{index}())"
+        else:
+            default = f.default if f.default is not dataclasses.MISSING else f.metadata.get('missing')
+            namespace[f"_default{index}"] = default
+            if kind == 'model':
+                value = f"(_model{index}.from_dict(v) if (v := {raw}) is not None else _default{index})"
+            elif default is None:
+                value = raw
+            else:
+                value = f"get({f.name!r}, _default{index})"
+        load_items.append(value)
+
+    source = (
+        "def to_dict(self):\n"
+        f"    return {{{', '.join(dump_items)}}}\n"
+        "def from_dict(cls, data):\n"
+        "    get = data.get\n"
+        f"    return cls({', '.join(load_items)})\n"
+    )
+    exec(compile(source, f"<{cls.__name__} codec>", 'exec'), namespace)
+
+    if 'to_dict' not in cls.__dict__:
+        namespace['to_dict'].__qualname__ = f"{cls.__qualname__}.to_dict"
+        namespace['to_dict'].__doc__ = "Convert to a JSON-serializable dictionary."
+        cls.to_dict = namespace['to_dict']
+    if 'from_dict' not in cls.__dict__:
+        namespace['from_dict'].__qualname__ = f"{cls.__qualname__}.from_dict"
+        namespace['from_dict'].__doc__ = "Create an instance from its dictionary form (e.g. a saved result file)."
+        cls.from_dict = classmethod(namespace['from_dict'])
+    return cls
+
+
+@codec
+@dataclass(**SLOTS)
 class AnswerLocation:
     """Represents the location of an answer within a document."""
-    page: int
+    page: int = field(metadata={'missing': 1})
     bounding_box: Optional[Dict[str, float]] = None  # x1, y1, x2, y2 coordinates
     text_spans: Optional[List[Dict[str, Any]]] = field(default_factory=list)  # For multiple text regions
 
-    def to_dict(self):
-        """Convert location to dictionary."""
-        return {
-            "page": self.page,
-            "bounding_box": self.bounding_box,
-            "text_spans": self.text_spans
-        }
-
 
-@dataclass
+@codec
+@dataclass(**SLOTS)
 class QuestionAnswer:
     """Represents a student's answer to a specific question."""
-    question_number: str
-    answer_text: str
+    question_number: str = field(metadata={'missing': ''})
+    answer_text: str = field(metadata={'missing': ''})
     is_correct: Optional[bool] = None
     location: AnswerLocation = field(default_factory=lambda: AnswerLocation(page=1))
     error_type: Optional[str] = None
@@ -34,81 +123,44 @@ class QuestionAnswer:
     reference_to_answer: Optional[str] = None
     misconception: Optional[str] = None
 
-    def to_dict(self):
-        return {
-            "question_number": self.question_number,
-            "answer_text": self.answer_text,
-            "is_correct": self.is_correct,
-            "location": {
-                "page": self.location.page,
-                "bounding_box": self.location.bounding_box,
-                "text_spans": self.location.text_spans
-            },
-            "error_type": self.error_type,
-            "evaluation_reason": self.evaluation_reason,
-            "learning_topics": self.learning_topics,
-            "reference_to_answer": self.reference_to_answer,
-            "misconception": self.misconception
-        }
 
-@dataclass
+@codec
+@dataclass(**SLOTS)
 class StudentExam:
     """Represents a student's exam with all their answers."""
-    student_id: str
-    exam_id: str
+    student_id: str = field(metadata={'missing': 'Unknown'})
+    exam_id: str = field(metadata={'missing': ''})
     student_name: Optional[str] = None  # Add this line for the student's full name
     answers: List[QuestionAnswer] = field(default_factory=list)
     score: Optional[float] = None
-
-    def to_dict(self):
-        return {
-            "student_id": self.student_id,
-            "exam_id": self.exam_id,
-            "student_name": self.student_name,  # Include in the dictionary
-            "answers": [ans.to_dict() for ans in self.answers],
-            "score": self.score
-        }
+    source_file: Optional[str] = None  # Exam file the answers were extracted from
+    raw_text: Optional[str] = None  # Unparsed model output when answer extraction failed
 
     def save(self, directory):
         """Save the student exam data to a JSON file."""
         filename = f"{self.student_id}_{self.exam_id}.json"
         filepath = os.path.join(directory, filename)
-
-        with open(filepath, 'w') as f:
-            json.dump(self.to_dict(), f, indent=2)
-
+        fast_json.dump_file(self.to_dict(), filepath)
         return filepath
 
 
-@dataclass
+@codec
+@dataclass(**SLOTS)
 class AnswerKey:
     """Represents the answer key for an exam."""
-    exam_id: str
+    exam_id: str = field(metadata={'missing': ''})
     answers: Dict[str, str] = field(default_factory=dict)  # question_number -> correct_answer
     answer_locations: Dict[str, AnswerLocation] = field(default_factory=dict)  # question_number -> location
 
-    def to_dict(self):
-        return {
-            "exam_id": self.exam_id,
-            "answers": self.answers,
-            "answer_locations": {
-                qnum: loc.to_dict() if hasattr(loc, 'to_dict') else loc
-                for qnum, loc in self.answer_locations.items()
-            } if hasattr(self, 'answer_locations') else {}
-        }
-
     def save(self, directory):
         """Save the answer key to a JSON file."""
         filename = f"key_{self.exam_id}.json"
         filepath = os.path.join(directory, filename)
-
-        with open(filepath, 'w') as f:
-            json.dump(self.to_dict(), f, indent=2)
-
+        fast_json.dump_file(self.to_dict(), filepath)
         return filepath
 
 
-@dataclass
+@dataclass(**SLOTS)
 class ExamAnalysis:
     """Represents the analysis of all students' performance on an exam."""
     exam_id: str
@@ -117,11 +169,16 @@ class ExamAnalysis:
     question_difficulty: Dict[str, float] = field(default_factory=dict)  # question_number -> difficulty score
     error_patterns: Dict[str, Dict[str, int]] = field(default_factory=dict)  # question_number -> {error_type -> count}
 
+    @property
+    def questions(self):
+        """Question numbers in the order of question_difficulty."""
+        return list(self.question_difficulty.keys())
+
     def to_dict(self):
         return {
             "exam_id": self.exam_id,
             "student_count": len(self.student_exams),
-            "questions": list(self.question_difficulty.keys()),
+            "questions": self.questions,
             "question_difficulty": self.question_difficulty,
             "error_patterns": self.error_patterns
         }
@@ -130,8 +187,5 @@ class ExamAnalysis:
         """Save the exam analysis to a JSON file."""
         filename = f"analysis_{self.exam_id}.json"
         filepath = os.path.join(directory, filename)
-
-        with open(filepath, 'w') as f:
-            json.dump(self.to_dict(), f, indent=2)
-
-        return filepath
\ No newline at end of file
+        fast_json.dump_file(self.to_dict(), filepath)
+        return filepath
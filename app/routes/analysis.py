@@ -1,19 +1,51 @@
 # app/routes/analysis.py
 import os
-import json
 import difflib
 from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, jsonify, send_file, \
-    make_response, session
+    session, Response
 from werkzeug.utils import secure_filename  # Add this line
-from app.services.exam_processor import ExamProcessor
 from app.services.analyzer import ExamAnalyzer
-from app.services.vision_api import GeminiVisionAPI
+from app.services.grading_pipeline import GradingPipeline
+from app.services.regrader import Regrader
 from app.services.pdf_highlighter import PDFHighlighter
-import io
+from app.services.render_cache import HighlightCache, schedule_prerender
+from app.services.export import stream_highlighted_zip
+from app.services.page_renderer import PageRenderer, IMAGE_FORMATS
+from app.services.pdf_metadata import metadata_index_for
+from app.services.usage import usage_dir, usage_report
+from app.services.result_store import ResultStore
+from app.services.work_queue import WorkQueue, QUEUED, LEASED, DONE, FAILED
+from app.services.queue_worker import submit_exam, PRIORITIES
+from app.models.data_model import ExamAnalysis
+from app.utils.file_utils import validate_exam_id
 
 analysis_bp = Blueprint('analysis', __name__)
 
 
+def get_result_store():
+    """Return the result store for the current application."""
+    return ResultStore.from_config(current_app.config)
+
+
+def get_highlight_cache():
+    """Return the highlight cache for the current application."""
+    return HighlightCache(current_app.config['HIGHLIGHT_CACHE_DIR'])
+
+
+def start_highlight_prerender(render_jobs):
+    """Queue highlighted PDFs for pre-rendering in the background so first views are cached.
+
+    Args:
+        render_jobs (list): (original_pdf_path, answer_locations, errors_only) tuples
+    """
+    if not render_jobs or not current_app.config.get('PRERENDER_HIGHLIGHTS'):
+        return
+
+    schedule_prerender(current_app.config['HIGHLIGHT_CACHE_DIR'], render_jobs,
+                       max_workers=current_app.config.get('RENDER_WORKERS'),
+                       max_queued=current_app.config.get('PRERENDER_QUEUE_SIZE', 4))
+
+
 @analysis_bp.route('/process', methods=['POST'])
 def process():
     """Process exams and answer keys."""
@@ -21,6 +53,12 @@ def process():
     exam_files = request.form.getlist('exam_files')
     answer_key_file = request.form.get('answer_key_file')
 
+    try:
+        validate_exam_id(exam_id)
+    except ValueError as e:
+        flash(str(e))
+        return redirect(url_for('exams.list'))
+
     if not exam_files:
         flash('No exam files selected')
         return redirect(url_for('exams.list'))
@@ -30,86 +68,183 @@ def process():
         return redirect(url_for('exams.list'))
 
     try:
-        # Initialize services
-        api = GeminiVisionAPI()
-        processor = ExamProcessor(api)
-        analyzer = ExamAnalyzer()
-
-        # Process answer key
         answer_key_path = os.path.join(current_app.config['ANSWERS_DIR'], answer_key_file)
-        answer_key = processor.process_answer_key(answer_key_path, exam_id)
+        exam_paths = [os.path.join(current_app.config['EXAMS_DIR'], exam_file) for exam_file in exam_files]
+
+        if current_app.config.get('WORK_QUEUE_ENABLED'):
+            # Leave the grading to the queue workers; results appear as they finish
+            queue = WorkQueue.from_config(current_app.config)
+            try:
+                summary = submit_exam(queue, exam_id, answer_key_path, exam_paths, "English", current_app.config)
+            finally:
+                queue.close()
+            flash(f"Queued {summary['exams']} exams for grading; results appear here as the workers finish them")
+            return redirect(url_for('analysis.results', exam_id=exam_id))
+
+        pipeline = GradingPipeline(current_app.config)
+        result = pipeline.run(exam_id, answer_key_path, exam_paths, "English")
+
+        if not result['graded']:
+            raise ValueError('; '.join(f"{failure['file']}: {failure['error']}" for failure in result['failures']))
+
+        # Associate each exam file with its student ID in the session
+        if 'pdf_mappings' not in session:
+            session['pdf_mappings'] = {}
+
+        render_jobs = []
+        for exam_path, student_exam in result['graded']:
+            session['pdf_mappings'][f"{student_exam.student_id}_{exam_id}"] = os.path.basename(exam_path)
+
+            if exam_path.lower().endswith('.pdf'):
+                answer_locations = PDFHighlighter.format_answers_for_highlighting(student_exam.to_dict())
+                render_jobs.append((exam_path, answer_locations, True))
+                render_jobs.append((exam_path, answer_locations, False))
+        session.modified = True
+
+        # Warm the highlight cache for the whole class
+        start_highlight_prerender(render_jobs)
+
+        for failure in result['failures']:
+            flash(f"Could not grade {failure['file']}: {failure['error']}")
+        flash('Analysis completed successfully')
+        return redirect(url_for('analysis.results', exam_id=exam_id))
+
+    except Exception as e:
+        flash(f'Error processing exams: {str(e)}')
+        return redirect(url_for('exams.list'))
 
-        # Process exam files
-        student_exams = []
-        for i, exam_file in enumerate(exam_files):
-            exam_path = os.path.join(current_app.config['EXAMS_DIR'], exam_file)
-            default_student_id = f"student_{i + 1:02d}"
 
-            # Process the exam
-            student_exam = processor.process_student_exam(exam_path, default_student_id, exam_id)
+@analysis_bp.route('/regrade/<exam_id>', methods=['POST'])
+def regrade(exam_id):
+    """Retry the failed parts of an exam, or re-evaluate the questions changed in a corrected answer key.
 
-            # Compare with answer key
-            student_exam = processor.compare_with_answer_key(student_exam, answer_key, "English")
+    Without an 'answer_key_file' only failed extractions and not evaluated
+    answers are retried.
+    """
+    answer_key_file = request.form.get('answer_key_file')
 
-            student_exams.append(student_exam)
+    try:
+        validate_exam_id(exam_id)
+    except ValueError as e:
+        flash(str(e))
+        return redirect(url_for('analysis.list'))
 
-            # Associate the exam file with the student ID in the session
-            if 'pdf_mappings' not in session:
-                session['pdf_mappings'] = {}
+    try:
+        regrader = Regrader(current_app.config)
+        if answer_key_file:
+            answer_key_path = os.path.join(current_app.config['ANSWERS_DIR'], secure_filename(answer_key_file))
+            if not os.path.exists(answer_key_path):
+                raise ValueError(f'Answer key file not found: {answer_key_file}')
+            summary = regrader.regrade_with_key_file(exam_id, answer_key_path)
+        else:
+            summary = regrader.regrade(exam_id)
+    except ValueError as e:
+        flash(str(e))
+        return redirect(url_for('analysis.results', exam_id=exam_id))
+    except Exception as e:
+        flash(f'Error regrading exam: {str(e)}')
+        return redirect(url_for('analysis.results', exam_id=exam_id))
 
-            session['pdf_mappings'][f"{student_exam.student_id}_{exam_id}"] = exam_file
-            session.modified = True
+    if answer_key_file:
+        diff = summary['diff']
+        flash(f"Answer key updated: {len(diff['changed'])} changed, {len(diff['added'])} added, "
+              f"{len(diff['removed'])} removed questions; re-evaluated {summary['evaluated']} of "
+              f"{summary['answers']} answers and cleared {summary['cleared']} answers to removed questions "
+              f"for {summary['students']} students")
+    elif summary['answers'] == 0:
+        flash('Nothing to regrade: every answer has been evaluated')
+    else:
+        flash(f"Regraded {summary['evaluated']} of {summary['answers']} answers for {summary['students']} students"
+              f" ({summary['reextracted']} exams re-extracted)")
+    return redirect(url_for('analysis.results', exam_id=exam_id))
 
-        # Analyze the exam results
-        analysis = analyzer.analyze_exam(exam_id, student_exams, answer_key)
 
-        flash('Analysis completed successfully')
-        return redirect(url_for('analysis.results', exam_id=exam_id))
+@analysis_bp.route('/usage')
+def usage_overview():
+    """Return model token usage and cost totals of every exam as JSON, most expensive first."""
+    directory = usage_dir(current_app.config)
+    exam_ids = sorted(f[:-len('.jsonl')] for f in os.listdir(directory) if f.endswith('.jsonl')) \
+        if os.path.isdir(directory) else []
 
-    except Exception as e:
-        flash(f'Error processing exams: {str(e)}')
-        return redirect(url_for('exams.list'))
+    exams = []
+    for exam_id in exam_ids:
+        report = usage_report(current_app.config, exam_id)
+        exams.append(dict(report['totals'], exam_id=exam_id, students=report['students'],
+                          cost_per_student=report['cost_per_student']))
+    exams.sort(key=lambda exam: exam['cost'], reverse=True)
+
+    return jsonify({'currency': current_app.config.get('GEMINI_PRICE_CURRENCY', 'USD'), 'exams': exams})
+
+
+@analysis_bp.route('/usage/<exam_id>')
+def usage(exam_id):
+    """Return the token usage and cost report of an exam as JSON (per stage, model, student and run)."""
+    try:
+        validate_exam_id(exam_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    report = usage_report(current_app.config, exam_id)
+    if report['totals']['calls'] == 0:
+        return jsonify({'error': f'No model usage recorded for exam {exam_id}'}), 404
+    return jsonify(report)
 
 
 @analysis_bp.route('/list')
 def list():
     """List all analysis results."""
-    results_dir = current_app.config['RESULTS_DIR']
-    analysis_files = [f for f in os.listdir(results_dir) if f.startswith('analysis_') and f.endswith('.json')]
-
     results = []
-    for file in analysis_files:
-        file_path = os.path.join(results_dir, file)
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-            exam_id = data.get('exam_id', 'Unknown')
-            student_count = data.get('student_count', 0)
-            question_count = len(data.get('questions', []))
-
-            results.append({
-                'exam_id': exam_id,
-                'student_count': student_count,
-                'question_count': question_count,
-                'filename': file
-            })
+    for file, data in get_result_store().iter_analyses():
+        exam_id = data.get('exam_id', 'Unknown')
+        student_count = data.get('student_count', 0)
+        question_count = len(data.get('questions', []))
+
+        results.append({
+            'exam_id': exam_id,
+            'student_count': student_count,
+            'question_count': question_count,
+            'filename': file
+        })
 
     return render_template('analysis/list.html', results=results)
 
 
+def queue_status(exam_id):
+    """Return the work queue progress of an exam, or None if the queue is off or has no tasks for it.
+
+    Returns:
+        dict: 'tasks' as (kind, {status: count}) rows in grading order, 'statuses',
+            'pending' (tasks not done or failed yet) and the 'failures'
+    """
+    if not current_app.config.get('WORK_QUEUE_ENABLED'):
+        return None
+    queue = WorkQueue.from_config(current_app.config)
+    try:
+        counts = queue.counts(exam_id)
+        failures = queue.failures(exam_id) if counts else []
+    finally:
+        queue.close()
+    if not counts:
+        return None
+
+    tasks = sorted(counts.items(), key=lambda row: PRIORITIES.get(row[0], len(PRIORITIES)))
+    pending = sum(statuses.get(QUEUED, 0) + statuses.get(LEASED, 0) for statuses in counts.values())
+    return {'tasks': tasks, 'statuses': (QUEUED, LEASED, DONE, FAILED), 'pending': pending, 'failures': failures}
+
+
 @analysis_bp.route('/results/<exam_id>')
 def results(exam_id):
     """Display analysis results for a specific exam."""
-    results_dir = current_app.config['RESULTS_DIR']
+    store = get_result_store()
     answers_dir = current_app.config['ANSWERS_DIR']
-    analysis_file = os.path.join(results_dir, f'analysis_{exam_id}.json')
+    analysis_data = store.load_analysis(exam_id)
 
-    if not os.path.exists(analysis_file):
+    if analysis_data is None:
+        queued = queue_status(exam_id)
+        if queued is not None:
+            return render_template('analysis/queued.html', exam_id=exam_id, **queued)
         flash(f'Analysis for exam {exam_id} not found')
         return redirect(url_for('analysis.list'))
 
-    with open(analysis_file, 'r') as f:
-        analysis_data = json.load(f)
-
     # Find answer key file if exists
     answer_key_file = None
 
@@ -120,28 +255,26 @@ def results(exam_id):
             break
 
     # Get student exams for this analysis
-    student_files = [f for f in os.listdir(results_dir) if
-                     f.endswith(f'_{exam_id}.json') and not f.startswith('analysis_') and not f.startswith('key_')]
-
     students = []
-    for file in student_files:
-        file_path = os.path.join(results_dir, file)
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-            students.append({
-                'student_id': data.get('student_id', 'Unknown'),
-                'student_name': data.get('student_name', 'Unknown'),
-                'score': data.get('score', 0)
-            })
+    for _, data in store.iter_student_data(exam_id):
+        students.append({
+            'student_id': data.get('student_id', 'Unknown'),
+            'student_name': data.get('student_name', 'Unknown'),
+            'score': data.get('score', 0)
+        })
 
     # Sort students by score (descending)
     students.sort(key=lambda x: x['score'], reverse=True)
 
+    # Answer key files offered for a key-change regrade
+    answer_files = sorted(f for f in os.listdir(answers_dir) if f.lower().endswith(('.pdf', '.jpg', '.jpeg', '.png')))
+
     return render_template('analysis/results.html',
                            exam_id=exam_id,
                            analysis=analysis_data,
                            students=students,
-                           answer_key_file=answer_key_file)
+                           answer_key_file=answer_key_file,
+                           answer_files=answer_files)
 
 
 # Updated route that handles PDF highlighting
@@ -153,47 +286,16 @@ def student_exam_pdf(student_id, exam_id):
     highlight_mode = request.args.get('mode', 'errors_only')
     errors_only = (highlight_mode == 'errors_only')
 
-    # Find student data
-    results_dir = current_app.config['RESULTS_DIR']
-    student_file = os.path.join(results_dir, f"{student_id}_{exam_id}.json")
+    # Load student data
+    student_data = get_result_store().load_student_data(student_id, exam_id)
 
-    if not os.path.exists(student_file):
+    if student_data is None:
         flash(f"Student exam not found")
         return redirect(url_for('analysis.results', exam_id=exam_id))
 
-    # Load student data
-    with open(student_file, 'r') as f:
-        student_data = json.load(f)
-
     # Find the original exam file
     exams_dir = current_app.config['EXAMS_DIR']
-    exam_file = None
-
-    # First check if we have a stored mapping for this student in the pdf_mappings
-    if 'pdf_mappings' in session and f"{student_id}_{exam_id}" in session['pdf_mappings']:
-        mapped_pdf = session['pdf_mappings'][f"{student_id}_{exam_id}"]
-        if os.path.exists(os.path.join(exams_dir, mapped_pdf)):
-            exam_file = mapped_pdf
-            current_app.logger.info(f"Using mapped PDF from processing: {exam_file}")
-
-    # If no mapping, check for manual selection
-    if not exam_file and 'pdf_selections' in session and f"{student_id}_{exam_id}" in session['pdf_selections']:
-        selected_pdf = session['pdf_selections'][f"{student_id}_{exam_id}"]
-        if os.path.exists(os.path.join(exams_dir, selected_pdf)):
-            exam_file = selected_pdf
-            current_app.logger.info(f"Using manually selected PDF: {exam_file}")
-
-    # Still no file? Try to find the best match automatically
-    if not exam_file:
-        best_match = find_best_matching_pdf(student_data, exam_id, exams_dir)
-        if best_match:
-            exam_file = best_match
-            # Store this match for future use
-            if 'pdf_mappings' not in session:
-                session['pdf_mappings'] = {}
-            session['pdf_mappings'][f"{student_id}_{exam_id}"] = exam_file
-            session.modified = True
-            current_app.logger.info(f"Automatically found matching PDF: {exam_file}")
+    exam_file = resolve_exam_file(student_data, exam_id, exams_dir)
 
     if not exam_file:
         flash(f"Exam PDF file not found for student {student_id}")
@@ -215,25 +317,24 @@ def student_exam_pdf(student_id, exam_id):
     # Get the path to the original PDF
     original_pdf_path = os.path.join(exams_dir, exam_file)
 
-    # Create highlighted PDF
+    # Create highlighted PDF (or reuse a cached render)
     try:
-        highlighted_pdf = PDFHighlighter.create_highlighted_pdf(
+        highlighted_path, cache_key = get_highlight_cache().get_or_render(
             original_pdf_path,
             answer_locations,
             errors_only=errors_only
         )
 
-        # Return the PDF as a response
-        response = make_response(highlighted_pdf)
-        response.headers['Content-Type'] = 'application/pdf'
-        response.headers['Content-Disposition'] = f'inline; filename="{student_id}_{exam_id}_highlighted.pdf"'
-
-        # Add cache-control headers to prevent caching issues
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
-
-        return response
+        # Stream the cached file; the cache key doubles as a strong ETag so
+        # browsers revalidate with If-None-Match and can fetch byte ranges
+        return send_file(
+            highlighted_path,
+            mimetype='application/pdf',
+            as_attachment=False,
+            download_name=f"{student_id}_{exam_id}_highlighted.pdf",
+            conditional=True,
+            etag=cache_key
+        )
 
     except Exception as e:
         current_app.logger.error(f"Error creating highlighted PDF: {str(e)}")
@@ -241,6 +342,36 @@ def student_exam_pdf(student_id, exam_id):
         return redirect(url_for('analysis.student_detail', student_id=student_id, exam_id=exam_id))
 
 
+def resolve_exam_file(student_data, exam_id, exams_dir):
+    """Find the exam PDF for a student from session selections, mappings or best match.
+
+    A manual selection wins over the mapping recorded when the exam was processed in
+    this session, which wins over the source file stored with the result; only when
+    none of these exist is the best fuzzy match used.
+
+    Args:
+        student_data (dict): Student data from JSON
+        exam_id (str): Exam ID
+        exams_dir (str): Directory containing exam PDFs
+
+    Returns:
+        str or None: Exam PDF filename or None if no file could be found
+    """
+    session_key = f"{student_data.get('student_id', '')}_{exam_id}"
+
+    for mapping_name in ('pdf_selections', 'pdf_mappings'):
+        mapped_pdf = session.get(mapping_name, {}).get(session_key)
+        if mapped_pdf and os.path.exists(os.path.join(exams_dir, mapped_pdf)):
+            return mapped_pdf
+
+    # Exams graded outside this session (e.g. by the CLI) record their source file
+    source_file = student_data.get('source_file')
+    if source_file and os.path.exists(os.path.join(exams_dir, source_file)):
+        return source_file
+
+    return find_best_matching_pdf(student_data, exam_id, exams_dir)
+
+
 def find_best_matching_pdf(student_data, exam_id, exams_dir):
     """Find the best matching PDF file for a student based on name and exam ID.
 
@@ -317,36 +448,16 @@ def download_highlighted_pdf(student_id, exam_id):
     highlight_mode = request.args.get('mode', 'errors_only')
     errors_only = (highlight_mode == 'errors_only')
 
-    # Find student data
-    results_dir = current_app.config['RESULTS_DIR']
-    student_file = os.path.join(results_dir, f"{student_id}_{exam_id}.json")
+    # Load student data
+    student_data = get_result_store().load_student_data(student_id, exam_id)
 
-    if not os.path.exists(student_file):
+    if student_data is None:
         flash(f"Student exam not found")
         return redirect(url_for('analysis.results', exam_id=exam_id))
 
-    # Load student data
-    with open(student_file, 'r') as f:
-        student_data = json.load(f)
-
     # Find the original exam file using the same logic as in student_exam_pdf
     exams_dir = current_app.config['EXAMS_DIR']
-    exam_file = None
-
-    # Check for mapping or selection
-    if 'pdf_mappings' in session and f"{student_id}_{exam_id}" in session['pdf_mappings']:
-        mapped_pdf = session['pdf_mappings'][f"{student_id}_{exam_id}"]
-        if os.path.exists(os.path.join(exams_dir, mapped_pdf)):
-            exam_file = mapped_pdf
-
-    if not exam_file and 'pdf_selections' in session and f"{student_id}_{exam_id}" in session['pdf_selections']:
-        selected_pdf = session['pdf_selections'][f"{student_id}_{exam_id}"]
-        if os.path.exists(os.path.join(exams_dir, selected_pdf)):
-            exam_file = selected_pdf
-
-    # Try to find a match
-    if not exam_file:
-        exam_file = find_best_matching_pdf(student_data, exam_id, exams_dir)
+    exam_file = resolve_exam_file(student_data, exam_id, exams_dir)
 
     if not exam_file:
         flash(f"Exam PDF file not found for student {student_id}")
@@ -358,28 +469,26 @@ def download_highlighted_pdf(student_id, exam_id):
     # Get the path to the original PDF
     original_pdf_path = os.path.join(exams_dir, exam_file)
 
-    # Create highlighted PDF
+    # Create highlighted PDF (or reuse a cached render)
     try:
-        highlighted_pdf = PDFHighlighter.create_highlighted_pdf(
+        highlighted_path, cache_key = get_highlight_cache().get_or_render(
             original_pdf_path,
             answer_locations,
             errors_only=errors_only
         )
 
-        # Create a file-like object for sending
-        pdf_file = io.BytesIO(highlighted_pdf)
-        pdf_file.seek(0)
-
         mode_text = "errors" if errors_only else "all_answers"
         filename = f"{student_data.get('student_name', student_id)}_{exam_id}_{mode_text}.pdf"
         filename = secure_filename(filename)
 
         # Return as attachment (download)
         return send_file(
-            pdf_file,
+            highlighted_path,
             mimetype='application/pdf',
             as_attachment=True,
-            download_name=filename
+            download_name=filename,
+            conditional=True,
+            etag=cache_key
         )
 
     except Exception as e:
@@ -388,75 +497,83 @@ def download_highlighted_pdf(student_id, exam_id):
         return redirect(url_for('analysis.student_detail', student_id=student_id, exam_id=exam_id))
 
 
+@analysis_bp.route('/export/<exam_id>')
+def export_highlighted_pdfs(exam_id):
+    """Download all students' highlighted PDFs for an exam as a streamed ZIP."""
+
+    # Get highlight_mode from query parameters (errors_only, all or both)
+    highlight_mode = request.args.get('mode', 'errors_only')
+    if highlight_mode == 'both':
+        modes = [('errors', True), ('all_answers', False)]
+        mode_text = 'highlighted'
+    elif highlight_mode == 'errors_only':
+        modes = [('errors', True)]
+        mode_text = 'errors'
+    else:
+        modes = [('all_answers', False)]
+        mode_text = 'all_answers'
+
+    store = get_result_store()
+    exams_dir = current_app.config['EXAMS_DIR']
+
+    if not store.list_student_files(exam_id):
+        flash(f'No student results found for exam {exam_id}')
+        return redirect(url_for('analysis.results', exam_id=exam_id))
+
+    # Resolve everything that needs the request context before streaming starts
+    jobs = []
+    for file, student_data in store.iter_student_data(exam_id):
+        exam_file = resolve_exam_file(student_data, exam_id, exams_dir)
+        if not exam_file:
+            current_app.logger.warning(f"No exam PDF found for {file}, skipping in export")
+            continue
+
+        student_id = student_data.get('student_id', 'unknown')
+        name = secure_filename(f"{student_data.get('student_name') or student_id}_{student_id}_{exam_id}.pdf")
+        jobs.append({
+            'name': name,
+            'original_pdf_path': os.path.join(exams_dir, exam_file),
+            'answer_locations': PDFHighlighter.format_answers_for_highlighting(student_data)
+        })
+
+    current_app.logger.info(f"Exporting {len(jobs)} highlighted PDFs for exam {exam_id} ({highlight_mode})")
+
+    archive_stream = stream_highlighted_zip(
+        jobs,
+        current_app.config['HIGHLIGHT_CACHE_DIR'],
+        modes,
+        max_workers=current_app.config.get('RENDER_WORKERS')
+    )
+
+    filename = secure_filename(f"{exam_id}_{mode_text}.zip")
+    return Response(
+        archive_stream,
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
 @analysis_bp.route('/report/<exam_id>')
 def report(exam_id):
     """Generate a detailed report for a specific exam."""
-    results_dir = current_app.config['RESULTS_DIR']
-    analysis_file = os.path.join(results_dir, f'analysis_{exam_id}.json')
+    store = get_result_store()
+    analysis_data = store.load_analysis(exam_id)
 
-    if not os.path.exists(analysis_file):
+    if analysis_data is None:
+        queued = queue_status(exam_id)
+        if queued is not None:
+            return render_template('analysis/queued.html', exam_id=exam_id, **queued)
         flash(f'Analysis for exam {exam_id} not found')
         return redirect(url_for('analysis.list'))
 
-    with open(analysis_file, 'r') as f:
-        analysis_data = json.load(f)
-
     # Initialize analyzer
     analyzer = ExamAnalyzer()
 
-    # Get student exams and answer key
-    student_exams = []
-    answer_key = None
-
-    student_files = [f for f in os.listdir(results_dir) if
-                     f.endswith(f'_{exam_id}.json') and not f.startswith('analysis_') and not f.startswith('key_')]
-    key_file = os.path.join(results_dir, f'key_{exam_id}.json')
-
-    # Load answer key if exists
-    if os.path.exists(key_file):
-        with open(key_file, 'r') as f:
-            key_data = json.load(f)
-            # Create AnswerKey object
-            from app.models.data_model import AnswerKey
-            answer_key = AnswerKey(exam_id=exam_id, answers=key_data.get('answers', {}))
-
-    # Load student exams
-    for file in student_files:
-        file_path = os.path.join(results_dir, file)
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-
-            # Create StudentExam object
-            from app.models.data_model import StudentExam, QuestionAnswer
-            student_exam = StudentExam(
-                student_id=data.get('student_id', 'Unknown'),
-                exam_id=exam_id,
-                student_name=data.get('student_name', 'Unknown'),
-                score=data.get('score', 0)
-            )
-
-            # Add answers
-            for ans_data in data.get('answers', []):
-                answer = QuestionAnswer(
-                    question_number=ans_data.get('question_number', ''),
-                    answer_text=ans_data.get('answer_text', ''),
-                    is_correct=ans_data.get('is_correct', None),
-                    error_type=ans_data.get('error_type', None),
-                    evaluation_reason=ans_data.get('evaluation_reason', None),
-                    learning_topics=ans_data.get('learning_topics', []),
-                    reference_to_answer=ans_data.get('reference_to_answer', None),
-                    misconception=ans_data.get('misconception', None)
-                )
-                student_exam.answers.append(answer)
-
-            student_exams.append(student_exam)
-
-    # Create ExamAnalysis object with loaded data
-    from app.models.data_model import ExamAnalysis
+    # Create ExamAnalysis object with the stored answer key and student results
     analysis = ExamAnalysis(
         exam_id=exam_id,
-        student_exams=student_exams,
-        answer_key=answer_key,
+        student_exams=store.load_student_exams(exam_id),
+        answer_key=store.load_answer_key(exam_id),
         question_difficulty=analysis_data.get('question_difficulty', {}),
         error_patterns=analysis_data.get('error_patterns', {})
     )
@@ -502,53 +619,95 @@ def report(exam_id):
 def student_detail(student_id, exam_id):
     """Show detailed analysis for a specific student's exam."""
 
-    results_dir = current_app.config['RESULTS_DIR']
-    student_file = os.path.join(results_dir, f"{student_id}_{exam_id}.json")
+    student_data = get_result_store().load_student_data(student_id, exam_id)
 
-    if not os.path.exists(student_file):
+    if student_data is None:
         flash(f"Student exam not found")
         return redirect(url_for('analysis.results', exam_id=exam_id))
 
-    with open(student_file, 'r') as f:
-        student_data = json.load(f)
-
     # Find the original exam file automatically
     exams_dir = current_app.config['EXAMS_DIR']
 
     # Get all available PDF files
     all_pdfs = [f for f in os.listdir(exams_dir) if f.endswith('.pdf')]
 
-    # Check for automatic mapping from processing
-    exam_file = None
-    if 'pdf_mappings' in session and f"{student_id}_{exam_id}" in session['pdf_mappings']:
-        mapped_pdf = session['pdf_mappings'][f"{student_id}_{exam_id}"]
-        if os.path.exists(os.path.join(exams_dir, mapped_pdf)):
-            exam_file = mapped_pdf
-            current_app.logger.info(f"Using PDF mapping: {exam_file}")
-
-    # If there's a manual selection already, use that instead
-    if 'pdf_selections' in session and f"{student_id}_{exam_id}" in session['pdf_selections']:
-        selected_pdf = session['pdf_selections'][f"{student_id}_{exam_id}"]
-        if os.path.exists(os.path.join(exams_dir, selected_pdf)):
-            exam_file = selected_pdf
-            current_app.logger.info(f"Using manual PDF selection: {exam_file}")
-
-    # If no PDF is associated yet, find the best match
-    if not exam_file:
-        exam_file = find_best_matching_pdf(student_data, exam_id, exams_dir)
-        if exam_file:
-            # Store this match for future use
-            if 'pdf_mappings' not in session:
-                session['pdf_mappings'] = {}
-            session['pdf_mappings'][f"{student_id}_{exam_id}"] = exam_file
-            session.modified = True
-            current_app.logger.info(f"Automatically matched PDF: {exam_file}")
+    exam_file = resolve_exam_file(student_data, exam_id, exams_dir)
+
+    # Page count drives the lightweight per-page previews; it comes from the upload-time sidecar
+    page_count = 0
+    if exam_file and exam_file.lower().endswith('.pdf'):
+        metadata = metadata_index_for(current_app.config, 'exam').get_or_compute(exam_file)
+        if metadata:
+            page_count = metadata['page_count']
 
     return render_template('analysis/student_detail.html',
                            student=student_data,
                            exam_id=exam_id,
                            exam_file=exam_file,
-                           all_pdfs=all_pdfs)
+                           all_pdfs=all_pdfs,
+                           page_count=page_count,
+                           preview_dpi=current_app.config['PREVIEW_DPI'])
+
+
+@analysis_bp.route('/student/<student_id>/<exam_id>/page/<int:page_number>')
+def exam_page_image(student_id, exam_id, page_number):
+    """Serve a single exam page as a cached PNG/WebP image."""
+
+    # variant: original, errors_only or all
+    variant = request.args.get('variant', 'errors_only')
+    image_format = request.args.get('format', 'png').lower()
+    if image_format not in IMAGE_FORMATS:
+        return f"Unsupported format: {image_format}", 400
+
+    try:
+        dpi = int(request.args.get('dpi', current_app.config['PREVIEW_DPI']))
+    except ValueError:
+        return "Invalid dpi", 400
+    dpi = max(36, min(dpi, current_app.config['MAX_PREVIEW_DPI']))
+
+    exams_dir = current_app.config['EXAMS_DIR']
+    student_data = get_result_store().load_student_data(student_id, exam_id)
+
+    if student_data is None:
+        return "Student exam not found", 404
+
+    exam_file = resolve_exam_file(student_data, exam_id, exams_dir)
+    if not exam_file or not exam_file.lower().endswith('.pdf'):
+        return "No PDF file found", 404
+
+    # Reject out-of-range pages without opening or highlighting the PDF
+    metadata = metadata_index_for(current_app.config, 'exam').get(exam_file)
+    if metadata and not 1 <= page_number <= metadata['page_count']:
+        return f"Page {page_number} out of range (1-{metadata['page_count']})", 404
+
+    pdf_path = os.path.join(exams_dir, exam_file)
+
+    try:
+        if variant in ('errors_only', 'all'):
+            answer_locations = PDFHighlighter.format_answers_for_highlighting(student_data)
+            pdf_path, _ = get_highlight_cache().get_or_render(
+                pdf_path,
+                answer_locations,
+                errors_only=(variant == 'errors_only')
+            )
+
+        image_path, cache_key = PageRenderer(current_app.config['PAGE_CACHE_DIR'], current_app.config).render_page(
+            pdf_path, page_number, dpi=dpi, image_format=image_format)
+
+    except ValueError as e:
+        return str(e), 404
+    except Exception as e:
+        current_app.logger.error(f"Error rendering page preview: {str(e)}")
+        return f"Error: {str(e)}", 500
+
+    # Page images are content-addressed, so browsers may keep them for a while
+    return send_file(
+        image_path,
+        mimetype=IMAGE_FORMATS[image_format],
+        conditional=True,
+        etag=cache_key,
+        max_age=3600
+    )
 
 
 @analysis_bp.route('/student/<student_id>/<exam_id>/select-pdf')
@@ -592,33 +751,10 @@ def original_exam_pdf(student_id, exam_id):
     # Debug logging
     print(f"Serving original PDF for student: {student_id}, exam: {exam_id}")
 
-    # Check for automatic mapping from processing
-    if 'pdf_mappings' in session and f"{student_id}_{exam_id}" in session['pdf_mappings']:
-        mapped_pdf = session['pdf_mappings'][f"{student_id}_{exam_id}"]
-        if os.path.exists(os.path.join(exams_dir, mapped_pdf)):
-            exam_file = mapped_pdf
-            print(f"Using PDF mapping: {exam_file}")
-
-    # Check if we have a stored manual selection for this student
-    if not exam_file and 'pdf_selections' in session and f"{student_id}_{exam_id}" in session['pdf_selections']:
-        selected_pdf = session['pdf_selections'][f"{student_id}_{exam_id}"]
-        if os.path.exists(os.path.join(exams_dir, selected_pdf)):
-            exam_file = selected_pdf
-            print(f"Using selected PDF: {exam_file}")
-
-    # Try to find best match
-    if not exam_file:
-        # Find student data
-        results_dir = current_app.config['RESULTS_DIR']
-        student_file = os.path.join(results_dir, f"{student_id}_{exam_id}.json")
-
-        if os.path.exists(student_file):
-            with open(student_file, 'r') as f:
-                student_data = json.load(f)
-
-            exam_file = find_best_matching_pdf(student_data, exam_id, exams_dir)
-            if exam_file:
-                print(f"Using best matching PDF: {exam_file}")
+    student_data = get_result_store().load_student_data(student_id, exam_id)
+    if student_data is not None:
+        exam_file = resolve_exam_file(student_data, exam_id, exams_dir)
+        print(f"Using PDF: {exam_file}")
 
     if not exam_file:
         print("No matching PDF file found")
@@ -642,31 +778,17 @@ def original_exam_pdf(student_id, exam_id):
 
         print(f"File exists with size: {file_size} bytes")
 
-        # IMPORTANT: Read the file into memory first, just like the download route does
-        with open(original_pdf_path, 'rb') as file:
-            pdf_data = file.read()
-
-        print(f"Successfully read {len(pdf_data)} bytes of PDF data")
-
-        # Create a BytesIO object to serve the file from memory
-        pdf_io = io.BytesIO(pdf_data)
-        pdf_io.seek(0)
-
-        # Return using send_file with the in-memory file
-        response = send_file(
-            pdf_io,
+        # Stream straight from disk; send_file handles ETag/Last-Modified,
+        # If-None-Match/If-Modified-Since and HTTP Range requests for us
+        return send_file(
+            original_pdf_path,
             mimetype='application/pdf',
             as_attachment=False,
-            download_name=f"{student_id}_{exam_id}_original.pdf"
+            download_name=f"{student_id}_{exam_id}_original.pdf",
+            conditional=True,
+            etag=True
         )
 
-        # Add cache-control headers to prevent caching issues
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
-
-        return response
-
     except Exception as e:
         print(f"Error serving PDF: {str(e)}")
         return f"Error: {str(e)}", 500
\ No newline at end of file
@@ -1,10 +1,15 @@
 # app/routes/exams.py
 import os
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, jsonify
 from werkzeug.utils import secure_filename
 import json
 import logging
-from app.utils.file_utils import convert_image_to_pdf
+from app.utils.file_utils import convert_image_to_pdf, stream_to_temp_file, unique_path
+from app.utils.hash_index import HashIndex
+from app.utils import background
+from app.services.chunked_upload import ChunkedUploadStore, OffsetMismatchError, FILE_TYPES
+from app.services.batch_splitter import BatchSplitter
+from app.services.pdf_metadata import metadata_index_for
 
 exams_bp = Blueprint('exams', __name__)
 logger = logging.getLogger(__name__)
@@ -16,6 +21,138 @@ def allowed_file(filename):
         filename.rsplit('.', 1)[1].lower() in {'jpg', 'jpeg', 'png', 'pdf'}
 
 
+def get_upload_dir(file_type):
+    """Return the directory uploads of the given type ('exam' or 'answer') are stored in."""
+    if file_type not in FILE_TYPES:
+        raise ValueError(f"Unknown file type {file_type!r}, expected one of {', '.join(FILE_TYPES)}")
+    if file_type == 'exam':
+        return current_app.config['EXAMS_DIR']
+    return current_app.config['ANSWERS_DIR']
+
+
+def get_hash_index(file_type):
+    """Return the content-hash index used to deduplicate uploads of the given type."""
+    return HashIndex(
+        os.path.join(current_app.config['INDEX_DIR'], f"{file_type}_hashes.json"),
+        get_upload_dir(file_type)
+    )
+
+
+def index_pdf_metadata(metadata_index, filename, sha256=None):
+    """Compute the metadata sidecar for a stored PDF, logging instead of failing the upload."""
+    try:
+        return metadata_index.put(filename, sha256)
+    except Exception as e:
+        logger.warning(f"Could not compute PDF metadata for {filename}: {str(e)}")
+        return None
+
+
+def _convert_and_index(image_path, save_dir, sha256, hash_index, original_filename, metadata_index=None):
+    """Convert an uploaded image to PDF and index the result (runs in the background)."""
+    pdf_path = convert_image_to_pdf(image_path, save_dir)
+    with hash_index.lock():
+        hash_index.add(sha256, os.path.basename(pdf_path), original_filename=original_filename)
+    if metadata_index is not None:
+        index_pdf_metadata(metadata_index, os.path.basename(pdf_path))
+    logger.info(f"Converted image {os.path.basename(image_path)} to PDF {os.path.basename(pdf_path)}")
+    return pdf_path
+
+
+def register_stored_file(temp_path, sha256, size, filename, file_type, original_filename=None):
+    """Move a fully received upload into place, deduplicating it by content hash.
+
+    Byte-identical uploads are dropped in favour of the stored copy, and
+    images are queued for PDF conversion off the request thread. PDFs get
+    their metadata sidecar (page count, page sizes, text layer) computed once here.
+
+    Args:
+        temp_path (str): Path of the received file, on the same filesystem as the upload dir
+        sha256 (str): Hex SHA-256 digest of the file content
+        size (int): Size in bytes
+        filename (str): Sanitized target filename
+        file_type (str): 'exam' or 'answer'
+        original_filename (str, optional): Filename as sent by the client
+
+    Returns:
+        dict: Upload outcome with 'filename', 'status' (uploaded, converting,
+            duplicate or error) and 'message'
+    """
+    save_dir = get_upload_dir(file_type)
+    original_filename = original_filename or filename
+    name, file_ext = os.path.splitext(filename)
+    is_image = file_ext.lower() in ['.jpg', '.jpeg', '.png']
+
+    # The index lock spans the lookup, the move into place and the index entry, so processes
+    # storing the same content (web workers, the exam watcher) can't both miss the lookup
+    hash_index = get_hash_index(file_type)
+    with hash_index.lock():
+        existing = hash_index.lookup(sha256)
+        if existing:
+            os.remove(temp_path)
+            logger.info(f"Skipping duplicate upload {filename} (same content as {existing['filename']})")
+            return {
+                'filename': filename,
+                'status': 'duplicate',
+                'duplicate_of': existing['filename'],
+                'sha256': sha256,
+                'message': f'{filename} is identical to already uploaded {existing["filename"]}'
+            }
+
+        # Never overwrite another upload that happens to have the same name
+        file_path = unique_path(save_dir, filename, extensions=('.pdf',) if is_image else ())
+        if os.path.basename(file_path) != filename:
+            logger.info(f"{filename} already exists with other content, storing as {os.path.basename(file_path)}")
+            filename = os.path.basename(file_path)
+            name, file_ext = os.path.splitext(filename)
+        os.replace(temp_path, file_path)
+        # Images are indexed under their own name until the background conversion indexes the PDF
+        hash_index.add(sha256, filename, original_filename=original_filename)
+
+    # Check if it's an image file that needs to be converted to PDF
+    if is_image:
+        background.submit(_convert_and_index, file_path, save_dir, sha256, hash_index, original_filename,
+                          metadata_index_for(current_app.config, file_type),
+                          description=f"convert {filename} to PDF")
+        return {
+            'filename': f"{name}.pdf",
+            'status': 'converting',
+            'sha256': sha256,
+            'size': size,
+            'message': f'Image {filename} queued for conversion to {name}.pdf'
+        }
+
+    metadata = index_pdf_metadata(metadata_index_for(current_app.config, file_type), filename, sha256)
+    return {
+        'filename': filename,
+        'status': 'uploaded',
+        'sha256': sha256,
+        'size': size,
+        'page_count': metadata['page_count'] if metadata else None,
+        'message': f'File uploaded successfully: {filename}'
+    }
+
+
+def store_uploaded_file(file, file_type):
+    """Stream an uploaded file to disk, hashing it in the same pass, and register it.
+
+    Args:
+        file (FileStorage): The uploaded file
+        file_type (str): 'exam' or 'answer'
+
+    Returns:
+        dict: Upload outcome, see register_stored_file
+    """
+    filename = secure_filename(file.filename)
+
+    try:
+        temp_path, sha256, size = stream_to_temp_file(
+            file.stream, get_upload_dir(file_type), max_size=current_app.config['MAX_UPLOAD_FILE_SIZE'])
+    except ValueError as e:
+        return {'filename': filename, 'status': 'error', 'message': str(e)}
+
+    return register_stored_file(temp_path, sha256, size, filename, file_type, file.filename)
+
+
 @exams_bp.route('/upload', methods=['GET', 'POST'])
 def upload():
     """Upload exam files or answer keys."""
@@ -29,52 +166,21 @@ def upload():
         file_type = request.form.get('file_type', 'exam')  # 'exam' or 'answer'
         exam_id = request.form.get('exam_id', 'default_exam')
 
+        if file_type not in FILE_TYPES:
+            flash(f'Unknown file type: {file_type}')
+            return render_template('exams/upload.html'), 400
+
         # If user does not select file, browser also submits an empty part without filename
         if file.filename == '':
             flash('No selected file')
             return redirect(request.url)
 
-        # Check file size (limit to 10MB)
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        file.seek(0)
-
-        if file_size > 10 * 1024 * 1024:  # 10MB limit
-            flash('File too large. Maximum size is 10MB')
-            return redirect(request.url)
-
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
+            result = store_uploaded_file(file, file_type)
+            flash(result['message'])
 
-            # Determine the save directory based on file type
-            if file_type == 'exam':
-                save_dir = current_app.config['EXAMS_DIR']
-            else:  # answer key
-                save_dir = current_app.config['ANSWERS_DIR']
-
-            # Save the file initially
-            file_path = os.path.join(save_dir, filename)
-            file.save(file_path)
-
-            # Check if it's an image file that needs to be converted to PDF
-            file_ext = os.path.splitext(filename)[1].lower()
-            if file_ext in ['.jpg', '.jpeg', '.png']:
-                try:
-                    # Convert the image to PDF
-                    pdf_path = convert_image_to_pdf(file_path, save_dir)
-                    pdf_filename = os.path.basename(pdf_path)
-
-                    # Log success
-                    logger.info(f"Converted image {filename} to PDF {pdf_filename}")
-                    flash(f'Image converted to PDF successfully: {pdf_filename}')
-
-                except Exception as e:
-                    logger.error(f"Failed to convert image to PDF: {str(e)}")
-                    flash(f'Error converting image to PDF: {str(e)}')
-                    # Keep the original image if conversion fails
-                    return redirect(request.url)
-            else:
-                flash(f'File uploaded successfully: {filename}')
+            if result['status'] == 'error':
+                return redirect(request.url)
 
             # Redirect based on the file type
             if file_type == 'exam':
@@ -85,6 +191,229 @@ def upload():
     return render_template('exams/upload.html')
 
 
+@exams_bp.route('/upload-batch', methods=['POST'])
+def upload_batch():
+    """Upload many exam files or answer keys in one request."""
+    files = [f for f in request.files.getlist('files') if f and f.filename]
+    file_type = request.form.get('file_type', 'exam')  # 'exam' or 'answer'
+
+    if file_type not in FILE_TYPES:
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'error': f'Unknown file type: {file_type}'}), 400
+        flash(f'Unknown file type: {file_type}')
+        return render_template('exams/upload.html'), 400
+
+    if not files:
+        flash('No selected files')
+        return redirect(url_for('exams.upload'))
+
+    results = []
+    for file in files:
+        if not allowed_file(file.filename):
+            results.append({'filename': file.filename, 'status': 'error',
+                            'message': f'File type not allowed: {file.filename}'})
+            continue
+        results.append(store_uploaded_file(file, file_type))
+
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    logger.info(f"Batch upload of {len(files)} {file_type} files: {counts}")
+
+    # Scripted clients get the per-file outcome as JSON
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'results': results, 'counts': counts})
+
+    flash(f"Uploaded {counts.get('uploaded', 0) + counts.get('converting', 0)} files, "
+          f"skipped {counts.get('duplicate', 0)} duplicates, {counts.get('error', 0)} errors")
+    for result in results:
+        if result['status'] in ('duplicate', 'error'):
+            flash(result['message'])
+
+    if file_type == 'exam':
+        return redirect(url_for('exams.list'))
+    return redirect(url_for('analysis.list'))
+
+
+def get_chunked_upload_store():
+    """Return the chunked upload store for the current application."""
+    return ChunkedUploadStore(current_app.config['UPLOADS_DIR'],
+                              max_size=current_app.config['MAX_CHUNKED_UPLOAD_SIZE'])
+
+
+@exams_bp.route('/uploads', methods=['POST'])
+def chunked_upload_init():
+    """Start a chunked, resumable upload.
+
+    Expects JSON with 'filename', 'size' and optionally 'file_type'.
+    """
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename', ''))
+    file_type = data.get('file_type', 'exam')
+
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'A PDF or image filename is required'}), 400
+
+    store = get_chunked_upload_store()
+    store.cleanup_stale(current_app.config['CHUNKED_UPLOAD_EXPIRY'])
+
+    try:
+        upload = store.create(filename, int(data.get('size', 0)), file_type)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    upload['chunk_size'] = current_app.config['UPLOAD_CHUNK_SIZE']
+    return jsonify(upload), 201
+
+
+@exams_bp.route('/uploads/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    """Report how much of an upload has been received, so clients can resume."""
+    upload = get_chunked_upload_store().status(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    upload['chunk_size'] = current_app.config['UPLOAD_CHUNK_SIZE']
+    return jsonify(upload)
+
+
+@exams_bp.route('/uploads/<upload_id>', methods=['PUT'])
+def chunked_upload_chunk(upload_id):
+    """Write one chunk; the body is the raw bytes and ?offset= gives its position."""
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({'error': 'offset query parameter is required'}), 400
+
+    try:
+        new_offset = get_chunked_upload_store().write_chunk(upload_id, offset, request.stream)
+    except KeyError:
+        return jsonify({'error': 'Upload not found'}), 404
+    except OffsetMismatchError as e:
+        # Tell the client where to resume from
+        return jsonify({'error': str(e), 'offset': e.expected_offset}), 409
+    except TimeoutError as e:
+        # An earlier request for this upload (e.g. the timed out original of a resent chunk) is still running
+        return jsonify({'error': str(e)}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'upload_id': upload_id, 'offset': new_offset})
+
+
+@exams_bp.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def chunked_upload_finalize(upload_id):
+    """Verify the checksum of a completed upload and store it like a regular upload."""
+    data = request.get_json(silent=True) or {}
+
+    def handoff(part_path, upload, sha256):
+        return register_stored_file(part_path, sha256, upload['size'], upload['filename'], upload['file_type'])
+
+    try:
+        result = get_chunked_upload_store().finalize(upload_id, handoff, data.get('sha256'))
+    except KeyError:
+        return jsonify({'error': 'Upload not found'}), 404
+    except TimeoutError as e:
+        return jsonify({'error': str(e)}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    logger.info(f"Chunked upload {upload_id}: {result['message']}")
+    return jsonify(result)
+
+
+@exams_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+def chunked_upload_abort(upload_id):
+    """Abandon an upload and discard the received data."""
+    try:
+        get_chunked_upload_store().abort(upload_id)
+    except TimeoutError as e:
+        return jsonify({'error': str(e)}), 409
+    return '', 204
+
+
+@exams_bp.route('/split', methods=['POST'])
+def split_batch():
+    """Split a whole-class scan PDF into per-student exam PDFs."""
+    batch_file = request.form.get('batch_file', '')
+    strategy = request.form.get('strategy', 'fixed')
+    delete_original = request.form.get('delete_original') == 'on'
+    wants_json = request.accept_mimetypes.best == 'application/json'
+
+    exams_dir = current_app.config['EXAMS_DIR']
+    filename = secure_filename(batch_file)
+    batch_path = os.path.join(exams_dir, filename)
+
+    try:
+        if not filename.lower().endswith('.pdf') or not os.path.exists(batch_path):
+            raise ValueError(f"Batch PDF not found: {batch_file}")
+
+        pages_per_student = request.form.get('pages_per_student')
+        pages_per_student = int(pages_per_student) if pages_per_student else None
+
+        # The index lock spans writing and indexing the parts, so their names and the duplicate
+        # check can't race with uploads or the exam watcher
+        hash_index = get_hash_index('exam')
+        with hash_index.lock():
+            parts = BatchSplitter().split(batch_path, exams_dir, strategy, pages_per_student)
+
+            # Parts identical to an exam that is already stored are reported instead of kept twice
+            for part in parts:
+                existing = hash_index.lookup(part['sha256'])
+                if existing:
+                    os.remove(part['path'])
+                    logger.info(f"Dropping split part {part['filename']} (same content as {existing['filename']})")
+                    part['status'] = 'duplicate'
+                    part['duplicate_of'] = existing['filename']
+                else:
+                    hash_index.add(part['sha256'], part['filename'], original_filename=filename, split_from=filename)
+                    part['status'] = 'stored'
+
+    except ValueError as e:
+        if wants_json:
+            return jsonify({'error': str(e)}), 400
+        flash(f'Could not split {batch_file}: {str(e)}')
+        return redirect(url_for('exams.list'))
+
+    metadata_index = metadata_index_for(current_app.config, 'exam')
+    stored = [part for part in parts if part['status'] == 'stored']
+    for part in stored:
+        index_pdf_metadata(metadata_index, part['filename'], part['sha256'])
+
+    if delete_original and parts:
+        os.remove(batch_path)
+        metadata_index.remove(filename)
+
+    duplicates = len(parts) - len(stored)
+    logger.info(f"Split {filename} into {len(parts)} exams using '{strategy}' ({duplicates} duplicates)")
+
+    if wants_json:
+        return jsonify({'batch_file': filename, 'strategy': strategy,
+                        'parts': [{k: v for k, v in part.items() if k != 'path'} for part in parts]})
+
+    flash(f'Split {filename} into {len(parts)} student exams')
+    for part in parts:
+        if part['status'] == 'duplicate':
+            flash(f"Part {part['filename']} (pages {part['pages'][0]}-{part['pages'][1]}) "
+                  f"is identical to already uploaded {part['duplicate_of']}")
+    return redirect(url_for('exams.list'))
+
+
+@exams_bp.route('/metadata/<file_type>/<filename>')
+def file_metadata(file_type, filename):
+    """Return the metadata sidecar of an uploaded PDF as JSON."""
+    if file_type not in FILE_TYPES:
+        return jsonify({'error': f'Unknown file type: {file_type}'}), 400
+
+    filename = secure_filename(filename)
+    if not filename.lower().endswith('.pdf'):
+        return jsonify({'error': 'Metadata is only available for PDF files'}), 400
+
+    metadata = metadata_index_for(current_app.config, file_type).get_or_compute(filename)
+    if metadata is None:
+        return jsonify({'error': f'File not found: {filename}'}), 404
+    return jsonify(dict(metadata, filename=filename))
+
+
 @exams_bp.route('/list')
 def list():
     """List all uploaded exam files."""
@@ -1,9 +1,18 @@
 # app/routes/main.py
-from flask import Blueprint, render_template, current_app
+from flask import Blueprint, render_template, current_app, Response, abort
+
+from app.utils.metrics import REGISTRY
 
 main_bp = Blueprint('main', __name__)
 
 @main_bp.route('/')
 def index():
     """Home page."""
-    return render_template('index.html')
\ No newline at end of file
+    return render_template('index.html')
+
+@main_bp.route('/metrics')
+def metrics():
+    """Stage timings, call counts and cache hits in the Prometheus text format."""
+    if not current_app.config.get('METRICS_ENABLED', True):
+        abort(404)
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
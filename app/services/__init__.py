@@ -1,14 +1,27 @@
 # app/services/__init__.py
-# This file marks the services directory as a Python package
-# Import major service components for easier access
-# app/services/__init__.py
-# This file makes the services directory a Python package
-from .vision_api import GeminiVisionAPI
-from .exam_processor import ExamProcessor
-from .analyzer import ExamAnalyzer
-from .pdf_highlighter import PDFHighlighter
-from app.services.vision_api import GeminiVisionAPI
-from app.services.exam_processor import ExamProcessor
-from app.services.analyzer import ExamAnalyzer
-
-__all__ = ['GeminiVisionAPI', 'ExamProcessor', 'ExamAnalyzer', 'PDFHighlighter']
\ No newline at end of file
+# This file makes the services directory a Python package.
+# The major service classes are importable from here, but their modules (and
+# google.generativeai, PyMuPDF and Pillow with them) are only loaded on first use.
+import importlib
+
+_LAZY_EXPORTS = {
+    'GeminiVisionAPI': 'app.services.vision_api',
+    'ExamProcessor': 'app.services.exam_processor',
+    'ExamAnalyzer': 'app.services.analyzer',
+    'PDFHighlighter': 'app.services.pdf_highlighter',
+}
+
+__all__ = ['GeminiVisionAPI', 'ExamProcessor', 'ExamAnalyzer', 'PDFHighlighter']
+
+
+def __getattr__(name):
+    module_name = _LAZY_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
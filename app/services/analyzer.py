@@ -2,7 +2,6 @@ import os
 import json
 import logging
 import re
-import google.generativeai as genai
 from collections import defaultdict, Counter
 from typing import Dict, List, Optional, Set, Any
 import sys
@@ -10,8 +9,9 @@ import sys
 # Add parent directory to path to import config and other modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from app.models.data_model import StudentExam, AnswerKey, ExamAnalysis
-
-from flask import current_app
+from app.services.result_store import ResultStore
+from app.services.model_calls import get_model, generate_content, retry_settings
+from app.utils.metrics import track
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +19,17 @@ logger = logging.getLogger(__name__)
 class ExamAnalyzer:
     """Analyzer for exam results to find patterns and generate insights."""
 
+    def __init__(self, config=None):
+        """Initialize the analyzer.
+
+        Args:
+            config (dict, optional): Configuration to use instead of the Flask app config
+        """
+        if config is None:
+            from flask import current_app
+            config = current_app.config
+        self.config = config
+
     def analyze_exam(self, exam_id: str, student_exams: List[StudentExam], answer_key: AnswerKey) -> ExamAnalysis:
         """Analyze the exam results across all students.
 
@@ -52,11 +63,60 @@ class ExamAnalyzer:
         self._sort_analysis_by_question_number(analysis)
 
         # Save the analysis
-        save_path = analysis.save(current_app.config['RESULTS_DIR'])
+        save_path = ResultStore.from_config(self.config).save_analysis(analysis)
         logger.info(f"Saved exam analysis to {save_path}")
 
         return analysis
 
+    def update_analysis(self, exam_id: str, student_exams: List[StudentExam], answer_key: AnswerKey,
+                        changed_questions) -> ExamAnalysis:
+        """Refresh a stored analysis after some answers were re-evaluated.
+
+        Difficulty is cheap and recomputed for every question; error patterns are
+        only regrouped with Gemini for the changed questions, the stored groups of
+        all other questions are kept.
+
+        Args:
+            exam_id (str): ID of the exam
+            student_exams (List[StudentExam]): All student exams, including the updated ones
+            answer_key (AnswerKey): The answer key
+            changed_questions (iterable): Question numbers whose answers changed
+
+        Returns:
+            ExamAnalysis: The updated exam analysis
+        """
+        stored = ResultStore.from_config(self.config).load_analysis(exam_id)
+        if stored is None:
+            return self.analyze_exam(exam_id, student_exams, answer_key)
+
+        changed_questions = set(changed_questions)
+        logger.info(f"Updating analysis of exam {exam_id} for {len(changed_questions)} changed questions")
+
+        analysis = ExamAnalysis(
+            exam_id=exam_id,
+            student_exams=student_exams,
+            answer_key=answer_key
+        )
+        analysis.question_difficulty = self._calculate_difficulty(student_exams)
+
+        raw_error_patterns = self._identify_error_patterns(student_exams)
+        error_patterns = {
+            q: patterns for q, patterns in stored.get('error_patterns', {}).items()
+            if q in raw_error_patterns and q not in changed_questions
+        }
+        error_patterns.update(self._group_error_patterns_with_gemini({
+            q: patterns for q, patterns in raw_error_patterns.items()
+            if q in changed_questions or q not in error_patterns
+        }))
+        analysis.error_patterns = error_patterns
+
+        self._sort_analysis_by_question_number(analysis)
+
+        save_path = ResultStore.from_config(self.config).save_analysis(analysis)
+        logger.info(f"Saved updated exam analysis to {save_path}")
+
+        return analysis
+
     def _calculate_difficulty(self, student_exams: List[StudentExam]) -> Dict[str, float]:
         """Calculate difficulty level for each question based on student performance.
 
@@ -331,10 +391,7 @@ class ExamAnalyzer:
 
         sorted_questions = sorted(question_numbers, key=get_sort_key)
 
-        # Sort the questions list
-        analysis.questions = sorted_questions
-
-        # Sort question_difficulty
+        # Sort question_difficulty (analysis.questions follows its order)
         sorted_difficulty = {q: analysis.question_difficulty[q] for q in sorted_questions}
         analysis.question_difficulty = sorted_difficulty
 
@@ -353,12 +410,11 @@ class ExamAnalyzer:
         Returns:
             Dict[str, Dict[str, int]]: Grouped error patterns
         """
-        import google.generativeai as genai
         grouped_patterns = {}
 
         # Initialize the Gemini model
         try:
-            genai_model = genai.GenerativeModel("gemini-1.5-pro")
+            genai_model = get_model(self.config, self.config['GEMINI_GROUPING_MODEL'])
         except Exception as e:
             logger.error(f"Failed to initialize Gemini model: {str(e)}")
             return error_patterns  # Return original patterns if Gemini initialization fails
@@ -401,7 +457,7 @@ class ExamAnalyzer:
             """
 
             try:
-                response = genai_model.generate_content(prompt)
+                response = generate_content(genai_model, prompt, 'grouping_call', **retry_settings(self.config))
                 raw_text = response.text
 
                 # Extract JSON from the response
@@ -419,7 +475,8 @@ class ExamAnalyzer:
 
                 if json_str:
                     try:
-                        result = json.loads(json_str)
+                        with track('json_parse'):
+                            result = json.loads(json_str)
                         if 'grouped_errors' in result:
                             grouped_patterns[question_number] = result['grouped_errors']
                             logger.info(
@@ -0,0 +1,153 @@
+# batch_splitter.py
+import os
+import re
+import hashlib
+import logging
+from app.utils.file_utils import unique_path
+
+logger = logging.getLogger(__name__)
+
+
+class BatchSplitter:
+    """Splits a whole-class scan PDF into per-student documents using PyMuPDF.
+
+    Pages are copied with insert_pdf, so the parts keep the original page
+    content (scanned images, text layers) without being re-rasterized.
+    """
+
+    STRATEGIES = ('fixed', 'blank', 'header')
+
+    def __init__(self, blank_ink_ratio=0.01, blank_dpi=24, header_area=0.25,
+                 header_pattern=r'\b(name|student)\b\s*[:_]', separator_pattern=r'\bseparator\b'):
+        """Initialize the splitter.
+
+        Args:
+            blank_ink_ratio (float): Maximum share of dark pixels for a page to count as blank
+            blank_dpi (int): Resolution of the low-res raster used for blank detection
+            header_area (float): Top fraction of the page searched for a name header
+            header_pattern (str): Regex (case-insensitive) marking the first page of an exam
+            separator_pattern (str): Regex (case-insensitive) marking a printed separator sheet
+        """
+        self.blank_ink_ratio = blank_ink_ratio
+        self.blank_dpi = blank_dpi
+        self.header_area = header_area
+        self.header_regex = re.compile(header_pattern, re.IGNORECASE)
+        self.separator_regex = re.compile(separator_pattern, re.IGNORECASE)
+
+    def is_separator_page(self, page):
+        """Check whether a page is a blank or printed separator sheet.
+
+        Args:
+            page (fitz.Page): The page to inspect
+
+        Returns:
+            bool: True if the page separates two students' exams
+        """
+        text = page.get_text().strip()
+        if text:
+            return bool(self.separator_regex.search(text)) and len(text) < 200
+
+        # No text layer: look at a tiny grayscale raster and count dark pixels
+        import fitz  # PyMuPDF
+        pixmap = page.get_pixmap(dpi=self.blank_dpi, colorspace=fitz.csGRAY, alpha=False)
+        samples = pixmap.samples
+        if not samples:
+            return True
+        dark_pixels = sum(1 for value in samples if value < 160)
+        return dark_pixels / len(samples) <= self.blank_ink_ratio
+
+    def has_name_header(self, page):
+        """Check whether a page starts a new exam, i.e. has a name header near the top."""
+        import fitz  # PyMuPDF
+        rect = page.rect
+        header_rect = fitz.Rect(rect.x0, rect.y0, rect.x1, rect.y0 + rect.height * self.header_area)
+        return bool(self.header_regex.search(page.get_text(clip=header_rect)))
+
+    def find_segments(self, doc, strategy='fixed', pages_per_student=None):
+        """Work out the page ranges of each student's exam.
+
+        Args:
+            doc (fitz.Document): The batch document
+            strategy (str): 'fixed', 'blank' (separator sheets) or 'header' (name headers)
+            pages_per_student (int, optional): Page count per exam for the 'fixed' strategy
+
+        Returns:
+            list: (first_page, last_page) tuples, 0-indexed and inclusive
+
+        Raises:
+            ValueError: If the strategy or its parameters are invalid
+        """
+        page_total = len(doc)
+
+        if strategy == 'fixed':
+            if not pages_per_student or pages_per_student < 1:
+                raise ValueError("pages_per_student must be a positive number for the fixed strategy")
+            return [(start, min(start + pages_per_student, page_total) - 1)
+                    for start in range(0, page_total, pages_per_student)]
+
+        if strategy == 'blank':
+            segments = []
+            start = None
+            for page_index in range(page_total):
+                if self.is_separator_page(doc[page_index]):
+                    if start is not None:
+                        segments.append((start, page_index - 1))
+                        start = None
+                elif start is None:
+                    start = page_index
+            if start is not None:
+                segments.append((start, page_total - 1))
+            return segments
+
+        if strategy == 'header':
+            starts = [page_index for page_index in range(page_total) if self.has_name_header(doc[page_index])]
+            if not starts or starts[0] != 0:
+                starts.insert(0, 0)
+            ends = [start - 1 for start in starts[1:]] + [page_total - 1]
+            return list(zip(starts, ends))
+
+        raise ValueError(f"Unknown split strategy: {strategy}")
+
+    def split(self, pdf_path, output_dir, strategy='fixed', pages_per_student=None, prefix=None):
+        """Split a batch PDF into one PDF per student.
+
+        Args:
+            pdf_path (str): Path to the batch PDF
+            output_dir (str): Directory to write the parts to (e.g. EXAMS_DIR)
+            strategy (str): 'fixed', 'blank' or 'header'
+            pages_per_student (int, optional): Page count per exam for the 'fixed' strategy
+            prefix (str, optional): Filename prefix for the parts, defaults to the batch name
+
+        Returns:
+            list: Dicts with 'filename', 'path', 'pages' and 'sha256' for each part
+        """
+        if prefix is None:
+            prefix = os.path.splitext(os.path.basename(pdf_path))[0]
+
+        parts = []
+        import fitz  # PyMuPDF
+        with fitz.open(pdf_path) as src:
+            segments = self.find_segments(src, strategy, pages_per_student)
+            logger.info(f"Splitting {pdf_path} ({len(src)} pages) into {len(segments)} parts using '{strategy}'")
+
+            for index, (first_page, last_page) in enumerate(segments, start=1):
+                part = fitz.open()
+                part.insert_pdf(src, from_page=first_page, to_page=last_page)
+                # Without a fresh document ID the same pages always give the same bytes (and hash)
+                pdf_bytes = part.tobytes(garbage=3, deflate=True, no_new_id=True)
+                part.close()
+
+                # Never overwrite parts of an earlier split (or any other exam) with the same name
+                path = unique_path(output_dir, f"{prefix}_part_{index:03d}.pdf")
+                filename = os.path.basename(path)
+                with open(path, 'wb') as f:
+                    f.write(pdf_bytes)
+
+                parts.append({
+                    'filename': filename,
+                    'path': path,
+                    'pages': [first_page + 1, last_page + 1],
+                    'sha256': hashlib.sha256(pdf_bytes).hexdigest()
+                })
+
+        return parts
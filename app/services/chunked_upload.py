@@ -0,0 +1,308 @@
+# chunked_upload.py
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from app.utils.file_lock import FileLock
+
+logger = logging.getLogger(__name__)
+
+# Block size used when copying chunk bodies to disk
+COPY_BLOCK_SIZE = 1024 * 1024
+
+# Seconds a request waits for another request of the same upload to finish
+LOCK_TIMEOUT = 30
+
+# Upload types and the folder their files end up in
+FILE_TYPES = ('exam', 'answer')
+
+
+class OffsetMismatchError(ValueError):
+    """Raised when a chunk does not start at the upload's current offset."""
+
+    def __init__(self, expected_offset, received_offset):
+        super().__init__(f"Chunk offset {received_offset} does not match upload offset {expected_offset}")
+        self.expected_offset = expected_offset
+        self.received_offset = received_offset
+
+
+class ChunkedUploadStore:
+    """Resumable, chunked uploads written straight to disk.
+
+    Each upload is a `<upload_id>.part` file plus a `<upload_id>.json` metadata
+    file. The current offset is the size of the part file, so an interrupted
+    upload resumes from exactly what reached the disk. Requests for the same
+    upload (e.g. a chunk resent after a timeout while the first is still being
+    written) are serialized by a lock per upload, held across threads and
+    processes.
+    """
+
+    # Running SHA-256 per upload, so finalize rarely has to re-read the file.
+    # Only valid while the hasher's offset matches the part file size.
+    _hashers = {}
+    _hashers_lock = threading.Lock()
+
+    # One lock per upload for the threads of this process; the lock file covers other processes
+    _upload_locks = {}
+    _upload_locks_guard = threading.Lock()
+
+    def __init__(self, upload_dir, max_size=None):
+        """Initialize the store.
+
+        Args:
+            upload_dir (str): Directory for in-progress uploads
+            max_size (int, optional): Maximum total size of a single upload in bytes
+        """
+        self.upload_dir = upload_dir
+        self.max_size = max_size
+        os.makedirs(upload_dir, exist_ok=True)
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.upload_dir, f"{upload_id}.json")
+
+    def part_path(self, upload_id):
+        """Return the path of the partially uploaded file."""
+        return os.path.join(self.upload_dir, f"{upload_id}.part")
+
+    def _lock_path(self, upload_id):
+        return os.path.join(self.upload_dir, f"{upload_id}.lock")
+
+    @contextmanager
+    def _locked(self, upload_id):
+        """Hold the lock of an upload, so only one request at a time reads or changes it."""
+        with self._upload_locks_guard:
+            lock = self._upload_locks.setdefault(upload_id, threading.Lock())
+        if not lock.acquire(timeout=LOCK_TIMEOUT):
+            raise TimeoutError(f"Upload {upload_id} is busy with another request")
+        try:
+            with FileLock(self._lock_path(upload_id), timeout=LOCK_TIMEOUT):
+                yield
+        finally:
+            lock.release()
+            if not os.path.exists(self._meta_path(upload_id)):
+                # Finalized, aborted or never existed
+                self._forget(upload_id)
+
+    def _forget(self, upload_id):
+        """Drop the in-process state and lock file of an upload that no longer exists."""
+        with self._hashers_lock:
+            self._hashers.pop(upload_id, None)
+        with self._upload_locks_guard:
+            self._upload_locks.pop(upload_id, None)
+        try:
+            os.remove(self._lock_path(upload_id))
+        except OSError:
+            pass
+
+    def _save_meta(self, meta):
+        fd, temp_path = tempfile.mkstemp(dir=self.upload_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(temp_path, self._meta_path(meta['upload_id']))
+
+    def create(self, filename, size, file_type='exam'):
+        """Start a new upload.
+
+        Args:
+            filename (str): Name of the file being uploaded
+            size (int): Total size in bytes
+            file_type (str): 'exam' or 'answer'
+
+        Returns:
+            dict: Upload metadata including 'upload_id' and 'offset'
+
+        Raises:
+            ValueError: If the file type is unknown, or the size is invalid or exceeds the limit
+        """
+        if file_type not in FILE_TYPES:
+            raise ValueError(f"Unknown file type {file_type!r}, expected one of {', '.join(FILE_TYPES)}")
+        if size <= 0:
+            raise ValueError("Upload size must be positive")
+        if self.max_size is not None and size > self.max_size:
+            raise ValueError(f"Upload too large. Maximum size is {self.max_size // (1024 * 1024)}MB")
+
+        upload_id = uuid.uuid4().hex
+        meta = {
+            'upload_id': upload_id,
+            'filename': filename,
+            'size': size,
+            'file_type': file_type,
+            'created_at': time.time()
+        }
+        open(self.part_path(upload_id), 'wb').close()
+        self._save_meta(meta)
+
+        with self._hashers_lock:
+            self._hashers[upload_id] = (0, hashlib.sha256())
+
+        logger.info(f"Started chunked upload {upload_id} for {filename} ({size} bytes)")
+        return dict(meta, offset=0)
+
+    def status(self, upload_id):
+        """Return upload metadata with the current offset, or None if unknown."""
+        try:
+            with open(self._meta_path(upload_id), 'r') as f:
+                meta = json.load(f)
+            meta['offset'] = os.path.getsize(self.part_path(upload_id))
+        except FileNotFoundError:
+            return None
+        return meta
+
+    def write_chunk(self, upload_id, offset, stream):
+        """Append a chunk read from a stream at the given offset.
+
+        Args:
+            upload_id (str): The upload
+            offset (int): Byte offset the chunk starts at
+            stream: Readable binary stream with the chunk body
+
+        Returns:
+            int: The new offset
+
+        Raises:
+            KeyError: If the upload does not exist
+            OffsetMismatchError: If offset is not the current end of the upload
+            ValueError: If the chunk would exceed the declared size
+            TimeoutError: If another request of the upload held it for too long
+        """
+        with self._locked(upload_id):
+            return self._write_chunk(upload_id, offset, stream)
+
+    def _write_chunk(self, upload_id, offset, stream):
+        """Write a chunk with the upload's lock held; see write_chunk."""
+        meta = self.status(upload_id)
+        if meta is None:
+            raise KeyError(upload_id)
+        if offset != meta['offset']:
+            raise OffsetMismatchError(meta['offset'], offset)
+
+        with self._hashers_lock:
+            hasher_offset, hasher = self._hashers.get(upload_id, (None, None))
+        if hasher_offset != offset:
+            hasher = None  # Resumed in another process or after a restart
+
+        written = 0
+        with open(self.part_path(upload_id), 'r+b') as f:
+            f.seek(offset)
+            try:
+                while True:
+                    block = stream.read(COPY_BLOCK_SIZE)
+                    if not block:
+                        break
+                    if offset + written + len(block) > meta['size']:
+                        raise ValueError("Chunk exceeds the declared upload size")
+                    f.write(block)
+                    if hasher is not None:
+                        hasher.update(block)
+                    written += len(block)
+            except Exception:
+                # Drop the partial chunk so the client can resend it from the same offset
+                f.truncate(offset)
+                with self._hashers_lock:
+                    self._hashers.pop(upload_id, None)
+                raise
+            f.flush()
+            os.fsync(f.fileno())
+
+        new_offset = offset + written
+        with self._hashers_lock:
+            if hasher is not None:
+                self._hashers[upload_id] = (new_offset, hasher)
+            else:
+                self._hashers.pop(upload_id, None)
+
+        return new_offset
+
+    def finalize(self, upload_id, handoff, expected_sha256=None):
+        """Verify a complete upload and hand its file over, then forget the upload.
+
+        The upload stays known until handoff returns, so if handoff fails the
+        client can retry the finalize and the data is cleaned up with other
+        stale uploads otherwise.
+
+        Args:
+            upload_id (str): The upload
+            handoff (callable): Called as handoff(path, meta, sha256) with the completed
+                file; must move or remove the file
+            expected_sha256 (str, optional): Checksum the client computed
+
+        Returns:
+            The return value of handoff
+
+        Raises:
+            KeyError: If the upload does not exist (also if it was finalized meanwhile)
+            ValueError: If the upload is incomplete or the checksum does not match
+            TimeoutError: If another request of the upload held it for too long
+        """
+        with self._locked(upload_id):
+            meta = self.status(upload_id)
+            if meta is None:
+                raise KeyError(upload_id)
+            if meta['offset'] != meta['size']:
+                raise ValueError(f"Upload incomplete: {meta['offset']} of {meta['size']} bytes received")
+
+            with self._hashers_lock:
+                hasher_offset, hasher = self._hashers.get(upload_id, (None, None))
+
+            if hasher is not None and hasher_offset == meta['size']:
+                digest = hasher.hexdigest()
+            else:
+                sha256 = hashlib.sha256()
+                with open(self.part_path(upload_id), 'rb') as f:
+                    for block in iter(lambda: f.read(COPY_BLOCK_SIZE), b''):
+                        sha256.update(block)
+                digest = sha256.hexdigest()
+                with self._hashers_lock:
+                    self._hashers[upload_id] = (meta['size'], sha256)
+
+            if expected_sha256 and expected_sha256.lower() != digest:
+                raise ValueError(f"Checksum mismatch: expected {expected_sha256}, got {digest}")
+
+            result = handoff(self.part_path(upload_id), meta, digest)
+            os.remove(self._meta_path(upload_id))
+            logger.info(f"Finalized chunked upload {upload_id} ({meta['size']} bytes, sha256 {digest})")
+            return result
+
+    def abort(self, upload_id):
+        """Discard an upload and its data."""
+        with self._locked(upload_id):
+            for path in (self.part_path(upload_id), self._meta_path(upload_id)):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def cleanup_stale(self, max_age_seconds):
+        """Remove uploads that were started more than max_age_seconds ago.
+
+        Part files whose metadata is gone are aged by their modification time.
+
+        Returns:
+            int: Number of uploads removed
+        """
+        removed = 0
+        cutoff = time.time() - max_age_seconds
+        upload_ids = {os.path.splitext(name)[0] for name in os.listdir(self.upload_dir)
+                      if name.endswith(('.json', '.part'))}
+        for upload_id in upload_ids:
+            meta = self.status(upload_id)
+            try:
+                started = meta['created_at'] if meta else os.path.getmtime(self.part_path(upload_id))
+            except OSError:
+                # Only the metadata is left, or the upload finished meanwhile
+                started = 0 if os.path.exists(self._meta_path(upload_id)) else None
+            if started is None or started >= cutoff:
+                continue
+            try:
+                self.abort(upload_id)
+            except TimeoutError:
+                logger.warning(f"Not removing stale upload {upload_id}: it is busy with a request")
+                continue
+            removed += 1
+        if removed:
+            logger.info(f"Removed {removed} stale chunked uploads")
+        return removed
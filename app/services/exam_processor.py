@@ -4,15 +4,16 @@ import json
 import sys
 import re
 import logging
-import google.generativeai as genai
 
 # Add parent directory to path to import config and other modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.services.vision_api import GeminiVisionAPI
+from app.services.model_calls import get_model, generate_content, retry_settings
+from app.utils.metrics import track
 from app.models.data_model import QuestionAnswer, StudentExam, AnswerKey
-
-from flask import current_app
+from app.services.result_store import ResultStore
+from app.services.pdf_metadata import stored_metadata
 
 logger = logging.getLogger(__name__)
 
@@ -20,22 +21,31 @@ logger = logging.getLogger(__name__)
 class ExamProcessor:
     """Processor for exam papers and answer keys."""
 
-    def __init__(self, vision_api=None):
+    def __init__(self, vision_api=None, config=None):
         """Initialize the exam processor.
 
         Args:
             vision_api (GeminiVisionAPI, optional): Vision API for processing.
                 If None, a new instance will be created.
+            config (dict, optional): Configuration to use instead of the Flask app config
         """
-        self.vision_api = vision_api or GeminiVisionAPI()
-
-    def process_student_exam(self, exam_image_path: str, default_student_id: str, exam_id: str) -> StudentExam:
+        if config is None and vision_api is not None:
+            config = vision_api.config
+        elif config is None:
+            from flask import current_app
+            config = current_app.config
+        self.config = config
+        self.vision_api = vision_api or GeminiVisionAPI(config=config)
+
+    def process_student_exam(self, exam_image_path: str, default_student_id: str, exam_id: str,
+                             save: bool = True) -> StudentExam:
         """Process a student's exam paper.
 
         Args:
             exam_image_path (str): Path to the exam image
             default_student_id (str): Default ID to use if name extraction fails
             exam_id (str): ID of the exam
+            save (bool): Whether to save the extracted exam to RESULTS_DIR
 
         Returns:
             StudentExam: The processed student exam
@@ -44,6 +54,7 @@ class ExamProcessor:
 
         # Analyze the exam using the vision API
         api_result = self.vision_api.analyze_exam(exam_image_path)
+        page_count = self._page_count(exam_image_path)
 
         # Extract student name if available
         student_id = default_student_id
@@ -58,7 +69,8 @@ class ExamProcessor:
         student_exam = StudentExam(
             student_id=student_id,
             exam_id=exam_id,
-            student_name=student_name
+            student_name=student_name,
+            source_file=os.path.basename(exam_image_path)
         )
 
         # Extract questions and answers from the API result
@@ -70,7 +82,7 @@ class ExamProcessor:
                 # Create a proper AnswerLocation object
                 from app.models.data_model import AnswerLocation
                 location = AnswerLocation(
-                    page=location_data.get("page", 1),
+                    page=self._clamp_page(location_data.get("page", 1), page_count),
                     bounding_box=location_data.get("bounding_box"),
                     text_spans=location_data.get("text_spans", [])
                 )
@@ -83,20 +95,24 @@ class ExamProcessor:
                 student_exam.answers.append(answer)
             logger.info(f"Extracted {len(student_exam.answers)} answers")
         else:
+            # Keep the unparsed model output so the exam can be found and re-extracted later
+            student_exam.raw_text = api_result.get("raw_text")
             logger.warning(f"No questions found in API result for student {student_id}, exam {exam_id}")
 
         # Save the student exam data
-        save_path = student_exam.save(current_app.config['RESULTS_DIR'])
-        logger.info(f"Saved student exam data to {save_path}")
+        if save:
+            save_path = ResultStore.from_config(self.config).save_student_exam(student_exam)
+            logger.info(f"Saved student exam data to {save_path}")
 
         return student_exam
 
-    def process_answer_key(self, answer_key_path: str, exam_id: str) -> AnswerKey:
+    def process_answer_key(self, answer_key_path: str, exam_id: str, save: bool = True) -> AnswerKey:
         """Process an answer key image or PDF.
 
         Args:
             answer_key_path (str): Path to the answer key file
             exam_id (str): ID of the exam
+            save (bool): Whether to save the answer key to RESULTS_DIR
 
         Returns:
             AnswerKey: The processed answer key
@@ -105,6 +121,7 @@ class ExamProcessor:
 
         # Analyze the answer key using the vision API
         api_result = self.vision_api.analyze_answer_key(answer_key_path)
+        page_count = self._page_count(answer_key_path)
 
         # Create an AnswerKey object
         answer_key = AnswerKey(exam_id=exam_id)
@@ -124,7 +141,7 @@ class ExamProcessor:
                     # Create a location object similar to what we use for student answers
                     from app.models.data_model import AnswerLocation
                     location = AnswerLocation(
-                        page=ans["location"].get("page", 1),
+                        page=self._clamp_page(ans["location"].get("page", 1), page_count),
                         bounding_box=ans["location"].get("bounding_box"),
                         text_spans=ans["location"].get("text_spans", [])
                     )
@@ -134,11 +151,27 @@ class ExamProcessor:
             logger.warning(f"No answers found in API result for exam {exam_id}")
 
         # Save the answer key data
-        save_path = answer_key.save(current_app.config['RESULTS_DIR'])
-        logger.info(f"Saved answer key data to {save_path}")
+        if save:
+            save_path = ResultStore.from_config(self.config).save_answer_key(answer_key)
+            logger.info(f"Saved answer key data to {save_path}")
 
         return answer_key
 
+    def _page_count(self, file_path):
+        """Return the page count from a PDF's upload-time metadata sidecar, or None if it has none."""
+        metadata = stored_metadata(self.config, file_path)
+        return metadata['page_count'] if metadata else None
+
+    @staticmethod
+    def _clamp_page(page, page_count):
+        """Keep a page number reported by the model inside the document, so highlights land on a real page."""
+        if not page_count:
+            return page
+        try:
+            return min(max(int(page), 1), page_count)
+        except (TypeError, ValueError):
+            return 1
+
     def _clean_pdf_answer_text(self, text):
         """Clean up text extracted from PDFs to normalize for better comparison.
 
@@ -162,64 +195,118 @@ class ExamProcessor:
 
         return cleaned.strip()
 
+    def _evaluation_item(self, answer, answer_key: AnswerKey):
+        """Build the evaluation prompt entry for an answer, or None if the key has no such question."""
+        question_number = answer.question_number
+        if question_number not in answer_key.answers:
+            return None
+
+        correct_answer = answer_key.answers[question_number]
+
+        # Clean up answer text from PDFs which might contain extra whitespace or formatting
+        cleaned_answer = self._clean_pdf_answer_text(answer.answer_text)
+
+        # Add location information when available (for both student answer and reference answer)
+        location_context = ""
+
+        # Add student answer location if available
+        if hasattr(answer, 'location') and answer.location:
+            location_context += f"""
+            Student answer location:
+            - Page: {answer.location.page}
+            - Coordinates: {answer.location.bounding_box if answer.location.bounding_box else 'Not available'}
+            """
+
+        # Add reference answer location if available
+        if hasattr(answer_key, 'answer_locations') and question_number in answer_key.answer_locations:
+            ref_location = answer_key.answer_locations[question_number]
+            location_context += f"""
+            Reference answer location:
+            - Page: {ref_location.page}
+            - Coordinates: {ref_location.bounding_box if ref_location.bounding_box else 'Not available'}
+            """
+
+        return {
+            "question_number": question_number,
+            "student_answer": cleaned_answer,
+            "reference_answer": correct_answer,
+            "location_context": location_context.strip()
+        }
+
+    @staticmethod
+    def _apply_evaluation(answer, result):
+        """Store an evaluation result on an answer, or mark it not evaluated if result is None."""
+        if result is None:
+            # If no result for this question, use default values
+            answer.is_correct = False
+            answer.error_type = "not_evaluated"
+            answer.evaluation_reason = "Could not evaluate this answer"
+            answer.misconception = None
+            answer.reference_to_answer = None
+            answer.learning_topics = []
+            return
+
+        # Handle different formats of is_correct (boolean or string)
+        if isinstance(result.get("is_correct"), str):
+            is_correct_value = result.get("is_correct", "").lower() == "true"
+        else:
+            is_correct_value = bool(result.get("is_correct", False))
+
+        # Set basic fields
+        answer.is_correct = is_correct_value
+        answer.evaluation_reason = result.get("reason", "")
+
+        if is_correct_value:
+            answer.error_type = None
+            answer.misconception = None
+            answer.reference_to_answer = None
+            answer.learning_topics = []
+        else:
+            # Set detailed error information
+            answer.error_type = result.get("error_type", "unknown")
+            answer.misconception = result.get("misconception", "")
+            answer.reference_to_answer = result.get("reference_to_answer", "")
+
+            # Handle learning topics (might be a list or a string)
+            learning_topics = result.get("learning_topics", [])
+            if isinstance(learning_topics, str):
+                # Convert comma-separated string to list
+                answer.learning_topics = [topic.strip() for topic in learning_topics.split(",")]
+            else:
+                answer.learning_topics = learning_topics
+
+    @staticmethod
+    def recompute_score(student_exam: StudentExam) -> StudentExam:
+        """Set the score to the percentage of correct answers."""
+        if student_exam.answers:
+            correct_count = sum(1 for answer in student_exam.answers if answer.is_correct)
+            student_exam.score = (correct_count / len(student_exam.answers)) * 100
+        return student_exam
+
     def compare_with_answer_key(self, student_exam: StudentExam, answer_key: AnswerKey,
-                                exam_subject="English") -> StudentExam:
+                                exam_subject="English", save=True) -> StudentExam:
         """Compare a student's answers with the answer key using Gemini for intelligent comparison.
 
         Args:
             student_exam (StudentExam): The student's exam
             answer_key (AnswerKey): The answer key
             exam_subject (str): The subject of the exam
+            save (bool): Whether to save the evaluated exam to RESULTS_DIR
 
         Returns:
             StudentExam: The updated student exam with correctness indicators and feedback
         """
         logger.info(f"Comparing student {student_exam.student_id}'s answers with answer key")
 
-        correct_count = 0
-        total_questions = len(student_exam.answers)
-
         # Process questions in batches to minimize API calls
         questions_to_evaluate = []
 
         for answer in student_exam.answers:
-            question_number = answer.question_number
-
-            if question_number in answer_key.answers:
-                correct_answer = answer_key.answers[question_number]
-
-                # Clean up answer text from PDFs which might contain extra whitespace or formatting
-                cleaned_answer = self._clean_pdf_answer_text(answer.answer_text)
-
-                # Add location information when available (for both student answer and reference answer)
-                location_context = ""
-
-                # Add student answer location if available
-                if hasattr(answer, 'location') and answer.location:
-                    location_context += f"""
-                    Student answer location:
-                    - Page: {answer.location.page}
-                    - Coordinates: {answer.location.bounding_box if answer.location.bounding_box else 'Not available'}
-                    """
-
-                # Add reference answer location if available
-                if hasattr(answer_key, 'answer_locations') and question_number in answer_key.answer_locations:
-                    ref_location = answer_key.answer_locations[question_number]
-                    location_context += f"""
-                    Reference answer location:
-                    - Page: {ref_location.page}
-                    - Coordinates: {ref_location.bounding_box if ref_location.bounding_box else 'Not available'}
-                    """
-
-                # Add to the list of questions to evaluate
-                questions_to_evaluate.append({
-                    "question_number": question_number,
-                    "student_answer": cleaned_answer,
-                    "reference_answer": correct_answer,
-                    "location_context": location_context.strip()
-                })
+            item = self._evaluation_item(answer, answer_key)
+            if item is not None:
+                questions_to_evaluate.append(item)
             else:
-                logger.warning(f"Question {question_number} not found in answer key")
+                logger.warning(f"Question {answer.question_number} not found in answer key")
                 answer.is_correct = None
 
         # Use Gemini to evaluate all answers at once
@@ -229,59 +316,58 @@ class ExamProcessor:
 
             # Process the evaluation results
             for answer in student_exam.answers:
-                question_number = answer.question_number
-
-                # Check if the question number exists in the results
-                if question_number in evaluation_results:
-                    result = evaluation_results[question_number]
-
-                    # Handle different formats of is_correct (boolean or string)
-                    if isinstance(result.get("is_correct"), str):
-                        is_correct_value = result.get("is_correct", "").lower() == "true"
-                    else:
-                        is_correct_value = bool(result.get("is_correct", False))
-
-                    # Set basic fields
-                    answer.is_correct = is_correct_value
-                    answer.evaluation_reason = result.get("reason", "")
-
-                    if is_correct_value:
-                        answer.error_type = None
-                        answer.misconception = None
-                        answer.reference_to_answer = None
-                        answer.learning_topics = []
-                        correct_count += 1
-                    else:
-                        # Set detailed error information
-                        answer.error_type = result.get("error_type", "unknown")
-                        answer.misconception = result.get("misconception", "")
-                        answer.reference_to_answer = result.get("reference_to_answer", "")
-
-                        # Handle learning topics (might be a list or a string)
-                        learning_topics = result.get("learning_topics", [])
-                        if isinstance(learning_topics, str):
-                            # Convert comma-separated string to list
-                            answer.learning_topics = [topic.strip() for topic in learning_topics.split(",")]
-                        else:
-                            answer.learning_topics = learning_topics
-                else:
-                    # If no result for this question, use default values
-                    answer.is_correct = False
-                    answer.error_type = "not_evaluated"
-                    answer.evaluation_reason = "Could not evaluate this answer"
-                    answer.misconception = None
-                    answer.reference_to_answer = None
-                    answer.learning_topics = []
-
-        # Calculate score as percentage
-        if total_questions > 0:
-            student_exam.score = (correct_count / total_questions) * 100
+                self._apply_evaluation(answer, evaluation_results.get(answer.question_number))
+
+            # Calculate score as percentage
+            self.recompute_score(student_exam)
 
         # Save the updated student exam data
-        student_exam.save(current_app.config['RESULTS_DIR'])
+        if save:
+            ResultStore.from_config(self.config).save_student_exam(student_exam)
 
         return student_exam
 
+    def reevaluate_answers(self, items, answer_key: AnswerKey, exam_subject="English", batch_size=20):
+        """Evaluate selected answers of several students, batching them across students.
+
+        Only the given answers are sent to the model; scores of the affected
+        students are recomputed, but nothing is saved.
+
+        Args:
+            items (list): (StudentExam, QuestionAnswer) tuples to evaluate
+            answer_key (AnswerKey): The answer key
+            exam_subject (str): The subject of the exam
+            batch_size (int): Maximum number of answers per model call
+
+        Returns:
+            int: Number of answers that received an evaluation
+        """
+        pending = []
+        for student_exam, answer in items:
+            item = self._evaluation_item(answer, answer_key)
+            if item is None:
+                answer.is_correct = None
+                continue
+            # Prefix the question number so results from different students can't collide
+            item["question_number"] = f"{student_exam.student_id}/{answer.question_number}"
+            pending.append((student_exam, answer, item))
+
+        evaluated = 0
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            evaluation_results = self._evaluate_answers_with_gemini([item for _, _, item in batch], exam_subject)
+            for _, answer, item in batch:
+                result = evaluation_results.get(item["question_number"])
+                self._apply_evaluation(answer, result)
+                if result is not None:
+                    evaluated += 1
+
+        for student_exam in {id(student_exam): student_exam for student_exam, _ in items}.values():
+            self.recompute_score(student_exam)
+
+        logger.info(f"Re-evaluated {evaluated}/{len(pending)} answers")
+        return evaluated
+
     def _evaluate_answers_with_gemini(self, questions_to_evaluate, exam_subject="English"):
         """Use Gemini to evaluate student answers with detailed educational feedback.
 
@@ -351,8 +437,8 @@ class ExamProcessor:
 
         try:
             # Call Gemini for evaluation
-            genai_model = genai.GenerativeModel("gemini-1.5-pro")
-            response = genai_model.generate_content(prompt)
+            genai_model = get_model(self.config, self.config['GEMINI_EVALUATION_MODEL'])
+            response = generate_content(genai_model, prompt, 'evaluation_call', **retry_settings(self.config))
             raw_text = response.text
 
             # Print the raw response for debugging
@@ -377,7 +463,8 @@ class ExamProcessor:
 
             if json_str:
                 try:
-                    evaluation_results = json.loads(json_str)
+                    with track('json_parse'):
+                        evaluation_results = json.loads(json_str)
                     logger.info("Successfully parsed JSON results")
 
                     # Ensure all question numbers are strings for consistent lookup
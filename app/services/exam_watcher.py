@@ -0,0 +1,407 @@
+# exam_watcher.py
+import os
+import time
+import shutil
+import hashlib
+import logging
+import threading
+
+from app.services.grading_pipeline import GradingPipeline
+from app.services.pdf_metadata import metadata_index_for
+from app.services.usage import exam_usage, usage_scope, ANSWER_KEY
+from app.utils.hash_index import JsonFileIndex, HashIndex
+from app.utils.file_utils import unique_path
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # watchdog is optional, the watcher falls back to polling
+    Observer = None
+    FileSystemEventHandler = object
+
+logger = logging.getLogger(__name__)
+
+# File types picked up from the inbox, matching the upload form
+EXAM_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png')
+
+# Block size used when fingerprinting files
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+# Ledger status of files whose grading failed and is retried later
+FAILED = 'failed'
+
+
+class IngestLedger(JsonFileIndex):
+    """Persistent SHA-256 -> graded file record for one exam.
+
+    Lets the watcher skip files it already graded, across restarts and when a
+    scanner drops the same paper twice. Files whose grading failed are kept
+    with status 'failed', their number of attempts and when to retry them.
+    """
+
+    def contains(self, sha256):
+        """Check whether a content hash was already graded."""
+        entry = self._load().get(sha256)
+        return entry is not None and entry.get('status') != FAILED
+
+    def entries(self):
+        """Return all ingested file records keyed by content hash."""
+        return self._load()
+
+    def graded_count(self):
+        """Return the number of files graded so far."""
+        return sum(1 for entry in self._load().values() if entry.get('status') != FAILED)
+
+    def failure(self, sha256):
+        """Return the failure record of a content hash, or None if it did not fail."""
+        entry = self._load().get(sha256)
+        return entry if entry is not None and entry.get('status') == FAILED else None
+
+    def record_failure(self, sha256, filename, error, retry_seconds):
+        """Count a failed grading of a file and schedule its retry with exponential backoff.
+
+        Args:
+            sha256 (str): Hex digest of the file content
+            filename (str): Filename relative to base_dir
+            error (str): Why grading failed
+            retry_seconds (float): Delay before the first retry, doubled for every further attempt
+
+        Returns:
+            dict: The failure record with 'attempts' and 'retry_at'
+        """
+        with self._lock:
+            entries = self._load()
+            previous = entries.get(sha256) or {}
+            attempts = previous.get('attempts', 0) + 1 if previous.get('status') == FAILED else 1
+            entry = {'filename': filename, 'status': FAILED, 'attempts': attempts, 'error': error,
+                     'failed_at': time.time(), 'retry_at': time.time() + retry_seconds * 2 ** (attempts - 1)}
+            entries[sha256] = entry
+            self._save(entries)
+        return entry
+
+    def record(self, sha256, filename, **extra):
+        """Record an ingested file.
+
+        Args:
+            sha256 (str): Hex digest of the file content
+            filename (str): Filename relative to base_dir
+            **extra: Additional fields to keep with the entry (e.g. student_id, status)
+        """
+        path = os.path.join(self.base_dir, filename)
+        stat = os.stat(path) if os.path.exists(path) else None
+        entry = dict(extra, filename=filename, ingested_at=time.time(),
+                     size=stat.st_size if stat else None, mtime_ns=stat.st_mtime_ns if stat else None)
+        with self._lock:
+            entries = self._load()
+            entries[sha256] = entry
+            self._save(entries)
+
+
+class _InboxEventHandler(FileSystemEventHandler):
+    """Forwards watchdog file events to the watcher."""
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.watcher.notify(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.watcher.notify(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.watcher.notify(event.dest_path)
+
+
+class ExamWatcher:
+    """Watches an inbox folder and grades exams as scanners drop them in.
+
+    New files are only picked up once their size and mtime have stayed the same
+    for settle_seconds, so partially written scans are never graded. Each file is
+    fingerprinted by SHA-256 and recorded in a ledger; after every batch the class
+    analysis is recomputed over all students graded so far. Files that fail to
+    grade are retried with exponential backoff up to WATCH_MAX_ATTEMPTS times.
+
+    Every file in the inbox is graded as a paper of this exam, so it should be
+    a folder of its own. If it is EXAMS_DIR, which also holds the uploads of
+    other exams, the files already there when the watcher starts are ignored.
+    """
+
+    def __init__(self, config, exam_id, answer_key_path, inbox_dir=None, settle_seconds=None,
+                 poll_interval=None, workers=None, use_polling=False, exam_subject="English"):
+        """Initialize the watcher.
+
+        Args:
+            config (dict): Application settings
+            exam_id (str): Exam the incoming papers belong to
+            answer_key_path (str): Path to the answer key PDF or image
+            inbox_dir (str, optional): Folder to watch, defaults to WATCH_INBOX_DIR
+            settle_seconds (float, optional): Time a file must stay unchanged before it is graded
+            poll_interval (float, optional): Seconds between inbox checks
+            workers (int, optional): Exams graded concurrently
+            use_polling (bool): Poll even if watchdog is installed (e.g. on network shares)
+            exam_subject (str): Subject passed to the evaluation prompt
+        """
+        self.config = config
+        self.exam_id = exam_id
+        self.answer_key_path = answer_key_path
+        self.exams_dir = config['EXAMS_DIR']
+        self.inbox_dir = os.path.abspath(inbox_dir or config.get('WATCH_INBOX_DIR') or self.exams_dir)
+        self.settle_seconds = config.get('WATCH_SETTLE_SECONDS', 2.0) if settle_seconds is None else settle_seconds
+        self.poll_interval = config.get('WATCH_POLL_INTERVAL', 1.0) if poll_interval is None else poll_interval
+        self.use_polling = use_polling or Observer is None
+        self.exam_subject = exam_subject
+        self.max_attempts = config.get('WATCH_MAX_ATTEMPTS', 3)
+        self.retry_seconds = config.get('WATCH_RETRY_SECONDS', 60.0)
+
+        self.pipeline = GradingPipeline(config, workers=workers)
+        self.ledger = IngestLedger(os.path.join(config['INDEX_DIR'], f"watch_{exam_id}.json"), self.exams_dir)
+        self.hash_index = HashIndex(os.path.join(config['INDEX_DIR'], 'exam_hashes.json'), self.exams_dir)
+        self.answer_key = None
+
+        # path -> (size, mtime_ns, time the file was last seen changing)
+        self._pending = {}
+        # path -> (size, mtime_ns) of files already handled, so polling does not re-hash them
+        self._handled = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+        for entry in self.ledger.entries().values():
+            path = os.path.join(self.exams_dir, entry['filename'])
+            self._handled[os.path.abspath(path)] = (entry.get('size'), entry.get('mtime_ns'))
+
+    @staticmethod
+    def is_candidate(path):
+        """Check whether a path looks like a finished exam file (not a temp or hidden file)."""
+        name = os.path.basename(path)
+        return not name.startswith('.') and name.lower().endswith(EXAM_EXTENSIONS)
+
+    def notify(self, path):
+        """Register a file that was created or changed in the inbox."""
+        path = os.path.abspath(path)
+        if os.path.dirname(path) != self.inbox_dir or not self.is_candidate(path):
+            return
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return  # Already moved or deleted
+
+        fingerprint = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if self._handled.get(path) == fingerprint:
+                return
+            pending = self._pending.get(path)
+            if pending is None or pending[:2] != fingerprint:
+                self._pending[path] = (stat.st_size, stat.st_mtime_ns, time.monotonic())
+        self._wake.set()
+
+    def ignore_existing(self):
+        """Mark every file currently in the inbox as handled without grading it."""
+        for name in os.listdir(self.inbox_dir):
+            path = os.path.join(self.inbox_dir, name)
+            if self.is_candidate(path):
+                self._mark_handled(path)
+
+    def scan(self):
+        """Register every file currently in the inbox."""
+        for name in os.listdir(self.inbox_dir):
+            self.notify(os.path.join(self.inbox_dir, name))
+
+    def settled_files(self):
+        """Return pending files whose size and mtime have not changed for settle_seconds."""
+        now = time.monotonic()
+        settled = []
+        with self._lock:
+            for path, (size, mtime_ns, changed_at) in list(self._pending.items()):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    del self._pending[path]
+                    continue
+                if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                    self._pending[path] = (stat.st_size, stat.st_mtime_ns, now)
+                elif stat.st_size > 0 and now - changed_at >= self.settle_seconds:
+                    del self._pending[path]
+                    settled.append(path)
+        return sorted(settled)
+
+    @staticmethod
+    def fingerprint(path):
+        """Return the hex SHA-256 digest of a file."""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def ingest(self, path):
+        """Fingerprint a settled file and move it into EXAMS_DIR.
+
+        Returns:
+            tuple: (exam path to grade, sha256), or (None, sha256) if the content was already graded
+        """
+        sha256 = self.fingerprint(path)
+        if self.ledger.contains(sha256):
+            logger.info(f"Skipping {os.path.basename(path)}: already graded for {self.exam_id}")
+            self._mark_handled(path)
+            return None, sha256
+        failure = self.ledger.failure(sha256)
+        if failure is not None and not self._retry_due(failure):
+            # The stored copy is retried on schedule; dropping the paper again does not skip the backoff
+            logger.info(f"Skipping {os.path.basename(path)}: grading failed {failure['attempts']} times")
+            self._mark_handled(path)
+            return None, sha256
+
+        if os.path.dirname(path) == os.path.abspath(self.exams_dir):
+            exam_path = path
+        else:
+            # Held like the web upload does, so an upload of the same paper can't slip in between
+            with self.hash_index.lock():
+                existing = self.hash_index.lookup(sha256)
+                if existing:
+                    # Same paper was already uploaded through the web UI; grade that copy
+                    os.remove(path)
+                    exam_path = os.path.join(self.exams_dir, existing['filename'])
+                else:
+                    exam_path = unique_path(self.exams_dir, os.path.basename(path))
+                    shutil.move(path, exam_path)
+                    self.hash_index.add(sha256, os.path.basename(exam_path),
+                                        original_filename=os.path.basename(path))
+            if not existing and exam_path.lower().endswith('.pdf'):
+                try:
+                    metadata_index_for(self.config, 'exam').put(os.path.basename(exam_path), sha256)
+                except Exception as e:
+                    logger.warning(f"Could not compute PDF metadata for {exam_path}: {str(e)}")
+
+        self._mark_handled(exam_path)
+        return exam_path, sha256
+
+    def _retry_due(self, failure):
+        """Check whether a failed file may be graded again now."""
+        return failure['attempts'] < self.max_attempts and time.time() >= failure.get('retry_at', 0)
+
+    def due_retries(self):
+        """Return the stored copies of failed files whose retry is due."""
+        paths = []
+        for entry in self.ledger.entries().values():
+            if entry.get('status') == FAILED and self._retry_due(entry):
+                path = os.path.join(self.exams_dir, entry['filename'])
+                if os.path.exists(path):
+                    paths.append(os.path.abspath(path))
+        return paths
+
+    def _mark_handled(self, path):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            with self._lock:
+                self._handled[os.path.abspath(path)] = (stat.st_size, stat.st_mtime_ns)
+
+    def process(self, paths):
+        """Grade settled files and refresh the class analysis.
+
+        Args:
+            paths (list): Settled inbox files
+
+        Returns:
+            dict: 'graded' and 'failed' counts and the number of 'students' in the analysis
+        """
+        batch = []
+        for path in paths:
+            try:
+                exam_path, sha256 = self.ingest(path)
+            except OSError as e:
+                logger.error(f"Could not ingest {path}: {str(e)}")
+                continue
+            if exam_path:
+                batch.append((exam_path, sha256))
+
+        if not batch:
+            return {'graded': 0, 'failed': 0, 'students': None}
+
+        with exam_usage(self.config, self.exam_id, source='watcher'):
+            return self._grade_and_analyze(batch)
+
+    def _grade_and_analyze(self, batch):
+        """Grade ingested (exam_path, sha256) pairs, record them and refresh the analysis."""
+        first_index = self.ledger.graded_count()
+        graded, failures, _, claimed = self.pipeline.grade_batch(
+            self.exam_id, [exam_path for exam_path, _ in batch], self.answer_key, self.exam_subject, first_index)
+
+        student_ids = {exam_path: student_exam.student_id for exam_path, student_exam in graded}
+        errors = {failure['file']: failure['error'] for failure in failures}
+        for exam_path, sha256 in batch:
+            filename = os.path.basename(exam_path)
+            if exam_path in student_ids:
+                self.ledger.record(sha256, filename, student_id=student_ids[exam_path])
+            elif exam_path not in claimed:
+                failure = self.ledger.record_failure(sha256, filename, errors.get(filename, 'Grading failed'),
+                                                     self.retry_seconds)
+                if failure['attempts'] < self.max_attempts:
+                    logger.warning(f"Grading {filename} failed (attempt {failure['attempts']}), "
+                                   f"retrying in {failure['retry_at'] - time.time():.0f}s")
+                else:
+                    logger.error(f"Grading {filename} failed {failure['attempts']} times, giving up: "
+                                 f"{failure['error']}")
+
+        student_count = None
+        if graded:
+            # Recompute the class analysis over everyone graded so far
+            with self.pipeline.store.exam_lease(self.exam_id):
+                student_exams = self.pipeline.load_student_exams(self.exam_id)
+                self.pipeline.analyzer.analyze_exam(self.exam_id, student_exams, self.answer_key)
+            student_count = len(student_exams)
+
+        logger.info(f"Watcher graded {len(graded)} new exams for {self.exam_id} "
+                    f"({len(failures)} failed, {len(claimed)} graded by other workers), "
+                    f"analysis now covers {student_count} students")
+        return {'graded': len(graded), 'failed': len(failures), 'students': student_count}
+
+    def run_once(self):
+        """Check the inbox once and grade whatever has settled."""
+        if self.use_polling:
+            self.scan()
+        settled = self.settled_files()
+        settled += [path for path in self.due_retries() if path not in settled]
+        return self.process(settled) if settled else None
+
+    def run(self):
+        """Watch the inbox until stop() is called."""
+        os.makedirs(self.inbox_dir, exist_ok=True)
+        with exam_usage(self.config, self.exam_id, source='watcher'), usage_scope(student_id=ANSWER_KEY):
+            self.answer_key = self.pipeline.processor.process_answer_key(self.answer_key_path, self.exam_id)
+
+        observer = None
+        if not self.use_polling:
+            observer = Observer()
+            observer.schedule(_InboxEventHandler(self), self.inbox_dir, recursive=False)
+            observer.start()
+        logger.info(f"Watching {self.inbox_dir} for exam {self.exam_id} "
+                    f"({'polling' if observer is None else 'filesystem events'})")
+
+        if self.inbox_dir == os.path.abspath(self.exams_dir):
+            # EXAMS_DIR also holds other exams' papers and web uploads; only grade what arrives from now on
+            logger.warning(f"Watching EXAMS_DIR as the inbox: every file added there, also uploads for other "
+                           f"exams, will be graded as {self.exam_id}; set WATCH_INBOX_DIR to a folder of its own")
+            self.ignore_existing()
+        else:
+            # Pick up files that arrived while the watcher was not running
+            self.scan()
+        try:
+            while not self._stop.is_set():
+                self.run_once()
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+    def stop(self):
+        """Ask a running watcher to stop after the current batch."""
+        self._stop.set()
+        self._wake.set()
@@ -0,0 +1,95 @@
+# export.py
+import io
+import os
+import time
+import logging
+import zipfile
+
+from app.services.render_cache import HighlightCache
+
+logger = logging.getLogger(__name__)
+
+# Size of the blocks copied from rendered PDFs into the archive stream
+ZIP_CHUNK_SIZE = 64 * 1024
+
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """Write-only, non-seekable sink that collects archive bytes until drained.
+
+    Because it cannot seek, zipfile writes local headers followed by data
+    descriptors, so entries can be emitted without knowing their size upfront.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        """Return and clear everything written since the last drain."""
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_highlighted_zip(jobs, cache_dir, modes, max_workers=None):
+    """Render highlighted PDFs for many students and stream them into a ZIP.
+
+    Cached renders are emitted immediately; the rest are rendered by
+    PDFHighlighter.render_batch and written to the archive in completion
+    order. Only one chunk of the archive is held in memory at a time.
+
+    Args:
+        jobs (list): Dicts with 'name', 'original_pdf_path' and 'answer_locations'
+        cache_dir (str): Highlight cache directory
+        modes (list): Archive folder name -> errors_only pairs, e.g. [('errors', True)]
+        max_workers (int, optional): Size of the render process pool
+
+    Yields:
+        bytes: Consecutive chunks of the ZIP archive
+    """
+    cache = HighlightCache(cache_dir)
+    buffer = _ZipStreamBuffer()
+    started = time.time()
+    entry_count = 0
+
+    def add_entry(archive, arcname, pdf_path):
+        info = zipfile.ZipInfo(arcname, date_time=time.localtime(os.path.getmtime(pdf_path))[:6])
+        info.compress_type = zipfile.ZIP_STORED  # PDFs are already compressed
+        with open(pdf_path, 'rb') as src, archive.open(info, 'w') as dest:
+            while True:
+                chunk = src.read(ZIP_CHUNK_SIZE)
+                if not chunk:
+                    break
+                dest.write(chunk)
+                data = buffer.drain()
+                if data:
+                    yield data
+        # Closing the entry writes its data descriptor
+        yield buffer.drain()
+
+    render_jobs = []
+    arcnames = []
+    for job in jobs:
+        for folder, errors_only in modes:
+            render_jobs.append((job['original_pdf_path'], job['answer_locations'], errors_only))
+            arcnames.append(f"{folder}/{job['name']}" if len(modes) > 1 else job['name'])
+
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        # Cached renders come back first, the rest as the process pool finishes them
+        for index, pdf_path in cache.render_batch(render_jobs, max_workers=max_workers):
+            if not pdf_path:
+                logger.error(f"Failed to render {arcnames[index]} for export, skipping")
+                continue
+            yield from add_entry(archive, arcnames[index], pdf_path)
+            entry_count += 1
+
+    # Closing the archive writes the central directory
+    yield buffer.drain()
+    logger.info(f"ZIP export finished: {entry_count} files in {time.time() - started:.2f}s")
@@ -0,0 +1,359 @@
+# grading_pipeline.py
+import os
+import json
+import time
+import hashlib
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services.exam_processor import ExamProcessor
+from app.services.analyzer import ExamAnalyzer
+from app.services.result_store import ResultStore
+from app.services.run_journal import RunJournal, ANSWER_KEY_ITEM, file_fingerprint
+from app.models.data_model import StudentExam, AnswerKey
+from app.services.usage import exam_usage, usage_scope, summarize_usage, ANSWER_KEY
+from app.utils.metrics import run_metrics, summarize_durations
+
+logger = logging.getLogger(__name__)
+
+# grade_batch outcome of an exam file that another worker is grading
+CLAIMED = object()
+
+
+class GradingPipeline:
+    """Runs answer key extraction, per-student extraction and evaluation, and class analysis.
+
+    All settings come from the config passed in, so the pipeline runs the same
+    way inside a Flask request, from the command line or on a batch node.
+    Students are extracted and evaluated concurrently; the model calls are
+    network bound, so threads are enough.
+
+    When RUN_JOURNAL_PATH is configured, every completed stage is checkpointed
+    in a RunJournal and a re-run with the same inputs resumes where the
+    previous one stopped.
+    """
+
+    def __init__(self, config, workers=None, processor=None, analyzer=None, journal=None):
+        """Initialize the pipeline.
+
+        Args:
+            config (dict): Application settings (RESULTS_DIR, GEMINI_* models and prompts)
+            workers (int, optional): Number of exams processed concurrently,
+                defaults to GRADING_WORKERS
+            processor (ExamProcessor, optional): Processor to use, created from config if None
+            analyzer (ExamAnalyzer, optional): Analyzer to use, created from config if None
+            journal (RunJournal, optional): Checkpoint journal, opened from RUN_JOURNAL_PATH if None
+        """
+        self.config = config
+        self.workers = max(1, workers or config.get('GRADING_WORKERS', 1))
+        self.processor = processor or ExamProcessor(config=config)
+        self.analyzer = analyzer or ExamAnalyzer(config=config)
+        self.journal = journal
+        self.store = ResultStore.from_config(config)
+
+    def grade_student(self, exam_path, default_student_id, exam_id, answer_key, exam_subject="English",
+                      checkpoint=None):
+        """Extract, evaluate and save a single student's exam.
+
+        Args:
+            exam_path (str): Path to the exam file
+            default_student_id (str): ID to use if no student name is extracted
+            exam_id (str): ID of the exam
+            answer_key (AnswerKey): The processed answer key
+            exam_subject (str): Subject passed to the evaluation prompt
+            checkpoint (tuple, optional): (RunJournal, run_id, item_key); completed stages
+                are skipped and newly completed ones are recorded
+
+        Returns:
+            tuple: (StudentExam, dict of durations in seconds for the stages actually run)
+        """
+        with usage_scope(source_file=os.path.basename(exam_path)) as usage_labels:
+            return self._grade_student(exam_path, default_student_id, exam_id, answer_key, exam_subject,
+                                       checkpoint, usage_labels)
+
+    def _grade_student(self, exam_path, default_student_id, exam_id, answer_key, exam_subject, checkpoint,
+                       usage_labels):
+        """Run the stages of grade_student(), labelling model usage with the student once known."""
+        journal, run_id, item_key = checkpoint or (None, None, None)
+        done = journal.checkpoints(run_id, item_key) if journal else {}
+        timings = {}
+
+        if 'evaluated' in done:
+            student_exam = StudentExam.from_dict(done['evaluated'])
+        else:
+            if 'extracted' in done:
+                student_exam = StudentExam.from_dict(done['extracted'])
+            else:
+                started = time.perf_counter()
+                student_exam = self.processor.process_student_exam(exam_path, default_student_id, exam_id,
+                                                                   save=False)
+                timings['extraction'] = time.perf_counter() - started
+                self.store.assign_student_id(student_exam)
+                if journal:
+                    journal.record(run_id, item_key, 'extracted', student_exam.to_dict())
+            usage_labels['student_id'] = student_exam.student_id
+
+            started = time.perf_counter()
+            student_exam = self.processor.compare_with_answer_key(student_exam, answer_key, exam_subject,
+                                                                  save=False)
+            timings['evaluation'] = time.perf_counter() - started
+            if journal:
+                journal.record(run_id, item_key, 'evaluated', student_exam.to_dict())
+
+        # Inside a group commit the result may still be pending when 'saved' is journaled; a resumed
+        # run finds no file for it and saves it again
+        if 'saved' not in done or not os.path.exists(self.store.student_path(student_exam.student_id, exam_id)):
+            result_path = self.store.save_student_exam(student_exam)
+            if journal:
+                journal.record(run_id, item_key, 'saved', {'path': result_path})
+
+        return student_exam, timings
+
+    def grade_batch(self, exam_id, exam_paths, answer_key, exam_subject="English", first_index=0,
+                    journal=None, run_id=None, item_keys=None):
+        """Extract and evaluate several exams concurrently.
+
+        A failing exam is logged and reported but does not stop the batch.
+        Each exam file is claimed while it is graded; files claimed by another
+        worker sharing RESULTS_DIR are skipped and reported as claimed.
+
+        Args:
+            exam_id (str): ID of the exam
+            exam_paths (list): Paths to the students' exam files
+            answer_key (AnswerKey): The processed answer key
+            exam_subject (str): Subject passed to the evaluation prompt
+            first_index (int): Number of exams graded before, used for default student IDs
+            journal (RunJournal, optional): Journal to checkpoint completed stages in
+            run_id (str, optional): Journal run the batch belongs to
+            item_keys (list, optional): Journal item key (file fingerprint) per exam path
+
+        Returns:
+            tuple: (graded list of (exam_path, StudentExam) in input order,
+                failures list of dicts with 'file' and 'error',
+                durations dict of stage -> list of seconds,
+                claimed list of exam paths being graded by another worker)
+        """
+        outcomes = [None] * len(exam_paths)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # Run every exam in a copy of the caller's context so stage timings and token
+            # usage reach the recorder and ledger of the run
+            futures = [
+                executor.submit(contextvars.copy_context().run, self._grade_claimed, exam_path,
+                                f"student_{first_index + i + 1:02d}", exam_id, answer_key, exam_subject,
+                                (journal, run_id, item_keys[i]) if journal is not None else None,
+                                item_keys[i] if item_keys else None)
+                for i, exam_path in enumerate(exam_paths)
+            ]
+            for i, future in enumerate(futures):
+                try:
+                    outcomes[i] = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to grade {exam_paths[i]}: {str(e)}")
+                    outcomes[i] = e
+
+        graded = []
+        failures = []
+        claimed = []
+        durations = {'extraction': [], 'evaluation': []}
+        for exam_path, outcome in zip(exam_paths, outcomes):
+            if outcome is CLAIMED:
+                claimed.append(exam_path)
+                continue
+            if isinstance(outcome, Exception):
+                failures.append({'file': os.path.basename(exam_path), 'error': str(outcome)})
+                continue
+            student_exam, timings = outcome
+            graded.append((exam_path, student_exam))
+            for stage, seconds in timings.items():
+                durations[stage].append(seconds)
+
+        if claimed:
+            logger.info(f"Skipped {len(claimed)} exams of {exam_id} claimed by other workers")
+        return graded, failures, durations, claimed
+
+    def _grade_claimed(self, exam_path, default_student_id, exam_id, answer_key, exam_subject, checkpoint,
+                       item_key=None):
+        """Claim an exam file and grade it, or return CLAIMED if another worker is grading it."""
+        if item_key is None:
+            item_key = hashlib.sha256(os.path.abspath(exam_path).encode('utf-8')).hexdigest()
+        claim = self.store.claim(exam_id, item_key)
+        if claim is None:
+            return CLAIMED
+        try:
+            return self.grade_student(exam_path, default_student_id, exam_id, answer_key, exam_subject, checkpoint)
+        finally:
+            claim.release()
+
+    def load_student_exams(self, exam_id):
+        """Load every saved student result for an exam from RESULTS_DIR.
+
+        Returns:
+            list: StudentExam objects, ordered by result filename
+        """
+        return self.store.load_student_exams(exam_id)
+
+    def _open_journal(self):
+        """Return (journal, owned): the configured journal, or one opened from RUN_JOURNAL_PATH."""
+        if self.journal is not None:
+            return self.journal, False
+        if self.config.get('RUN_JOURNAL_PATH'):
+            return RunJournal(self.config['RUN_JOURNAL_PATH'], self.config.get('SQLITE_JOURNAL_MODE', 'WAL')), True
+        return None, False
+
+    def _load_answer_key(self, answer_key_path, exam_id, journal, run_id):
+        """Process the answer key, reusing the checkpointed result of a resumed run."""
+        if journal:
+            done = journal.checkpoints(run_id, ANSWER_KEY_ITEM)
+            if 'extracted' in done:
+                answer_key = AnswerKey.from_dict(done['extracted'])
+                self.store.save_answer_key(answer_key)
+                return answer_key
+
+        with usage_scope(student_id=ANSWER_KEY):
+            answer_key = self.processor.process_answer_key(answer_key_path, exam_id)
+        if journal:
+            journal.record(run_id, ANSWER_KEY_ITEM, 'extracted', answer_key.to_dict())
+        return answer_key
+
+    def run_metrics_dir(self):
+        """Return the folder per-run summaries are written to (RUN_METRICS_DIR or RESULTS_DIR/runs)."""
+        return self.config.get('RUN_METRICS_DIR') or os.path.join(self.config['RESULTS_DIR'], 'runs')
+
+    def _write_run_summary(self, stats):
+        """Write the stats and stage metrics of a run to the run metrics folder.
+
+        Returns:
+            str: Path to the summary file, or None if it could not be written
+        """
+        metrics_dir = self.run_metrics_dir()
+        filename = f"{stats['exam_id']}_{time.strftime('%Y%m%dT%H%M%S')}_{stats['run_id'] or 'nojournal'}.json"
+        path = os.path.join(metrics_dir, filename)
+        try:
+            os.makedirs(metrics_dir, exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(dict(stats, finished_at=time.time()), f, indent=2)
+        except OSError as e:
+            logger.warning(f"Could not write run summary {path}: {str(e)}")
+            return None
+        logger.info(f"Wrote run summary to {path}")
+        return path
+
+    def run(self, exam_id, answer_key_path, exam_paths, exam_subject="English", resume=True):
+        """Grade a batch of exams against an answer key and analyze the results.
+
+        Args:
+            exam_id (str): ID of the exam
+            answer_key_path (str): Path to the answer key PDF or image
+            exam_paths (list): Paths to the students' exam files
+            exam_subject (str): Subject passed to the evaluation prompt
+            resume (bool): Continue an unfinished run with the same inputs, if journaled
+
+        Returns:
+            dict: 'exam_id', 'run_id' (None without a journal), 'graded' ((exam_path,
+                StudentExam) tuples in input order), 'failures' (dicts with 'file' and
+                'error'), 'claimed' (files graded by other workers), 'analysis' (ExamAnalysis or
+                None if no exam could be graded) and 'stats'
+        """
+        run_started = time.perf_counter()
+        logger.info(f"Grading {len(exam_paths)} exams for {exam_id} with {self.workers} workers")
+
+        journal, owns_journal = self._open_journal()
+        try:
+            with run_metrics() as recorder, exam_usage(self.config, exam_id) as (ledger, usage_labels), \
+                    self.store.group_commit():
+                return self._run(exam_id, answer_key_path, exam_paths, exam_subject, resume, run_started,
+                                 journal, recorder, ledger, usage_labels)
+        finally:
+            if owns_journal:
+                journal.close()
+
+    def _run(self, exam_id, answer_key_path, exam_paths, exam_subject, resume, run_started, journal, recorder,
+             ledger, usage_labels):
+        """Run the stages of run() with an open journal, metrics recorder and usage ledger."""
+        run_id = None
+        item_keys = None
+        if journal:
+            item_keys = [file_fingerprint(exam_path, self.config) for exam_path in exam_paths]
+
+        # Workers started on the same inputs join one journal run and the answer key is extracted
+        # once: the first worker extracts it under the lease, the others reuse its checkpoint
+        with self.store.exam_lease(exam_id):
+            if journal:
+                run_id, _ = journal.start_run(
+                    exam_id, RunJournal.inputs_key(exam_id, answer_key_path, item_keys, self.config),
+                    resume=resume)
+                usage_labels['run_id'] = run_id
+            answer_key = self._load_answer_key(answer_key_path, exam_id, journal, run_id)
+        answer_key_seconds = time.perf_counter() - run_started
+
+        graded, failures, durations, claimed = self.grade_batch(
+            exam_id, exam_paths, answer_key, exam_subject, journal=journal, run_id=run_id, item_keys=item_keys)
+        return self._finish_run(exam_id, exam_paths, answer_key, graded, failures, durations,
+                                run_started, answer_key_seconds, journal, run_id, recorder, ledger, claimed,
+                                item_keys)
+
+    def _finish_run(self, exam_id, exam_paths, answer_key, graded, failures, durations,
+                    run_started, answer_key_seconds, journal, run_id, recorder=None, ledger=None, claimed=(),
+                    item_keys=None):
+        """Analyze the graded exams, build the run stats and close the journal run."""
+        analysis = None
+        analysis_seconds = 0.0
+        with self.store.exam_lease(exam_id):
+            # Write the results still pending in the group commit, so they are on disk (and in the
+            # run's metrics) before the run is analyzed, summarized and closed
+            self.store.flush()
+            if graded:
+                analysis_started = time.perf_counter()
+                student_exams = [student_exam for _, student_exam in graded]
+                if claimed:
+                    # Other workers graded part of the batch; analyze everyone saved so far, so the
+                    # worker finishing last leaves the analysis of the whole class
+                    student_exams = self.store.load_student_exams(exam_id)
+                analysis = self.analyzer.analyze_exam(exam_id, student_exams, answer_key)
+                analysis_seconds = time.perf_counter() - analysis_started
+
+        wall_seconds = time.perf_counter() - run_started
+        stats = {
+            'exam_id': exam_id,
+            'run_id': run_id,
+            'workers': self.workers,
+            'exams': len(exam_paths),
+            'graded': len(graded),
+            'failed': len(failures),
+            'claimed': len(claimed),
+            'resumed': len(graded) - len(durations['evaluation']),
+            'answers': sum(len(student_exam.answers) for _, student_exam in graded),
+            'wall_seconds': round(wall_seconds, 3),
+            'exams_per_minute': round(len(graded) * 60 / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+            'stages': {
+                'answer_key': round(answer_key_seconds, 3),
+                'extraction': summarize_durations(durations['extraction']),
+                'evaluation': summarize_durations(durations['evaluation']),
+                'analysis': round(analysis_seconds, 3)
+            }
+        }
+        if ledger is not None:
+            usage = summarize_usage(ledger.records(), self.config.get('GEMINI_PRICES', {}))
+            stats['usage'] = {'totals': usage['totals'], 'by_stage': usage['by_stage'],
+                              'currency': self.config.get('GEMINI_PRICE_CURRENCY', 'USD')}
+        if recorder is not None:
+            stats['metrics'] = recorder.summary()
+            self._write_run_summary(stats)
+        logger.info(f"Graded {len(graded)}/{len(exam_paths)} exams for {exam_id} in {wall_seconds:.1f}s "
+                    f"({stats['exams_per_minute']} exams/min)")
+
+        # A run with failures stays open, so re-running it retries only the failed exams; with exams
+        # graded by other workers, the worker that sees every exam saved closes it
+        if journal and not failures and (not claimed or journal.saved_count(run_id) >= len(set(item_keys))):
+            journal.finish_run(run_id, stats)
+
+        return {
+            'exam_id': exam_id,
+            'run_id': run_id,
+            'graded': graded,
+            'failures': failures,
+            'claimed': [os.path.basename(exam_path) for exam_path in claimed],
+            'analysis': analysis,
+            'stats': stats
+        }
@@ -0,0 +1,202 @@
+# model_calls.py
+import time
+import logging
+import threading
+
+from app.utils.metrics import track, record_retry
+from app.services.usage import record_call
+
+logger = logging.getLogger(__name__)
+
+# Errors worth retrying (rate limits, overload, timeouts), resolved on first use
+_transient_errors = None
+
+
+def transient_errors():
+    """Return the exception types of model call failures that may succeed when retried.
+
+    Rate limits, an overloaded or failing service, deadlines and dropped
+    connections are transient; invalid keys, bad requests, missing permissions
+    or unknown models are not and fail the same way on every attempt.
+
+    Returns:
+        tuple: Exception classes
+    """
+    global _transient_errors
+    if _transient_errors is None:
+        errors = (ConnectionError, TimeoutError)
+        try:
+            from google.api_core import exceptions as google_exceptions
+            errors += (google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable,
+                       google_exceptions.DeadlineExceeded, google_exceptions.InternalServerError)
+        except ImportError:
+            pass
+        _transient_errors = errors
+    return _transient_errors
+
+
+def generate_content(model, contents, stage, max_retries=0, retry_backoff=1.0):
+    """Call model.generate_content, timing the call, retrying transient errors and recording token usage.
+
+    Args:
+        model: Gemini GenerativeModel (or anything with generate_content)
+        contents: Prompt or multimodal content list
+        stage (str): Metrics stage name, e.g. 'vision_call' or 'evaluation_call'
+        max_retries (int): Number of additional attempts after a failed call
+        retry_backoff (float): Seconds to wait before the first retry, doubled after each retry
+
+    Returns:
+        The model response
+
+    Raises:
+        Exception: A permanent error right away, or the error of the last attempt if
+            every attempt failed with a transient error (see transient_errors)
+    """
+    started = time.perf_counter()
+    attempt = 0
+    while True:
+        try:
+            with track(stage):
+                response = model.generate_content(contents)
+        except Exception as e:
+            if attempt >= max_retries or not isinstance(e, transient_errors()):
+                record_call(model, stage, None, time.perf_counter() - started, attempt, error=e)
+                raise
+            delay = retry_backoff * (2 ** attempt)
+            attempt += 1
+            record_retry(stage)
+            logger.warning(f"{stage} failed ({str(e)}), retry {attempt}/{max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        record_call(model, stage, response, time.perf_counter() - started, attempt)
+        return response
+
+
+def create_model(config, model_name, generation_config=None):
+    """Create the generative model used for a call.
+
+    GEMINI_MODEL_FACTORY, if set, is called with the model name instead of
+    creating a Gemini model, e.g. to run the pipeline against an offline stand-in.
+    Prefer get_model(), which reuses one client per model across the process.
+
+    Args:
+        config (dict): Application settings
+        model_name (str): Name of the Gemini model
+        generation_config (dict, optional): Gemini generation settings (temperature, ...)
+
+    Returns:
+        A model with a generate_content method
+    """
+    factory = config.get('GEMINI_MODEL_FACTORY')
+    if factory is not None:
+        return factory(model_name)
+
+    import google.generativeai as genai
+    configure_api(config['GEMINI_API_KEY'])
+    return genai.GenerativeModel(model_name, generation_config=generation_config)
+
+
+# Process-wide model clients keyed by (model, generation config, API key, factory)
+_models = {}
+_models_lock = threading.Lock()
+_configured_api_key = None
+
+
+def configure_api(api_key):
+    """Configure the Gemini SDK with an API key, once per process and key."""
+    global _configured_api_key
+    with _models_lock:
+        if api_key == _configured_api_key:
+            return
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        _configured_api_key = api_key
+
+
+def _registry_key(config, model_name, generation_config):
+    settings = tuple(sorted((generation_config or {}).items()))
+    return model_name, settings, config.get('GEMINI_API_KEY'), config.get('GEMINI_MODEL_FACTORY')
+
+
+def get_model(config, model_name, generation_config=None):
+    """Return the shared client for a model, creating it on first use.
+
+    Clients are safe to share between grading threads, and reusing them keeps
+    the SDK's connection open instead of paying the setup on every call.
+
+    Args:
+        config (dict): Application settings
+        model_name (str): Name of the Gemini model
+        generation_config (dict, optional): Gemini generation settings; each distinct
+            setting gets its own client
+
+    Returns:
+        A model with a generate_content method
+    """
+    key = _registry_key(config, model_name, generation_config)
+    model = _models.get(key)
+    if model is None:
+        model = create_model(config, model_name, generation_config)
+        with _models_lock:
+            # Another thread may have created the client meanwhile; keep the first one
+            model = _models.setdefault(key, model)
+    return model
+
+
+def clear_models():
+    """Drop all shared clients, e.g. after the API key or model factory changed."""
+    global _configured_api_key
+    with _models_lock:
+        _models.clear()
+        _configured_api_key = None
+
+
+def warm_up_models(config, background=True):
+    """Create the clients of the configured models and open their connections ahead of the first call.
+
+    Token counting is free, so a count_tokens call is used to establish the
+    connection where the client supports it. Failures are only logged; the
+    first real call will retry the setup.
+
+    Args:
+        config (dict): Application settings
+        background (bool): Warm up in a daemon thread instead of blocking startup
+
+    Returns:
+        threading.Thread: The warm-up thread, or None if it ran inline or was skipped
+    """
+    if not config.get('GEMINI_WARMUP', False):
+        return None
+    if config.get('GEMINI_MODEL_FACTORY') is None and not config.get('GEMINI_API_KEY'):
+        logger.info("Skipping model warm-up: no Gemini API key configured")
+        return None
+
+    def warm_up():
+        model_names = dict.fromkeys(config[key] for key in
+                                    ('GEMINI_MODEL', 'GEMINI_EVALUATION_MODEL', 'GEMINI_GROUPING_MODEL')
+                                    if config.get(key))
+        for model_name in model_names:
+            started = time.perf_counter()
+            try:
+                model = get_model(config, model_name)
+                if hasattr(model, 'count_tokens'):
+                    model.count_tokens('warm-up')
+                logger.info(f"Warmed up {model_name} in {time.perf_counter() - started:.2f}s")
+            except Exception as e:
+                logger.warning(f"Could not warm up {model_name}: {str(e)}")
+
+    if not background:
+        warm_up()
+        return None
+    thread = threading.Thread(target=warm_up, name='model-warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+def retry_settings(config):
+    """Return the retry keyword arguments for generate_content from the config."""
+    return {
+        'max_retries': config.get('GEMINI_MAX_RETRIES', 0),
+        'retry_backoff': config.get('GEMINI_RETRY_BACKOFF', 1.0)
+    }
@@ -0,0 +1,139 @@
+# page_renderer.py
+import io
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+
+from app.services.render_cache import file_fingerprint
+from app.services.pdf_metadata import stored_metadata
+from app.utils.metrics import track, record_cache
+
+logger = logging.getLogger(__name__)
+
+# Supported output formats -> mimetype
+IMAGE_FORMATS = {
+    'png': 'image/png',
+    'webp': 'image/webp'
+}
+
+# Document hashes memoized by file fingerprint so each PDF is hashed once per change
+_hash_memo = {}
+_hash_memo_lock = threading.Lock()
+_HASH_MEMO_LIMIT = 4096
+
+
+def document_hash(pdf_path, config=None):
+    """Compute the SHA-256 of a document's content, memoized by file fingerprint.
+
+    Args:
+        pdf_path (str): Path to the PDF
+        config (dict, optional): Application config; uploaded PDFs then take the
+            hash from their metadata sidecar instead of being read
+
+    Returns:
+        str: Hex digest of the file content
+    """
+    fingerprint = file_fingerprint(pdf_path)
+    with _hash_memo_lock:
+        cached = _hash_memo.get(fingerprint)
+    if cached:
+        return cached
+
+    metadata = stored_metadata(config, pdf_path) if config is not None else None
+    if metadata is not None:
+        content_hash = metadata['sha256']
+    else:
+        digest = hashlib.sha256()
+        with open(pdf_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        content_hash = digest.hexdigest()
+
+    with _hash_memo_lock:
+        if len(_hash_memo) >= _HASH_MEMO_LIMIT:
+            _hash_memo.clear()
+        _hash_memo[fingerprint] = content_hash
+    return content_hash
+
+
+class PageRenderer:
+    """Renders individual PDF pages to images with an on-disk cache."""
+
+    def __init__(self, cache_dir, config=None):
+        """Initialize the renderer.
+
+        Args:
+            cache_dir (str): Directory where page images are cached
+            config (dict, optional): Application config, used to read the metadata sidecar of uploaded PDFs
+        """
+        self.cache_dir = cache_dir
+        self.config = config
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def page_count(pdf_path):
+        """Return the number of pages in a PDF."""
+        import fitz  # PyMuPDF
+        with fitz.open(pdf_path) as doc:
+            return len(doc)
+
+    def cache_key(self, pdf_path, page_number, dpi, image_format):
+        """Build the cache key for a page render from the document hash, page and DPI."""
+        return f"{document_hash(pdf_path, self.config)}_p{page_number}_{dpi}dpi.{image_format}"
+
+    def render_page(self, pdf_path, page_number, dpi=72, image_format='png'):
+        """Render one page of a PDF to an image, reusing a cached render if present.
+
+        Args:
+            pdf_path (str): Path to the PDF
+            page_number (int): 1-indexed page number
+            dpi (int): Output resolution
+            image_format (str): 'png' or 'webp'
+
+        Returns:
+            tuple: (path to the image, cache key)
+
+        Raises:
+            ValueError: If the format is unsupported or the page does not exist
+        """
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported image format: {image_format}")
+
+        key = self.cache_key(pdf_path, page_number, dpi, image_format)
+        path = os.path.join(self.cache_dir, key[:2], key)
+        cached = os.path.exists(path)
+        record_cache('page', cached)
+        if cached:
+            return path, key
+
+        with track('page_render'):
+            import fitz  # PyMuPDF
+            with fitz.open(pdf_path) as doc:
+                if page_number < 1 or page_number > len(doc):
+                    raise ValueError(f"Invalid page number {page_number} for {os.path.basename(pdf_path)}")
+                pixmap = doc[page_number - 1].get_pixmap(dpi=dpi, alpha=False)
+
+            if image_format == 'png':
+                image_bytes = pixmap.tobytes('png')
+            else:
+                from PIL import Image
+                image = Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+                buffer = io.BytesIO()
+                image.save(buffer, 'WEBP', quality=80)
+                image_bytes = buffer.getvalue()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(image_bytes)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        logger.info(f"Rendered page {page_number} of {pdf_path} at {dpi} DPI ({len(image_bytes)} bytes)")
+        return path, key
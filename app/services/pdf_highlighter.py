@@ -1,12 +1,44 @@
 # pdf_highlighter.py
 import os
 import io
+import json
 import logging
-import fitz  # PyMuPDF
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Render processes shared by every batch of this process, created on first use
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def _get_render_pool(max_workers=None):
+    """Return the process-wide render pool, creating it on first use.
+
+    Workers are spawned rather than forked: the pool is started from threaded
+    web and worker processes, whose locks and client threads must not be
+    copied into the children. max_workers only applies when the pool is created.
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(max_workers=max_workers,
+                                               mp_context=multiprocessing.get_context('spawn'))
+        return _render_pool
+
+
+def _discard_render_pool(pool):
+    """Drop a broken render pool so the next batch starts a new one."""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
 
 class PDFHighlighter:
     """Service for highlighting answers on PDF exams using PyMuPDF."""
@@ -16,6 +48,9 @@ class PDFHighlighter:
         """
         Create a new PDF with answers highlighted using PyMuPDF (text search approach).
 
+        Incorrect and unevaluated answers are drawn first and correct ones after
+        them, exactly as create_highlighted_variants does.
+
         Args:
             original_pdf_path (str): Path to the original exam PDF
             answer_locations (list): List of answer locations with correctness and answer text
@@ -24,156 +59,263 @@ class PDFHighlighter:
         Returns:
             bytes: The highlighted PDF as bytes
         """
+        # Same drawing order as the variants, so both produce the same render for a cache key
+        return PDFHighlighter.create_highlighted_variants(
+            original_pdf_path, answer_locations, modes=(errors_only,))[bool(errors_only)]
+
+    @staticmethod
+    def create_highlighted_variants(original_pdf_path, answer_locations, modes=(True, False)):
+        """
+        Render several highlight modes of the same exam from a single document open.
+
+        Errors-only highlights are a subset of the all-answers highlights, so the
+        errors-only variant is saved first and the correct answers are then drawn
+        onto the same document to produce the all-answers variant.
+
+        Args:
+            original_pdf_path (str): Path to the original exam PDF
+            answer_locations (list): List of answer locations with correctness and answer text
+            modes (iterable): The errors_only values to render
+
+        Returns:
+            dict: Mapping of errors_only -> highlighted PDF bytes
+        """
         if not os.path.exists(original_pdf_path):
             raise FileNotFoundError(f"Original PDF not found: {original_pdf_path}")
 
-        # Log diagnostics
-        logger.info(f"Processing PDF: {original_pdf_path}")
-        logger.info(f"Total answer locations: {len(answer_locations)}")
+        modes = {bool(mode) for mode in modes}
+        logger.info(f"Processing PDF: {original_pdf_path} (variants: {sorted(modes)})")
 
         try:
-            # Open the PDF with PyMuPDF
+            import fitz  # PyMuPDF
             doc = fitz.open(original_pdf_path)
+            variants = {}
 
-            # Process each answer
+            # Incorrect and unevaluated answers appear in both variants
             for answer in answer_locations:
-                # Skip if errors_only and this is a correct answer
-                if errors_only and answer.get('is_correct') is True:
-                    continue
+                if answer.get('is_correct') is not True:
+                    PDFHighlighter._highlight_answer(doc, answer)
 
-                # Get answer text and page number
-                answer_text = answer.get('answer_text', '').strip()
-                page_num = answer.get('location', {}).get('page', 1)
-                question_number = answer.get('question_number', '')
-                is_correct = answer.get('is_correct')
+            if True in modes:
+                variants[True] = PDFHighlighter._to_bytes(doc)
 
-                # If no answer text, skip
-                if not answer_text:
-                    logger.warning(f"No answer text found for question {question_number}")
-                    continue
+            if False in modes:
+                for answer in answer_locations:
+                    if answer.get('is_correct') is True:
+                        PDFHighlighter._highlight_answer(doc, answer)
+                variants[False] = PDFHighlighter._to_bytes(doc)
 
-                # Adjust page number (PyMuPDF is 0-indexed while our data is 1-indexed)
-                page_idx = page_num - 1
+            doc.close()
+            return variants
 
-                # Ensure the page index is valid
-                if page_idx < 0 or page_idx >= len(doc):
-                    logger.warning(f"Invalid page number {page_num} for question {question_number}")
-                    continue
+        except Exception as e:
+            logger.error(f"Error creating highlighted PDF variants: {str(e)}")
+            raise
+
+    @staticmethod
+    def render_batch(jobs, max_workers=None, store=None):
+        """
+        Render many highlighted PDFs across the process-wide render pool.
+
+        Jobs for the same document and answers are grouped, so each worker
+        produces every requested mode of a document from one document open.
+        Concurrent batches share the pool's processes instead of starting their own.
+
+        Args:
+            jobs (list): (original_pdf_path, answer_locations, errors_only) tuples
+            max_workers (int, optional): Number of worker processes when the pool is
+                first created (defaults to CPU count)
+            store (callable, optional): Picklable callable run in the worker as
+                store(original_pdf_path, answer_locations, errors_only, pdf_bytes).
+                Its return value is yielded instead of the PDF bytes, which avoids
+                shipping large documents back to the parent process.
+
+        Yields:
+            tuple: (job index, PDF bytes or store result) as documents finish;
+                the result is None if rendering failed
+        """
+        groups = {}
+        for index, (original_pdf_path, answer_locations, errors_only) in enumerate(jobs):
+            group_key = (original_pdf_path, json.dumps(answer_locations, sort_keys=True, default=str))
+            group = groups.setdefault(group_key, {
+                'original_pdf_path': original_pdf_path,
+                'answer_locations': answer_locations,
+                'indexes': {}
+            })
+            group['indexes'].setdefault(bool(errors_only), []).append(index)
 
-                # Get the page
-                page = doc[page_idx]
-
-                # Search for the answer text on the page
-                found_areas = page.search_for(answer_text)
-
-                # If no text found, try to search for substrings
-                if not found_areas and len(answer_text) > 10:
-                    # Try with shorter substrings
-                    for substring_length in [10, 5, 3]:
-                        if len(answer_text) <= substring_length:
-                            continue
-                        substring = answer_text[:substring_length]
-                        found_areas = page.search_for(substring)
-                        if found_areas:
-                            logger.info(
-                                f"Found match using substring of length {substring_length} for Q{question_number}")
-                            break
-
-                # If still no text found, use location data if available
-                if not found_areas and answer.get('location', {}).get('bounding_box'):
-                    bbox = answer.get('location', {}).get('bounding_box')
-                    if bbox:
-                        # Convert normalized coordinates to absolute
-                        page_rect = page.rect
-                        x1 = bbox.get('x1', 0) * page_rect.width
-                        y1 = bbox.get('y1', 0) * page_rect.height
-                        x2 = bbox.get('x2', 0) * page_rect.width
-                        y2 = bbox.get('y2', 0) * page_rect.height
-
-                        found_areas = [fitz.Rect(x1, y1, x2, y2)]
-                        logger.info(f"Using bounding box coordinates for Q{question_number}")
-
-                # Highlight all found areas
-                for rect in found_areas:
-                    # Create a new shape
-                    shape = page.new_shape()
-
-                    # Set highlight color based on correctness
-                    if is_correct is False:
-                        color = (1, 0, 0)  # Red
-                        fill_opacity = 0.3
-                    elif is_correct is True:
-                        color = (0, 0.7, 0)  # Green
-                        fill_opacity = 0.2
-                    else:
-                        color = (0, 0, 1)  # Blue
-                        fill_opacity = 0.2
-
-                    # Add some padding
-                    padding = 3
-                    rect = fitz.Rect(
-                        rect.x0 - padding,
-                        rect.y0 - padding,
-                        rect.x1 + padding,
-                        rect.y1 + padding
-                    )
-
-                    # Draw the rectangle
-                    shape.draw_rect(rect)
-                    shape.finish(color=color, fill=color, fill_opacity=fill_opacity, width=1.5)
-
-                    # Add question number label
-                    if question_number:
-                        # Position for the label
-                        label_x = rect.x0 - 10
-                        label_y = rect.y0
-
-                        text_box = fitz.Rect(label_x - 8, label_y - 8, label_x + 8, label_y + 8)
-
-                        circle_shape = page.new_shape()
-                        # Draw a small circle for the label
-                        circle_shape.draw_circle((label_x, label_y), 8)
-
-                        if is_correct is False:
-                            circle_shape.finish(color=(0.9, 0, 0), fill=(0.9, 0, 0), width=1)
-                        elif is_correct is True:
-                            circle_shape.finish(color=(0, 0.6, 0), fill=(0, 0.6, 0), width=1)
-                        else:
-                            circle_shape.finish(color=(0, 0, 0.9), fill=(0, 0, 0.9), width=1)
-
-                        circle_shape.commit()
-
-                        # Add text
-                        text = f"Q{question_number}"
-                        page.insert_textbox(
-                            text_box,
-                            text,
-                            fontsize=8,
-                            color=(1, 1, 1),  # White text
-                            align=1  # 0 = left alignment
-                        )
-
-                    # Commit the shape
-                    shape.commit()
-
-                # Log whether we found anything
+        if not groups:
+            return
+
+        logger.info(f"Rendering {len(jobs)} highlighted PDFs from {len(groups)} documents")
+
+        pool = _get_render_pool(max_workers)
+        futures = {}
+        try:
+            for group in groups.values():
+                future = pool.submit(_render_document, group['original_pdf_path'], group['answer_locations'],
+                                     list(group['indexes']), store)
+                futures[future] = group
+            for future in as_completed(futures):
+                group = futures[future]
+                try:
+                    results = future.result()
+                except BrokenProcessPool as e:
+                    logger.error(f"Render pool broke while rendering {group['original_pdf_path']}: {str(e)}")
+                    _discard_render_pool(pool)
+                    results = {}
+                except Exception as e:
+                    logger.error(f"Failed to render {group['original_pdf_path']}: {str(e)}")
+                    results = {}
+
+                for errors_only, indexes in group['indexes'].items():
+                    for index in indexes:
+                        yield index, results.get(errors_only)
+        except BrokenProcessPool:
+            _discard_render_pool(pool)
+            raise
+        finally:
+            # The pool is shared; only drop this batch's work that has not started
+            for future in futures:
+                future.cancel()
+
+    @staticmethod
+    def _to_bytes(doc):
+        """Save an open document to PDF bytes."""
+        output_buffer = io.BytesIO()
+        doc.save(output_buffer)
+        return output_buffer.getvalue()
+
+    @staticmethod
+    def _highlight_answer(doc, answer):
+        """Draw the highlight and question label for a single answer.
+
+        Args:
+            doc (fitz.Document): The open document to draw on
+            answer (dict): Answer location with correctness and answer text
+        """
+        import fitz  # PyMuPDF
+
+        # Get answer text and page number
+        answer_text = answer.get('answer_text', '').strip()
+        page_num = answer.get('location', {}).get('page', 1)
+        question_number = answer.get('question_number', '')
+        is_correct = answer.get('is_correct')
+
+        # If no answer text, skip
+        if not answer_text:
+            logger.warning(f"No answer text found for question {question_number}")
+            return
+
+        # Adjust page number (PyMuPDF is 0-indexed while our data is 1-indexed)
+        page_idx = page_num - 1
+
+        # Ensure the page index is valid
+        if page_idx < 0 or page_idx >= len(doc):
+            logger.warning(f"Invalid page number {page_num} for question {question_number}")
+            return
+
+        # Get the page
+        page = doc[page_idx]
+
+        # Search for the answer text on the page
+        found_areas = page.search_for(answer_text)
+
+        # If no text found, try to search for substrings
+        if not found_areas and len(answer_text) > 10:
+            # Try with shorter substrings
+            for substring_length in [10, 5, 3]:
+                if len(answer_text) <= substring_length:
+                    continue
+                substring = answer_text[:substring_length]
+                found_areas = page.search_for(substring)
                 if found_areas:
-                    logger.info(f"Highlighted {len(found_areas)} instances for Q{question_number} on page {page_num}")
+                    logger.info(
+                        f"Found match using substring of length {substring_length} for Q{question_number}")
+                    break
+
+        # If still no text found, use location data if available
+        if not found_areas and answer.get('location', {}).get('bounding_box'):
+            bbox = answer.get('location', {}).get('bounding_box')
+            if bbox:
+                # Convert normalized coordinates to absolute
+                page_rect = page.rect
+                x1 = bbox.get('x1', 0) * page_rect.width
+                y1 = bbox.get('y1', 0) * page_rect.height
+                x2 = bbox.get('x2', 0) * page_rect.width
+                y2 = bbox.get('y2', 0) * page_rect.height
+
+                found_areas = [fitz.Rect(x1, y1, x2, y2)]
+                logger.info(f"Using bounding box coordinates for Q{question_number}")
+
+        # Highlight all found areas
+        for rect in found_areas:
+            # Create a new shape
+            shape = page.new_shape()
+
+            # Set highlight color based on correctness
+            if is_correct is False:
+                color = (1, 0, 0)  # Red
+                fill_opacity = 0.3
+            elif is_correct is True:
+                color = (0, 0.7, 0)  # Green
+                fill_opacity = 0.2
+            else:
+                color = (0, 0, 1)  # Blue
+                fill_opacity = 0.2
+
+            # Add some padding
+            padding = 3
+            rect = fitz.Rect(
+                rect.x0 - padding,
+                rect.y0 - padding,
+                rect.x1 + padding,
+                rect.y1 + padding
+            )
+
+            # Draw the rectangle
+            shape.draw_rect(rect)
+            shape.finish(color=color, fill=color, fill_opacity=fill_opacity, width=1.5)
+
+            # Add question number label
+            if question_number:
+                # Position for the label
+                label_x = rect.x0 - 10
+                label_y = rect.y0
+
+                text_box = fitz.Rect(label_x - 8, label_y - 8, label_x + 8, label_y + 8)
+
+                circle_shape = page.new_shape()
+                # Draw a small circle for the label
+                circle_shape.draw_circle((label_x, label_y), 8)
+
+                if is_correct is False:
+                    circle_shape.finish(color=(0.9, 0, 0), fill=(0.9, 0, 0), width=1)
+                elif is_correct is True:
+                    circle_shape.finish(color=(0, 0.6, 0), fill=(0, 0.6, 0), width=1)
                 else:
-                    logger.warning(f"No match found for Q{question_number} answer: '{answer_text[:20]}...'")
+                    circle_shape.finish(color=(0, 0, 0.9), fill=(0, 0, 0.9), width=1)
 
-            # Save the PDF to a memory buffer
-            output_buffer = io.BytesIO()
-            doc.save(output_buffer)
-            doc.close()
+                circle_shape.commit()
 
-            # Return the PDF bytes
-            output_buffer.seek(0)
-            return output_buffer.getvalue()
+                # Add text
+                text = f"Q{question_number}"
+                page.insert_textbox(
+                    text_box,
+                    text,
+                    fontsize=8,
+                    color=(1, 1, 1),  # White text
+                    align=1  # 0 = left alignment
+                )
 
-        except Exception as e:
-            logger.error(f"Error creating highlighted PDF: {str(e)}")
-            raise
+            # Commit the shape
+            shape.commit()
+
+        # Log whether we found anything
+        if found_areas:
+            logger.info(f"Highlighted {len(found_areas)} instances for Q{question_number} on page {page_num}")
+        else:
+            logger.warning(f"No match found for Q{question_number} answer: '{answer_text[:20]}...'")
 
     @staticmethod
     def format_answers_for_highlighting(student_exam):
@@ -197,4 +339,15 @@ class PDFHighlighter:
                 'location': answer.get('location', {'page': 1})
             })
 
-        return answer_locations
\ No newline at end of file
+        return answer_locations
+
+
+def _render_document(original_pdf_path, answer_locations, modes, store=None):
+    """Process pool entry point for PDFHighlighter.render_batch."""
+    variants = PDFHighlighter.create_highlighted_variants(original_pdf_path, answer_locations, modes)
+    if store is None:
+        return variants
+    return {
+        errors_only: store(original_pdf_path, answer_locations, errors_only, pdf_bytes)
+        for errors_only, pdf_bytes in variants.items()
+    }
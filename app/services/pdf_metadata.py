@@ -0,0 +1,169 @@
+# pdf_metadata.py
+import os
+import time
+import hashlib
+import logging
+from app.utils.hash_index import JsonFileIndex
+
+logger = logging.getLogger(__name__)
+
+# Bump when the fields computed by compute_pdf_metadata change
+METADATA_VERSION = 1
+
+# A linearization dictionary must be the first object in the file
+LINEARIZED_PROBE_BYTES = 1024
+
+# Block size used when hashing files
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def compute_pdf_metadata(pdf_path, sha256=None):
+    """Collect the facts the pipeline needs about a PDF in a single pass.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        sha256 (str, optional): Content hash if already known (e.g. from upload)
+
+    Returns:
+        dict: 'sha256', 'size', 'mtime_ns', 'page_count', 'page_sizes' ([width, height]
+            in points per page), 'text_layer' (bool per page), 'has_text_layer',
+            'is_linearized', 'version' and 'computed_at'
+    """
+    stat = os.stat(pdf_path)
+
+    with open(pdf_path, 'rb') as f:
+        head = f.read(LINEARIZED_PROBE_BYTES)
+        if sha256 is None:
+            digest = hashlib.sha256(head)
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+            sha256 = digest.hexdigest()
+
+    page_sizes = []
+    text_layer = []
+    import fitz  # PyMuPDF
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            page_sizes.append([round(page.rect.width, 2), round(page.rect.height, 2)])
+            text_layer.append(bool(page.get_text().strip()))
+
+    return {
+        'sha256': sha256,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'page_count': len(page_sizes),
+        'page_sizes': page_sizes,
+        'text_layer': text_layer,
+        'has_text_layer': any(text_layer),
+        'is_linearized': b'/Linearized' in head,
+        'version': METADATA_VERSION,
+        'computed_at': time.time()
+    }
+
+
+class MetadataIndex(JsonFileIndex):
+    """Persistent filename -> PDF metadata index, filled in at upload time.
+
+    Entries are only returned while the file still has the size and mtime it
+    had when the metadata was computed, so replaced files are re-read.
+    """
+
+    def get(self, filename):
+        """Return stored metadata for a file, or None if it is missing or stale.
+
+        Args:
+            filename (str): Filename relative to base_dir
+
+        Returns:
+            dict or None: Metadata as returned by compute_pdf_metadata
+        """
+        entry = self._load().get(filename)
+        if (entry is None or entry.get('version') != METADATA_VERSION
+                or not self._is_current(filename, entry)):
+            return None
+        return entry
+
+    def put(self, filename, sha256=None):
+        """Compute and store metadata for a file.
+
+        Args:
+            filename (str): Filename relative to base_dir
+            sha256 (str, optional): Content hash if already known
+
+        Returns:
+            dict: The stored metadata
+        """
+        metadata = compute_pdf_metadata(os.path.join(self.base_dir, filename), sha256)
+        with self._lock:
+            entries = self._load()
+            entries[filename] = metadata
+            self._save(entries)
+        logger.info(f"Indexed metadata for {filename}: {metadata['page_count']} pages, "
+                    f"text layer: {metadata['has_text_layer']}, linearized: {metadata['is_linearized']}")
+        return metadata
+
+    def get_or_compute(self, filename):
+        """Return stored metadata, computing it first if it is missing or stale.
+
+        Returns:
+            dict or None: Metadata, or None if the file does not exist or cannot be read
+        """
+        metadata = self.get(filename)
+        if metadata is not None:
+            return metadata
+        if not os.path.exists(os.path.join(self.base_dir, filename)):
+            return None
+        try:
+            return self.put(filename)
+        except Exception as e:
+            logger.warning(f"Could not read PDF metadata for {filename}: {str(e)}")
+            return None
+
+    def remove(self, filename):
+        """Drop the entry for a file, e.g. after it was deleted."""
+        with self._lock:
+            entries = self._load()
+            if entries.pop(filename, None) is not None:
+                self._save(entries)
+
+
+def metadata_index_for(config, file_type='exam'):
+    """Return the metadata index for exams or answer keys.
+
+    Args:
+        config (dict): Application config (e.g. current_app.config)
+        file_type (str): 'exam' or 'answer'
+
+    Returns:
+        MetadataIndex: Index over EXAMS_DIR or ANSWERS_DIR
+
+    Raises:
+        ValueError: If file_type is not 'exam' or 'answer'
+    """
+    if file_type not in ('exam', 'answer'):
+        raise ValueError(f"Unknown file type {file_type!r}, expected 'exam' or 'answer'")
+    base_dir = config['EXAMS_DIR'] if file_type == 'exam' else config['ANSWERS_DIR']
+    return MetadataIndex(os.path.join(config['INDEX_DIR'], f"{file_type}_metadata.json"), base_dir)
+
+
+def stored_metadata(config, path):
+    """Return the upload-time metadata of a file without opening it.
+
+    Only files stored directly in EXAMS_DIR or ANSWERS_DIR have metadata; the
+    index is read but never filled in here.
+
+    Args:
+        config (dict): Application config
+        path (str): Path to the file
+
+    Returns:
+        dict or None: Metadata as returned by compute_pdf_metadata, or None if the
+            file has none or changed since it was indexed
+    """
+    if not config.get('INDEX_DIR'):
+        return None
+    directory = os.path.dirname(os.path.abspath(path))
+    for file_type, key in (('exam', 'EXAMS_DIR'), ('answer', 'ANSWERS_DIR')):
+        if config.get(key) and os.path.abspath(config[key]) == directory:
+            return metadata_index_for(config, file_type).get(os.path.basename(path))
+    return None
@@ -0,0 +1,284 @@
+# queue_worker.py
+import os
+import time
+import socket
+import logging
+import threading
+
+from app.services.exam_processor import ExamProcessor
+from app.services.analyzer import ExamAnalyzer
+from app.services.result_store import ResultStore
+from app.services.run_journal import file_fingerprint
+from app.services.work_queue import WorkQueue, DONE, FAILED
+from app.services.usage import exam_usage, usage_scope, ANSWER_KEY
+from app.models.data_model import StudentExam, AnswerKey
+from app.utils.metrics import track
+
+logger = logging.getLogger(__name__)
+
+# Task kinds in the order they are preferred: an answer key unblocks every evaluation, and
+# evaluating extracted students finishes them before new ones are started
+ANSWER_KEY_TASK, EVALUATE_TASK, EXTRACT_TASK, ANALYZE_TASK = 'answer_key', 'evaluate', 'extract', 'analyze'
+PRIORITIES = {ANSWER_KEY_TASK: 0, EVALUATE_TASK: 1, EXTRACT_TASK: 2, ANALYZE_TASK: 3}
+
+# Tasks that must be finished before the class analysis of an exam is refreshed
+GRADING_TASKS = (ANSWER_KEY_TASK, EXTRACT_TASK, EVALUATE_TASK)
+
+# Seconds an evaluation waits before checking again for an answer key that is still being processed
+ANSWER_KEY_WAIT = 5
+
+
+def _task(exam_id, kind, task_key, payload):
+    return {'exam_id': exam_id, 'kind': kind, 'task_key': task_key, 'payload': payload,
+            'priority': PRIORITIES[kind]}
+
+
+def submit_exam(queue, exam_id, answer_key_path, exam_paths, exam_subject="English", config=None):
+    """Queue the grading of a batch of exams for the queue workers.
+
+    Queues an answer key task and one extraction task per exam file; every
+    extraction queues the evaluation of that student, and once an exam has
+    no grading tasks left its class analysis is refreshed. Tasks are keyed
+    by the exam and the content of the answer key and exam files, so
+    submitting the same files again does not grade them twice (failed tasks
+    are retried). Paths must be readable by every worker.
+
+    Args:
+        queue (WorkQueue): The shared queue
+        exam_id (str): ID of the exam
+        answer_key_path (str): Path to the answer key PDF or image
+        exam_paths (list): Paths to the students' exam files
+        exam_subject (str): Subject passed to the evaluation prompt
+        config (dict, optional): Application config, lets uploaded PDFs be fingerprinted from their sidecar
+
+    Returns:
+        dict: 'exam_id', 'exams' submitted and 'queued' (new or retried tasks)
+    """
+    key_fingerprint = file_fingerprint(answer_key_path, config)
+    answer_key_task = f"{exam_id}:{ANSWER_KEY_TASK}:{key_fingerprint}"
+    tasks = [_task(exam_id, ANSWER_KEY_TASK, answer_key_task, {'path': os.path.abspath(answer_key_path)})]
+    for i, exam_path in enumerate(exam_paths):
+        tasks.append(_task(exam_id, EXTRACT_TASK, f"{exam_id}:{EXTRACT_TASK}:{key_fingerprint}:"
+                                                  f"{file_fingerprint(exam_path, config)}",
+                           {'path': os.path.abspath(exam_path), 'default_student_id': f"student_{i + 1:02d}",
+                            'answer_key_task': answer_key_task, 'exam_subject': exam_subject}))
+    queued = queue.enqueue(tasks)
+    logger.info(f"Queued {queued} tasks for {len(exam_paths)} exams of {exam_id}")
+    return {'exam_id': exam_id, 'exams': len(exam_paths), 'queued': queued}
+
+
+class _Heartbeat:
+    """Keeps a task's lease alive from a background thread while the task runs."""
+
+    def __init__(self, queue, task, interval):
+        self.queue = queue
+        self.task = task
+        self.interval = interval
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, name=f"heartbeat-{task.task_id}", daemon=True)
+
+    def _beat(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if not self.queue.heartbeat(self.task):
+                    self.lost = True
+                    logger.warning(f"Lost the lease of task {self.task.task_key}")
+                    return
+            except Exception as e:  # A missed beat is retried; the lease outlasts a few of them
+                logger.warning(f"Heartbeat of task {self.task.task_key} failed: {str(e)}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+
+
+class QueueWorker:
+    """Pulls grading tasks from the shared WorkQueue and runs them.
+
+    Any number of workers, in any number of processes or on any node that
+    sees the same WORK_QUEUE_PATH, RESULTS_DIR and exam files, can run
+    side by side. Results are written to the ResultStore under the same
+    student IDs whichever worker (or how many, after a lost lease) runs a
+    task, so running a task twice rewrites the same result.
+    """
+
+    def __init__(self, config, queue=None, processor=None, analyzer=None, store=None, worker_id=None):
+        """Initialize the worker.
+
+        Args:
+            config (dict): Application settings
+            queue (WorkQueue, optional): Queue to work on, opened from config if None
+            processor (ExamProcessor, optional): Processor to use, created from config if None
+            analyzer (ExamAnalyzer, optional): Analyzer to use, created from config if None
+            store (ResultStore, optional): Result store, defaults to RESULTS_DIR
+            worker_id (str, optional): Name of the worker in leases, defaults to host and process ID
+        """
+        self.config = config
+        self.queue = queue or WorkQueue.from_config(config)
+        self.processor = processor or ExamProcessor(config=config)
+        self.analyzer = analyzer or ExamAnalyzer(config=config)
+        self.store = store or ResultStore.from_config(config)
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self._answer_keys = {}
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.stats = {'done': 0, 'retried': 0, 'failed': 0, 'postponed': 0, 'lost': 0}
+
+    def stop(self):
+        """Let the worker threads finish their current task and exit."""
+        self._stop.set()
+
+    def _count(self, outcome):
+        with self._stats_lock:
+            self.stats[outcome] += 1
+
+    def run(self, threads=None, exam_id=None, max_tasks=None, idle_exit=None):
+        """Work on the queue until stopped.
+
+        Args:
+            threads (int, optional): Tasks run concurrently, defaults to GRADING_WORKERS
+            exam_id (str, optional): Only work on tasks of this exam
+            max_tasks (int, optional): Stop after leasing this many tasks
+            idle_exit (float, optional): Stop once no task has been available for this many seconds
+
+        Returns:
+            dict: Task counts by outcome ('done', 'retried', 'failed', 'postponed', 'lost')
+        """
+        threads = max(1, threads or self.config.get('GRADING_WORKERS', 1))
+        budget = {'left': max_tasks}
+        budget_lock = threading.Lock()
+
+        def take(count):
+            """Reserve (count=1) or give back (count=-1) one task of the budget."""
+            with budget_lock:
+                if budget['left'] is not None:
+                    if count > 0 and budget['left'] <= 0:
+                        return False
+                    budget['left'] -= count
+                return True
+
+        workers = [threading.Thread(target=self._work, args=(f"{self.worker_id}:{i}", exam_id, take, idle_exit),
+                                    name=f"queue-worker-{i}") for i in range(threads)]
+        logger.info(f"Queue worker {self.worker_id} started with {threads} threads")
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        logger.info(f"Queue worker {self.worker_id} stopped: {self.stats}")
+        return dict(self.stats)
+
+    def _work(self, worker_id, exam_id, take, idle_exit):
+        poll_interval = self.config.get('WORK_QUEUE_POLL_INTERVAL', 2)
+        idle_since = time.monotonic()
+        while not self._stop.is_set():
+            if not take(1):
+                return
+            try:
+                task = self.queue.lease(worker_id, exam_id=exam_id)
+            except Exception as e:  # e.g. the database stayed locked; try again after the poll interval
+                logger.warning(f"Could not lease a task: {str(e)}")
+                task = None
+            if task is None:
+                take(-1)
+                if idle_exit is not None and time.monotonic() - idle_since >= idle_exit:
+                    return
+                self._stop.wait(poll_interval)
+                continue
+            self.run_task(task)
+            idle_since = time.monotonic()
+
+    def run_task(self, task):
+        """Run a leased task and complete it, or give it back on errors."""
+        # The worker finishing (or failing for good) the last grading task of an exam queues its analysis
+        when_drained = None
+        if task.kind in GRADING_TASKS:
+            when_drained = {'kinds': GRADING_TASKS,
+                            'task': _task(task.exam_id, ANALYZE_TASK, f"{task.exam_id}:{ANALYZE_TASK}:{task.task_id}",
+                                          {'answer_key_task': task.payload.get('answer_key_task', task.task_key)})}
+        handler = getattr(self, f"_run_{task.kind}")
+        interval = max(1.0, self.queue.visibility_timeout / 3)
+        try:
+            with _Heartbeat(self.queue, task, interval) as heartbeat, track(f"task_{task.kind}"), \
+                    exam_usage(self.config, task.exam_id, source='queue'):
+                outcome = handler(task, heartbeat)
+        except Exception as e:
+            logger.error(f"Task {task.task_key} failed (attempt {task.attempts}): {str(e)}")
+            status = self.queue.fail(task, str(e), retry_delay=min(300, 10 * 2 ** (task.attempts - 1)),
+                                     when_drained=when_drained)
+            self._count('failed' if status == FAILED else 'retried' if status else 'lost')
+            return
+
+        if outcome is None:
+            self._count('postponed')
+            return
+        result, follow_ups = outcome
+        if heartbeat.lost or not self.queue.complete(task, result, follow_ups, when_drained):
+            self._count('lost')
+        else:
+            self._count('done')
+
+    def _answer_key(self, task_key):
+        """Return the AnswerKey produced by an answer key task, 'failed', or None if it is not done yet."""
+        if task_key in self._answer_keys:
+            return self._answer_keys[task_key]
+        status, result, _ = self.queue.result(task_key) or (None, None, None)
+        if status == FAILED:
+            return 'failed'
+        if status != DONE:
+            return None
+        answer_key = self._answer_keys[task_key] = AnswerKey.from_dict(result)
+        return answer_key
+
+    def _run_answer_key(self, task, heartbeat):
+        with usage_scope(student_id=ANSWER_KEY):
+            answer_key = self.processor.process_answer_key(task.payload['path'], task.exam_id, save=False)
+        if not heartbeat.lost:
+            with self.store.exam_lease(task.exam_id):
+                self.store.save_answer_key(answer_key)
+        return answer_key.to_dict(), []
+
+    def _run_extract(self, task, heartbeat):
+        payload = task.payload
+        with usage_scope(source_file=os.path.basename(payload['path'])) as usage_labels:
+            student_exam = self.processor.process_student_exam(payload['path'], payload['default_student_id'],
+                                                               task.exam_id, save=False)
+            usage_labels['student_id'] = student_exam.student_id
+        self.store.assign_student_id(student_exam)
+        evaluate_key = task.task_key.replace(f":{EXTRACT_TASK}:", f":{EVALUATE_TASK}:", 1)
+        evaluate = _task(task.exam_id, EVALUATE_TASK, evaluate_key,
+                         {'student_exam': student_exam.to_dict(), 'answer_key_task': payload['answer_key_task'],
+                          'exam_subject': payload['exam_subject']})
+        return {'student_id': student_exam.student_id}, [evaluate]
+
+    def _run_evaluate(self, task, heartbeat):
+        payload = task.payload
+        answer_key = self._answer_key(payload['answer_key_task'])
+        if answer_key == 'failed':
+            raise ValueError(f"The answer key of {task.exam_id} could not be processed")
+        if answer_key is None:
+            self.queue.postpone(task, ANSWER_KEY_WAIT)
+            return None
+
+        student_exam = StudentExam.from_dict(payload['student_exam'])
+        with usage_scope(student_id=student_exam.student_id, source_file=student_exam.source_file):
+            student_exam = self.processor.compare_with_answer_key(student_exam, answer_key, payload['exam_subject'],
+                                                                  save=False)
+        if not heartbeat.lost:
+            self.store.save_student_exam(student_exam)
+        return {'student_id': student_exam.student_id, 'score': student_exam.score}, []
+
+    def _run_analyze(self, task, heartbeat):
+        answer_key = self._answer_key(task.payload['answer_key_task'])
+        if not isinstance(answer_key, AnswerKey):
+            answer_key = self.store.load_answer_key(task.exam_id)
+        with self.store.exam_lease(task.exam_id):
+            student_exams = self.store.load_student_exams(task.exam_id)
+            if not student_exams or heartbeat.lost:
+                return {'students': len(student_exams)}, []
+            self.analyzer.analyze_exam(task.exam_id, student_exams, answer_key)
+        return {'students': len(student_exams)}, []
@@ -0,0 +1,275 @@
+# regrader.py
+import os
+import logging
+
+from app.services.exam_processor import ExamProcessor
+from app.services.analyzer import ExamAnalyzer
+from app.services.result_store import ResultStore
+from app.services.usage import exam_usage, usage_scope, summarize_usage, ANSWER_KEY
+
+logger = logging.getLogger(__name__)
+
+
+class Regrader:
+    """Re-runs only the failed parts of a graded exam instead of the whole class.
+
+    Picks up answers marked `not_evaluated` (the evaluation call failed or
+    returned partial JSON) and students whose extraction came back as
+    unparsed `raw_text`, re-processes just those, and updates the stored
+    scores and analysis in place. When the answer key changes, only the
+    answers to the changed questions are re-evaluated, using the stored
+    extracted answers.
+    """
+
+    def __init__(self, config, processor=None, analyzer=None, store=None):
+        """Initialize the regrader.
+
+        Args:
+            config (dict): Application settings
+            processor (ExamProcessor, optional): Processor to use, created from config if None
+            analyzer (ExamAnalyzer, optional): Analyzer to use, created from config if None
+            store (ResultStore, optional): Result store, defaults to RESULTS_DIR
+        """
+        self.config = config
+        self.processor = processor or ExamProcessor(config=config)
+        self.analyzer = analyzer or ExamAnalyzer(config=config)
+        self.store = store or ResultStore.from_config(config)
+
+    @staticmethod
+    def find_pending(student_exams):
+        """Find work that needs to be redone.
+
+        Args:
+            student_exams (list): StudentExam objects of one exam
+
+        Returns:
+            tuple: (students whose extraction failed, (StudentExam, QuestionAnswer)
+                tuples of answers that were not evaluated)
+        """
+        failed_extractions = [
+            student_exam for student_exam in student_exams
+            if not student_exam.answers and student_exam.raw_text is not None
+        ]
+        not_evaluated = [
+            (student_exam, answer)
+            for student_exam in student_exams
+            for answer in student_exam.answers
+            if answer.error_type == "not_evaluated"
+        ]
+        return failed_extractions, not_evaluated
+
+    def _reextract(self, student_exam, exam_id):
+        """Run answer extraction again for a student, keeping their ID so the result updates in place.
+
+        Returns:
+            bool: True if answers were extracted this time
+        """
+        if not student_exam.source_file:
+            logger.warning(f"Cannot re-extract {student_exam.student_id}: source file unknown")
+            return False
+
+        exam_path = os.path.join(self.config['EXAMS_DIR'], student_exam.source_file)
+        if not os.path.exists(exam_path):
+            logger.warning(f"Cannot re-extract {student_exam.student_id}: {exam_path} not found")
+            return False
+
+        with usage_scope(student_id=student_exam.student_id):
+            extracted = self.processor.process_student_exam(exam_path, student_exam.student_id, exam_id,
+                                                            save=False)
+        if not extracted.answers:
+            student_exam.raw_text = extracted.raw_text
+            return False
+
+        student_exam.answers = extracted.answers
+        student_exam.raw_text = None
+        if extracted.student_name and extracted.student_name != "Unknown":
+            student_exam.student_name = extracted.student_name
+        return True
+
+    @staticmethod
+    def _clear_evaluation(answer):
+        """Remove the evaluation of an answer to a question the answer key no longer has."""
+        answer.is_correct = None
+        answer.error_type = None
+        answer.evaluation_reason = None
+        answer.misconception = None
+        answer.reference_to_answer = None
+        answer.learning_topics = []
+
+    @staticmethod
+    def _normalize_answer(text):
+        return ' '.join(str(text).split()).casefold() if text is not None else None
+
+    @classmethod
+    def diff_answer_keys(cls, old_key, new_key):
+        """Compare two answer keys question by question.
+
+        Whitespace and case differences are ignored, since re-extracting the same
+        key rarely reproduces it byte for byte.
+
+        Returns:
+            dict: Sorted lists of 'changed', 'added' and 'removed' question numbers
+        """
+        old_answers = old_key.answers if old_key else {}
+        new_answers = new_key.answers
+        return {
+            'changed': sorted(q for q in new_answers if q in old_answers
+                              and cls._normalize_answer(new_answers[q]) != cls._normalize_answer(old_answers[q])),
+            'added': sorted(q for q in new_answers if q not in old_answers),
+            'removed': sorted(q for q in old_answers if q not in new_answers)
+        }
+
+    def _usage_totals(self, ledger):
+        """Return the token and cost totals of the calls recorded in a ledger."""
+        return summarize_usage(ledger.records(), self.config.get('GEMINI_PRICES', {}))['totals']
+
+    def regrade_for_key(self, exam_id, new_answer_key, exam_subject="English"):
+        """Re-evaluate only the answers whose reference answer changed in a new answer key.
+
+        Args:
+            exam_id (str): ID of the exam
+            new_answer_key (AnswerKey): The corrected answer key
+            exam_subject (str): Subject passed to the evaluation prompt
+
+        Returns:
+            dict: The key 'diff', counts of 'answers' sent for evaluation, 'evaluated'
+                answers, answers to removed questions 'cleared', 'students' updated and
+                'questions' refreshed, and the model 'usage'
+        """
+        # The lease keeps grading runs and other regrades of the exam from rewriting its results meanwhile
+        with self.store.exam_lease(exam_id), exam_usage(self.config, exam_id, source='regrade') as (ledger, _), \
+                self.store.group_commit():
+            summary = self._regrade_for_key(exam_id, new_answer_key, exam_subject)
+            summary['usage'] = self._usage_totals(ledger)
+        logger.info(f"Key regrade of {exam_id} finished: {summary}")
+        return summary
+
+    def _regrade_for_key(self, exam_id, new_answer_key, exam_subject):
+        """Store a new answer key and re-evaluate the answers to its changed questions; see regrade_for_key."""
+        old_answer_key = self.store.load_answer_key(exam_id)
+        diff = self.diff_answer_keys(old_answer_key, new_answer_key)
+        affected_questions = set(diff['changed']) | set(diff['added']) | set(diff['removed'])
+        logger.info(f"Answer key of {exam_id} changed: {diff}")
+
+        # Keep locations of unchanged answers if the new key came without them
+        if old_answer_key is not None:
+            for question_number, location in old_answer_key.answer_locations.items():
+                if question_number in new_answer_key.answers and question_number not in affected_questions:
+                    new_answer_key.answer_locations.setdefault(question_number, location)
+        new_answer_key.exam_id = exam_id
+        self.store.save_answer_key(new_answer_key)
+
+        student_exams = self.store.load_student_exams(exam_id)
+        removed_questions = set(diff['removed'])
+        items = []
+        retired = []
+        for student_exam in student_exams:
+            for answer in student_exam.answers:
+                if answer.question_number in removed_questions:
+                    retired.append((student_exam, answer))
+                elif answer.question_number in affected_questions:
+                    items.append((student_exam, answer))
+
+        evaluated = 0
+        if items:
+            evaluated = self.processor.reevaluate_answers(
+                items, new_answer_key, exam_subject, batch_size=self.config.get('REGRADE_BATCH_SIZE', 20))
+
+        # Answers to questions the key no longer has can't be evaluated; drop their old verdict
+        for _, answer in retired:
+            self._clear_evaluation(answer)
+        for student_exam in {id(student_exam): student_exam for student_exam, _ in retired}.values():
+            self.processor.recompute_score(student_exam)
+
+        changed_students = {id(student_exam): student_exam for student_exam, _ in items + retired}
+        for student_exam in changed_students.values():
+            self.store.save_student_exam(student_exam)
+
+        if affected_questions and student_exams:
+            self.analyzer.update_analysis(exam_id, student_exams, new_answer_key, affected_questions)
+
+        return {
+            'exam_id': exam_id,
+            'diff': diff,
+            'answers': len(items),
+            'evaluated': evaluated,
+            'cleared': len(retired),
+            'students': len(changed_students),
+            'questions': len(affected_questions)
+        }
+
+    def regrade_with_key_file(self, exam_id, answer_key_path, exam_subject="English"):
+        """Extract a corrected answer key file and regrade the questions that changed.
+
+        Returns:
+            dict: Summary, see regrade_for_key
+        """
+        with exam_usage(self.config, exam_id, source='regrade'), usage_scope(student_id=ANSWER_KEY):
+            new_answer_key = self.processor.process_answer_key(answer_key_path, exam_id, save=False)
+        if not new_answer_key.answers:
+            raise ValueError(f"No answers could be extracted from {os.path.basename(answer_key_path)}")
+        return self.regrade_for_key(exam_id, new_answer_key, exam_subject)
+
+    def regrade(self, exam_id, exam_subject="English", reextract=True):
+        """Re-process failed extractions and not_evaluated answers of an exam.
+
+        Args:
+            exam_id (str): ID of the exam
+            exam_subject (str): Subject passed to the evaluation prompt
+            reextract (bool): Whether to re-run extraction for raw_text results
+
+        Returns:
+            dict: Counts of 'reextracted' students, 'answers' sent for evaluation,
+                'evaluated' answers, 'students' updated and 'questions' refreshed,
+                and the model 'usage'
+
+        Raises:
+            ValueError: If the exam has no stored answer key
+        """
+        answer_key = self.store.load_answer_key(exam_id)
+        if answer_key is None:
+            raise ValueError(f"No answer key stored for exam {exam_id}")
+
+        # The lease keeps grading runs and other regrades of the exam from rewriting its results meanwhile
+        with self.store.exam_lease(exam_id), exam_usage(self.config, exam_id, source='regrade') as (ledger, _), \
+                self.store.group_commit():
+            summary = self._regrade(exam_id, answer_key, exam_subject, reextract)
+            summary['usage'] = self._usage_totals(ledger)
+        logger.info(f"Regrade of {exam_id} finished: {summary}")
+        return summary
+
+    def _regrade(self, exam_id, answer_key, exam_subject, reextract):
+        """Retry the failed extractions and not evaluated answers of an exam; see regrade."""
+        student_exams = self.store.load_student_exams(exam_id)
+        failed_extractions, items = self.find_pending(student_exams)
+        logger.info(f"Regrading {exam_id}: {len(failed_extractions)} failed extractions, "
+                    f"{len(items)} not evaluated answers")
+
+        reextracted = 0
+        if reextract:
+            for student_exam in failed_extractions:
+                if self._reextract(student_exam, exam_id):
+                    reextracted += 1
+                    items.extend((student_exam, answer) for answer in student_exam.answers)
+
+        evaluated = 0
+        if items:
+            evaluated = self.processor.reevaluate_answers(
+                items, answer_key, exam_subject, batch_size=self.config.get('REGRADE_BATCH_SIZE', 20))
+
+        changed_students = {id(student_exam): student_exam for student_exam, _ in items}
+        for student_exam in changed_students.values():
+            self.store.save_student_exam(student_exam)
+
+        changed_questions = {answer.question_number for _, answer in items}
+        if changed_questions:
+            self.analyzer.update_analysis(exam_id, student_exams, answer_key, changed_questions)
+
+        return {
+            'exam_id': exam_id,
+            'reextracted': reextracted,
+            'answers': len(items),
+            'evaluated': evaluated,
+            'students': len(changed_students),
+            'questions': len(changed_questions)
+        }
@@ -0,0 +1,218 @@
+# render_cache.py
+import os
+import json
+import queue
+import hashlib
+import logging
+import tempfile
+import threading
+
+from app.services.pdf_highlighter import PDFHighlighter
+from app.utils.metrics import track, record_cache
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever PDFHighlighter output changes so stale renders are never served
+RENDER_VERSION = 2
+
+# Pre-render batches waiting for the background renderer, created on first use
+_prerender_queue = None
+_prerender_lock = threading.Lock()
+
+
+def file_fingerprint(path):
+    """Build a cheap identity string for a file from its path, size and mtime.
+
+    Args:
+        path (str): Path to the file
+
+    Returns:
+        str: Fingerprint that changes whenever the file is replaced or modified
+    """
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class HighlightCache:
+    """Disk cache of highlighted PDFs keyed by source document, answers and mode."""
+
+    def __init__(self, cache_dir):
+        """Initialize the cache.
+
+        Args:
+            cache_dir (str): Directory where rendered PDFs are stored
+        """
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def cache_key(self, original_pdf_path, answer_locations, errors_only):
+        """Compute the cache key for a highlighted render.
+
+        Args:
+            original_pdf_path (str): Path to the original exam PDF
+            answer_locations (list): Answer locations as passed to the highlighter
+            errors_only (bool): Highlight mode
+
+        Returns:
+            str: Hex digest identifying the render
+        """
+        payload = json.dumps({
+            "source": file_fingerprint(original_pdf_path),
+            "answers": answer_locations,
+            "errors_only": bool(errors_only),
+            "version": RENDER_VERSION
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path_for(self, key):
+        """Return the on-disk path for a cache key."""
+        return os.path.join(self.cache_dir, key[:2], f"{key}.pdf")
+
+    def get(self, key):
+        """Return the cached file path for a key, or None if it is not cached."""
+        path = self.path_for(key)
+        return path if os.path.exists(path) else None
+
+    def put(self, key, pdf_bytes):
+        """Store rendered PDF bytes atomically under a key.
+
+        Args:
+            key (str): Cache key
+            pdf_bytes (bytes): The rendered PDF
+
+        Returns:
+            str: Path to the cached file
+        """
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temp file in the same directory and rename so that
+        # concurrent readers never see a partially written PDF
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(pdf_bytes)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return path
+
+    def get_or_render(self, original_pdf_path, answer_locations, errors_only=True):
+        """Return a cached highlighted PDF, rendering it on a cache miss.
+
+        Args:
+            original_pdf_path (str): Path to the original exam PDF
+            answer_locations (list): Formatted answer locations for highlighting
+            errors_only (bool): If True, only highlight incorrect answers
+
+        Returns:
+            tuple: (path to the highlighted PDF, cache key)
+        """
+        key = self.cache_key(original_pdf_path, answer_locations, errors_only)
+        path = self.get(key)
+        record_cache('highlight', path is not None)
+        if path:
+            logger.info(f"Highlight cache hit for {original_pdf_path} (errors_only={errors_only})")
+            return path, key
+
+        logger.info(f"Highlight cache miss for {original_pdf_path} (errors_only={errors_only})")
+        with track('highlight_render'):
+            pdf_bytes = PDFHighlighter.create_highlighted_pdf(
+                original_pdf_path,
+                answer_locations,
+                errors_only=errors_only
+            )
+        return self.put(key, pdf_bytes), key
+
+    def store_render(self, original_pdf_path, answer_locations, errors_only, pdf_bytes):
+        """Store a render produced elsewhere (e.g. in a worker process).
+
+        Returns:
+            str: Path to the cached file
+        """
+        return self.put(self.cache_key(original_pdf_path, answer_locations, errors_only), pdf_bytes)
+
+    def render_batch(self, jobs, max_workers=None):
+        """Resolve many renders, reusing cached files and rendering the rest in a process pool.
+
+        Args:
+            jobs (list): (original_pdf_path, answer_locations, errors_only) tuples
+            max_workers (int, optional): Number of render worker processes
+
+        Yields:
+            tuple: (job index, path to the highlighted PDF or None on failure),
+                cached renders first and then in completion order
+        """
+        pending = []
+        pending_indexes = []
+        for index, job in enumerate(jobs):
+            path = self.get(self.cache_key(*job))
+            record_cache('highlight', path is not None)
+            if path:
+                yield index, path
+            else:
+                pending.append(job)
+                pending_indexes.append(index)
+
+        logger.info(f"Highlight batch: {len(jobs) - len(pending)} cached, {len(pending)} to render")
+
+        for pending_index, path in PDFHighlighter.render_batch(pending, max_workers, store=self.store_render):
+            yield pending_indexes[pending_index], path
+
+    def prerender(self, jobs, max_workers=None):
+        """Render and cache a batch of highlighted PDFs, e.g. right after grading.
+
+        Args:
+            jobs (list): (original_pdf_path, answer_locations, errors_only) tuples
+            max_workers (int, optional): Number of render worker processes
+
+        Returns:
+            int: Number of renders available in the cache afterwards
+        """
+        rendered = sum(1 for _, path in self.render_batch(jobs, max_workers) if path)
+        logger.info(f"Pre-rendered {rendered}/{len(jobs)} highlighted PDFs into {self.cache_dir}")
+        return rendered
+
+
+def _prerender_loop(batches):
+    """Render queued pre-render batches one after another (runs in a daemon thread)."""
+    while True:
+        cache_dir, jobs, max_workers = batches.get()
+        try:
+            HighlightCache(cache_dir).prerender(jobs, max_workers)
+        except Exception as e:
+            logger.error(f"Pre-rendering {len(jobs)} highlighted PDFs failed: {str(e)}")
+        finally:
+            batches.task_done()
+
+
+def schedule_prerender(cache_dir, jobs, max_workers=None, max_queued=4):
+    """Queue a batch of renders for the process-wide background renderer.
+
+    One thread renders the batches in turn on the shared render pool, so
+    several grading requests finishing at once never render in parallel.
+
+    Args:
+        cache_dir (str): Highlight cache directory
+        jobs (list): (original_pdf_path, answer_locations, errors_only) tuples
+        max_workers (int, optional): Number of render worker processes
+        max_queued (int): Batches that may wait; the size is fixed by the first call
+
+    Returns:
+        bool: True if the batch was queued, False if the queue was full and it was skipped
+    """
+    global _prerender_queue
+    with _prerender_lock:
+        if _prerender_queue is None:
+            _prerender_queue = queue.Queue(maxsize=max_queued)
+            threading.Thread(target=_prerender_loop, args=(_prerender_queue,), name='highlight-prerender',
+                             daemon=True).start()
+    try:
+        _prerender_queue.put_nowait((cache_dir, jobs, max_workers))
+    except queue.Full:
+        logger.warning(f"Pre-render queue is full, not pre-rendering {len(jobs)} highlighted PDFs")
+        return False
+    return True
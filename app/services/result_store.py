@@ -0,0 +1,473 @@
+# result_store.py
+import os
+import time
+import itertools
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from app.models.data_model import StudentExam, AnswerKey
+from app.utils.metrics import track, record_result_write
+from app.utils.file_utils import atomic_write, fsync_directory, validate_exam_id
+from app.utils.file_lock import FileLock
+from app.utils import fast_json
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, results are stored as JSON without it
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+
+class ResultFormat:
+    """Serialization of result documents (the dicts produced by the models' to_dict)."""
+
+    def __init__(self, name, extension, encode, decode, requires=None, available=True):
+        """Initialize the format.
+
+        Args:
+            name (str): Name used in RESULT_FORMAT
+            extension (str): File extension including the dot
+            encode (callable): dict -> bytes
+            decode (callable): bytes -> dict
+            requires (str, optional): Package that must be installed to use the format
+            available (bool): Whether that package is installed
+        """
+        self.name = name
+        self.extension = extension
+        self.encode = encode
+        self.decode = decode
+        self.requires = requires
+        self.available = available
+
+
+RESULT_FORMATS = {
+    # Pretty-printed JSON, readable and the default
+    'json': ResultFormat('json', '.json', lambda data: fast_json.dumps(data, indent=True).encode('utf-8'),
+                         fast_json.loads),
+    # MessagePack: the same document model in a compact binary encoding (floats stay 64-bit, so
+    # converting to and from JSON is lossless)
+    'msgpack': ResultFormat('msgpack', '.msgpack',
+                            lambda data: msgpack.packb(data, use_bin_type=True),
+                            lambda data: msgpack.unpackb(data, raw=False, strict_map_key=False),
+                            requires='msgpack', available=msgpack is not None),
+}
+
+
+def get_result_format(name):
+    """Return the ResultFormat called name.
+
+    Raises:
+        ValueError: If the format is unknown or its package is not installed
+    """
+    result_format = RESULT_FORMATS.get(name)
+    if result_format is None:
+        raise ValueError(f"Unknown result format: {name} (choose from {', '.join(RESULT_FORMATS)})")
+    if not result_format.available:
+        raise ValueError(f"Result format {name} needs the {result_format.requires} package (pip install "
+                         f"{result_format.requires})")
+    return result_format
+
+
+# Write batch of the group commit the current context runs in, if any
+_current_batch = contextvars.ContextVar('result_write_batch', default=None)
+
+
+class WriteBatch:
+    """Result writes buffered during a group commit.
+
+    Pending writes are keyed by result file, so saving the same result again
+    before the batch is flushed replaces the pending data instead of writing
+    the file twice. The batch is shared by every ResultStore used in the
+    group commit's context, including worker threads started with a copy of
+    that context.
+    """
+
+    def __init__(self, max_pending, max_seconds):
+        """Initialize the batch.
+
+        Args:
+            max_pending (int): Flush once this many results are pending
+            max_seconds (float): Flush on the next write once the oldest pending result is this old
+        """
+        self.max_pending = max_pending
+        self.max_seconds = max_seconds
+        self._pending = {}  # (results_dir, stem) -> (ResultStore, data, ResultFormat)
+        self._oldest = None
+        self._lock = threading.Lock()
+        # Flushes are serialized so an older batch never lands after a newer one
+        self._commit_lock = threading.Lock()
+
+    def add(self, store, stem, data, result_format):
+        """Buffer a write, flushing the batch if it is full or old enough."""
+        with self._lock:
+            key = (store.results_dir, stem)
+            if key in self._pending:
+                record_result_write('coalesced')
+            elif not self._pending:
+                self._oldest = time.monotonic()
+            self._pending[key] = (store, data, result_format)
+            due = (len(self._pending) >= self.max_pending
+                   or time.monotonic() - self._oldest >= self.max_seconds)
+        if due:
+            self.flush()
+
+    def get(self, results_dir, stem):
+        """Return the pending (data, ResultFormat) of a result, or None."""
+        with self._lock:
+            pending = self._pending.get((results_dir, stem))
+        return pending[1:] if pending else None
+
+    def has_pending(self, results_dir):
+        with self._lock:
+            return any(key[0] == results_dir for key in self._pending)
+
+    def flush(self):
+        """Write all pending results, syncing each results folder once."""
+        with self._commit_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            directories = {}
+            for (results_dir, stem), (store, data, result_format) in pending.items():
+                store._commit(stem, data, result_format, sync_directory=False)
+                if store.fsync:
+                    directories[results_dir] = True
+            for results_dir in directories:
+                fsync_directory(results_dir)
+            logger.debug(f"Group commit wrote {len(pending)} results")
+
+
+class ResultStore:
+    """Reads and writes grading results (student exams, answer keys, analyses).
+
+    Results live in RESULTS_DIR as `<student_id>_<exam_id><ext>`,
+    `key_<exam_id><ext>` and `analysis_<exam_id><ext>`, where the extension
+    depends on the result format. New results are written in the configured
+    format; results in any available format are read, so a folder can be
+    switched to another format without converting it first.
+
+    Files are replaced atomically (temporary file, fsync, rename), so a
+    reader never sees a partially written result. Inside group_commit()
+    writes are buffered, repeated writes of the same result are coalesced,
+    and the batch is written and synced together.
+
+    Several processes can share one results folder: exam-wide updates (answer
+    key, analysis) are made under an exam lease, exam files are claimed by
+    the worker grading them, and student IDs are assigned so that two exam
+    files never share a result. The lock and claim files live in `.locks`.
+    """
+
+    def __init__(self, results_dir, result_format='json', fsync=True, group_commit_size=50,
+                 group_commit_seconds=2.0, lock_timeout=600):
+        """Initialize the store.
+
+        Args:
+            results_dir (str): Directory holding the result files
+            result_format (str): Format new results are written in ('json' or 'msgpack')
+            fsync (bool): Flush every result to disk before it replaces the old file
+            group_commit_size (int): Pending results that trigger a flush in group_commit();
+                0 disables buffering
+            group_commit_seconds (float): Age of the oldest pending result that triggers a flush
+            lock_timeout (float, optional): Seconds to wait for an exam lease; None waits indefinitely
+        """
+        self.results_dir = results_dir
+        self.format = get_result_format(result_format)
+        self.fsync = fsync
+        self.group_commit_size = group_commit_size
+        self.group_commit_seconds = group_commit_seconds
+        self.lock_timeout = lock_timeout
+        self.lock_dir = os.path.join(results_dir, '.locks')
+        # Formats tried when reading, the configured one first
+        self.read_formats = [self.format] + [f for f in RESULT_FORMATS.values()
+                                             if f is not self.format and f.available]
+
+    @classmethod
+    def from_config(cls, config):
+        """Create the store for RESULTS_DIR from the RESULT_* settings."""
+        return cls(config['RESULTS_DIR'], config.get('RESULT_FORMAT', 'json'),
+                   fsync=config.get('RESULT_FSYNC', True),
+                   group_commit_size=config.get('RESULT_GROUP_COMMIT_SIZE', 50),
+                   group_commit_seconds=config.get('RESULT_GROUP_COMMIT_SECONDS', 2.0),
+                   lock_timeout=config.get('RESULT_LOCK_TIMEOUT', 600))
+
+    def exam_lease(self, exam_id, timeout=None):
+        """Return the lease on an exam's shared results, to be held with `with`.
+
+        Holders are serialized across processes. Hold it while reading and
+        rewriting exam-wide results (answer key, analysis) or while starting
+        a run, so concurrent runs of one exam do not overwrite each other.
+
+        Args:
+            exam_id (str): ID of the exam
+            timeout (float, optional): Seconds to wait, defaults to lock_timeout
+
+        Returns:
+            FileLock: The (not yet acquired) lease; entering it raises LockTimeout on timeout
+        """
+        return FileLock(os.path.join(self.lock_dir, f"exam_{exam_id}.lock"),
+                        timeout=self.lock_timeout if timeout is None else timeout)
+
+    def claim(self, exam_id, item_key):
+        """Claim an exam file for grading, unless another worker is grading it.
+
+        Args:
+            exam_id (str): ID of the exam
+            item_key (str): Identifies the exam file, e.g. its content fingerprint
+
+        Returns:
+            FileLock: The held claim, to be released when the student is saved, or None
+                if the file is claimed elsewhere
+        """
+        claim = FileLock(os.path.join(self.lock_dir, validate_exam_id(exam_id), 'items', f"{item_key}.lock"))
+        return claim if claim.acquire(blocking=False) else None
+
+    def assign_student_id(self, student_exam):
+        """Make a student's ID unique among the exam files of their exam.
+
+        IDs derived from names can collide (two students with the same name,
+        or names that sanitize alike), which would overwrite one result with
+        the other. Each ID is claimed by the exam file (source_file) that
+        first used it; a different file with the same ID gets `<id>_2`,
+        `<id>_3`, ... The same file always gets the same ID back, so regrades
+        and resumed runs update its result in place.
+
+        Args:
+            student_exam (StudentExam): The student; student_id is updated in place
+
+        Returns:
+            str: The assigned student ID
+        """
+        source = student_exam.source_file
+        if not source:
+            return student_exam.student_id
+
+        exam_id = validate_exam_id(student_exam.exam_id)
+        claims_dir = os.path.join(self.lock_dir, exam_id, 'ids')
+        base_id = student_exam.student_id
+        with FileLock(os.path.join(self.lock_dir, f"ids_{exam_id}.lock"), timeout=self.lock_timeout):
+            for number in itertools.count(1):
+                candidate = base_id if number == 1 else f"{base_id}_{number}"
+                claim_path = os.path.join(claims_dir, candidate)
+                if os.path.exists(claim_path):
+                    with open(claim_path, 'r', encoding='utf-8') as f:
+                        owner = f.read()
+                else:
+                    # Results saved before IDs were claimed belong to the file recorded in them
+                    existing = self._read(f"{candidate}_{exam_id}")
+                    owner = existing.get('source_file') if existing else None
+                    if owner is None or owner == source:
+                        os.makedirs(claims_dir, exist_ok=True)
+                        atomic_write(claim_path, source.encode('utf-8'), fsync=self.fsync)
+                        owner = source
+                if owner == source:
+                    break
+
+        if candidate != base_id:
+            logger.info(f"Student ID {base_id} of exam {exam_id} is taken, using {candidate} for {source}")
+        student_exam.student_id = candidate
+        return candidate
+
+    @contextmanager
+    def group_commit(self, max_pending=None, max_seconds=None):
+        """Buffer and coalesce result writes made in this context, writing them together.
+
+        Meant for batch runs: every result saved in the context (by any
+        ResultStore, also from worker threads running in a copy of the
+        context) is held until max_pending results are pending or the oldest
+        is max_seconds old, and everything left is written when the context
+        exits, also on errors. Nested group commits join the outer one.
+
+        Args:
+            max_pending (int, optional): Defaults to group_commit_size
+            max_seconds (float, optional): Defaults to group_commit_seconds
+
+        Yields:
+            WriteBatch: The active batch, or None if buffering is disabled
+        """
+        max_pending = self.group_commit_size if max_pending is None else max_pending
+        if _current_batch.get() is not None or max_pending <= 0:
+            yield _current_batch.get()
+            return
+
+        batch = WriteBatch(max_pending, self.group_commit_seconds if max_seconds is None else max_seconds)
+        token = _current_batch.set(batch)
+        try:
+            yield batch
+        finally:
+            _current_batch.reset(token)
+            batch.flush()
+
+    def flush(self):
+        """Write the pending results of the active group commit, if any."""
+        batch = _current_batch.get()
+        if batch is not None:
+            batch.flush()
+
+    def _find(self, stem):
+        for result_format in self.read_formats:
+            path = os.path.join(self.results_dir, stem + result_format.extension)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def format_of(self, path):
+        """Return the ResultFormat of a result file from its extension, or None."""
+        for result_format in RESULT_FORMATS.values():
+            if path.endswith(result_format.extension):
+                return result_format
+        return None
+
+    def read_file(self, path):
+        """Read and decode a result file in any available format."""
+        with open(path, 'rb') as f:
+            return self.format_of(path).decode(f.read())
+
+    def _read(self, stem):
+        batch = _current_batch.get()
+        pending = batch.get(self.results_dir, stem) if batch is not None else None
+        if pending is not None:
+            return pending[0]
+        path = self._find(stem)
+        return self.read_file(path) if path else None
+
+    def _write(self, stem, data, result_format=None):
+        """Write a result now, or buffer it in the active group commit; returns its path."""
+        result_format = result_format or self.format
+        batch = _current_batch.get()
+        if batch is None:
+            return self._commit(stem, data, result_format)
+        batch.add(self, stem, data, result_format)
+        return os.path.join(self.results_dir, stem + result_format.extension)
+
+    def _commit(self, stem, data, result_format, sync_directory=True):
+        path = os.path.join(self.results_dir, stem + result_format.extension)
+        with track('save'):
+            atomic_write(path, result_format.encode(data), fsync=self.fsync)
+        # Drop copies in other formats so readers never see two versions of a result
+        for other in RESULT_FORMATS.values():
+            stale = os.path.join(self.results_dir, stem + other.extension)
+            if other is not result_format and os.path.exists(stale):
+                os.remove(stale)
+        if sync_directory and self.fsync:
+            fsync_directory(self.results_dir)
+        record_result_write('written')
+        return path
+
+    def student_path(self, student_id, exam_id):
+        """Return the path of a student's result file, or where it would be written if there is none."""
+        stem = f"{student_id}_{exam_id}"
+        return self._find(stem) or os.path.join(self.results_dir, stem + self.format.extension)
+
+    def list_student_files(self, exam_id):
+        """Return the filenames of all student results for an exam, sorted."""
+        # Results pending in a group commit are written first so they are listed too
+        batch = _current_batch.get()
+        if batch is not None and batch.has_pending(self.results_dir):
+            batch.flush()
+        suffixes = {f"_{exam_id}{f.extension}": f for f in self.read_formats}
+        files = {}
+        for filename in os.listdir(self.results_dir):
+            if filename.startswith('analysis_') or filename.startswith('key_'):
+                continue
+            for suffix in suffixes:
+                if filename.endswith(suffix):
+                    stem = filename[:-len(suffix)]
+                    # Prefer the configured format if a result exists in several
+                    if stem not in files or suffixes[suffix] is self.format:
+                        files[stem] = filename
+        return sorted(files.values())
+
+    def load_student_data(self, student_id, exam_id):
+        """Load a student's result as a dict, or None if there is none."""
+        return self._read(f"{student_id}_{exam_id}")
+
+    def iter_student_data(self, exam_id):
+        """Yield (filename, result dict) for every student result of an exam, ordered by filename."""
+        for filename in self.list_student_files(exam_id):
+            yield filename, self.read_file(os.path.join(self.results_dir, filename))
+
+    def load_student_exams(self, exam_id):
+        """Load every student result for an exam.
+
+        Returns:
+            list: StudentExam objects, ordered by result filename
+        """
+        return [StudentExam.from_dict(data) for _, data in self.iter_student_data(exam_id)]
+
+    def save_student_exam(self, student_exam):
+        """Save a student result, returning its path."""
+        return self._write(f"{student_exam.student_id}_{student_exam.exam_id}", student_exam.to_dict())
+
+    def load_answer_key(self, exam_id):
+        """Load the processed answer key of an exam, or None if it was never processed."""
+        data = self._read(f"key_{exam_id}")
+        return AnswerKey.from_dict(data) if data is not None else None
+
+    def save_answer_key(self, answer_key):
+        """Save a processed answer key, returning its path."""
+        return self._write(f"key_{answer_key.exam_id}", answer_key.to_dict())
+
+    def load_analysis(self, exam_id):
+        """Load the stored analysis of an exam as a dict, or None if there is none."""
+        return self._read(f"analysis_{exam_id}")
+
+    def save_analysis(self, analysis):
+        """Save an exam analysis, returning its path."""
+        return self._write(f"analysis_{analysis.exam_id}", analysis.to_dict())
+
+    def iter_analyses(self):
+        """Yield (filename, analysis dict) for every stored analysis."""
+        self.flush()
+        stems = {}
+        for filename in sorted(os.listdir(self.results_dir)):
+            result_format = self.format_of(filename)
+            if filename.startswith('analysis_') and result_format in self.read_formats:
+                stem = filename[:-len(result_format.extension)]
+                if stem not in stems or result_format is self.format:
+                    stems[stem] = filename
+        for filename in stems.values():
+            yield filename, self.read_file(os.path.join(self.results_dir, filename))
+
+    def convert(self, result_format, exam_id=None):
+        """Rewrite stored results in another format, checking each conversion is lossless.
+
+        Args:
+            result_format (str): Target format
+            exam_id (str, optional): Only convert the results of this exam
+
+        Returns:
+            dict: 'converted' and 'skipped' file counts and 'bytes_before'/'bytes_after'
+
+        Raises:
+            ValueError: If a converted file does not decode to the original document;
+                the original file is kept in that case
+        """
+        target = get_result_format(result_format)
+        stats = {'converted': 0, 'skipped': 0, 'bytes_before': 0, 'bytes_after': 0}
+        for filename in sorted(os.listdir(self.results_dir)):
+            source = self.format_of(filename)
+            if source is None or not source.available:
+                continue
+            stem = filename[:-len(source.extension)]
+            if exam_id is not None and not stem.endswith(f"_{exam_id}"):
+                continue
+            if source is target:
+                stats['skipped'] += 1
+                continue
+
+            path = os.path.join(self.results_dir, filename)
+            data = self.read_file(path)
+            encoded = target.encode(data)
+            if target.decode(encoded) != data:
+                raise ValueError(f"Converting {filename} to {target.name} would lose data")
+
+            stats['bytes_before'] += os.path.getsize(path)
+            new_path = self._commit(stem, data, target)
+            stats['bytes_after'] += os.path.getsize(new_path)
+            stats['converted'] += 1
+        logger.info(f"Converted {stats['converted']} result files in {self.results_dir} to {target.name}")
+        return stats
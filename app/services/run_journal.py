@@ -0,0 +1,200 @@
+# run_journal.py
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from app.services.pdf_metadata import stored_metadata
+
+logger = logging.getLogger(__name__)
+
+# Stages checkpointed for every student, in pipeline order
+STAGES = ('extracted', 'evaluated', 'saved')
+
+# Item key used for the answer key checkpoint of a run
+ANSWER_KEY_ITEM = '__answer_key__'
+
+# Block size used when fingerprinting files
+HASH_BLOCK_SIZE = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    exam_id TEXT NOT NULL,
+    inputs_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    summary TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_inputs ON runs (inputs_key, status);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    run_id TEXT NOT NULL,
+    item_key TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    payload TEXT,
+    recorded_at REAL NOT NULL,
+    PRIMARY KEY (run_id, item_key, stage)
+);
+"""
+
+
+def file_fingerprint(path, config=None):
+    """Return the hex SHA-256 digest of a file's content.
+
+    Args:
+        path (str): Path to the file
+        config (dict, optional): Application config; the digest of an uploaded PDF
+            is then taken from its metadata sidecar instead of reading the file
+
+    Returns:
+        str: Hex digest
+    """
+    if config is not None:
+        metadata = stored_metadata(config, path)
+        if metadata is not None:
+            return metadata['sha256']
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class RunJournal:
+    """Durable SQLite journal of completed grading stages.
+
+    Every finished stage (answer key, and extracted/evaluated/saved per student)
+    is committed as soon as it completes, so a run that dies halfway can be
+    resumed without repeating the model calls that already succeeded.
+    """
+
+    def __init__(self, db_path, journal_mode='WAL'):
+        """Open (and create if needed) the journal database.
+
+        Args:
+            db_path (str): Path to the SQLite file
+            journal_mode (str): SQLite journal mode; WAL does not work over NFS, use DELETE there
+        """
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        # One connection shared by the worker threads, serialized by a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(f'PRAGMA journal_mode={journal_mode}')
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def inputs_key(exam_id, answer_key_path, item_keys, config=None):
+        """Identify a run by its exam, answer key content and set of exam files."""
+        digest = hashlib.sha256(exam_id.encode('utf-8'))
+        digest.update(file_fingerprint(answer_key_path, config).encode('ascii'))
+        for item_key in sorted(item_keys):
+            digest.update(item_key.encode('utf-8'))
+        return digest.hexdigest()
+
+    def start_run(self, exam_id, inputs_key, resume=True):
+        """Start a run, or resume the latest unfinished run with the same inputs.
+
+        Args:
+            exam_id (str): ID of the exam
+            inputs_key (str): Key from inputs_key()
+            resume (bool): Whether an unfinished run may be resumed
+
+        Returns:
+            tuple: (run_id, True if an unfinished run was resumed)
+        """
+        with self._lock:
+            if resume:
+                row = self._conn.execute(
+                    "SELECT run_id FROM runs WHERE inputs_key = ? AND status = 'running' "
+                    "ORDER BY started_at DESC LIMIT 1", (inputs_key,)).fetchone()
+                if row:
+                    logger.info(f"Resuming grading run {row[0]} for exam {exam_id}")
+                    return row[0], True
+
+            run_id = uuid.uuid4().hex
+            self._conn.execute(
+                "INSERT INTO runs (run_id, exam_id, inputs_key, status, started_at) VALUES (?, ?, ?, 'running', ?)",
+                (run_id, exam_id, inputs_key, time.time()))
+            self._conn.commit()
+
+        logger.info(f"Started grading run {run_id} for exam {exam_id}")
+        return run_id, False
+
+    def record(self, run_id, item_key, stage, payload=None):
+        """Durably record a completed stage.
+
+        Args:
+            run_id (str): The run
+            item_key (str): The item, e.g. an exam file fingerprint or ANSWER_KEY_ITEM
+            stage (str): The completed stage
+            payload (dict, optional): JSON-serializable state needed to continue from this stage
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (run_id, item_key, stage, payload, recorded_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (run_id, item_key, stage, json.dumps(payload) if payload is not None else None, time.time()))
+            self._conn.commit()
+
+    def checkpoints(self, run_id, item_key):
+        """Return the completed stages of an item.
+
+        Returns:
+            dict: stage -> payload (None if the stage stored no payload)
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT stage, payload FROM checkpoints WHERE run_id = ? AND item_key = ?",
+                (run_id, item_key)).fetchall()
+        return {stage: json.loads(payload) if payload is not None else None for stage, payload in rows}
+
+    def saved_count(self, run_id):
+        """Return the number of items of a run with a 'saved' checkpoint (the answer key excluded)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(DISTINCT item_key) FROM checkpoints WHERE run_id = ? AND stage = 'saved' "
+                "AND item_key != ?", (run_id, ANSWER_KEY_ITEM)).fetchone()
+        return row[0]
+
+    def finish_run(self, run_id, summary=None):
+        """Mark a run as completed so it is no longer resumed."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE runs SET status = 'completed', finished_at = ?, summary = ? WHERE run_id = ?",
+                (time.time(), json.dumps(summary) if summary is not None else None, run_id))
+            self._conn.commit()
+
+    def list_runs(self, exam_id=None, limit=50):
+        """Return recent runs, newest first, with their number of saved students."""
+        query = ("SELECT r.run_id, r.exam_id, r.status, r.started_at, r.finished_at, "
+                 "(SELECT COUNT(*) FROM checkpoints c WHERE c.run_id = r.run_id AND c.stage = 'saved') "
+                 "FROM runs r")
+        params = []
+        if exam_id:
+            query += " WHERE r.exam_id = ?"
+            params.append(exam_id)
+        query += " ORDER BY r.started_at DESC LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [
+            {'run_id': run_id, 'exam_id': run_exam_id, 'status': status, 'started_at': started_at,
+             'finished_at': finished_at, 'saved': saved}
+            for run_id, run_exam_id, status, started_at, finished_at, saved in rows
+        ]
@@ -0,0 +1,267 @@
+# usage.py
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from app.utils.metrics import REGISTRY
+from app.utils.file_utils import validate_exam_id
+
+logger = logging.getLogger(__name__)
+
+MODEL_TOKENS = REGISTRY.counter(
+    'smartassess_model_tokens_total', 'Tokens sent to and received from the model.', ('model', 'stage', 'kind'))
+
+# Labels (exam_id, student_id, ...) and ledger of the work the current context is doing
+_scope = contextvars.ContextVar('usage_scope', default=None)
+
+# Label key under which calls that serve several students (e.g. batched regrades) are reported
+SHARED = '(shared)'
+# Student label of the answer key extraction calls
+ANSWER_KEY = '(answer key)'
+
+
+def usage_dir(config):
+    """Return the folder usage logs are kept in (USAGE_DIR or RESULTS_DIR/usage)."""
+    return config.get('USAGE_DIR') or os.path.join(config['RESULTS_DIR'], 'usage')
+
+
+class UsageLedger:
+    """Collects model call records and appends them to the usage log of an exam.
+
+    The log is a JSON lines file per exam, so every grading run, regrade and
+    watcher batch adds its calls to the same history.
+    """
+
+    def __init__(self, directory, exam_id):
+        """Initialize the ledger.
+
+        Args:
+            directory (str): Folder holding the usage logs
+            exam_id (str): Exam the calls are charged to
+
+        Raises:
+            ValueError: If exam_id is not safe to use as a file name
+        """
+        self.directory = directory
+        self.exam_id = validate_exam_id(exam_id)
+        self.path = os.path.join(directory, f"{exam_id}.jsonl")
+        self._records = []
+        self._lock = threading.Lock()
+
+    def add(self, record, labels):
+        with self._lock:
+            self._records.append((record, labels))
+
+    def records(self):
+        """Return the calls recorded so far, with their labels merged in."""
+        with self._lock:
+            return [dict(labels, **record) for record, labels in self._records]
+
+    def flush(self):
+        """Append the recorded calls to the usage log and clear them.
+
+        Returns:
+            list: The records written
+        """
+        records = self.records()
+        if not records:
+            return []
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path, 'a') as f:
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+        except OSError as e:
+            logger.warning(f"Could not write usage log {self.path}: {str(e)}")
+            return records
+        with self._lock:
+            del self._records[:len(records)]
+        return records
+
+
+def load_usage(directory, exam_id):
+    """Load all recorded calls of an exam.
+
+    Returns:
+        list: Call records, oldest first (empty if nothing was recorded)
+    """
+    path = os.path.join(directory, f"{validate_exam_id(exam_id)}.jsonl")
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping corrupt line in usage log {path}")
+    return records
+
+
+@contextmanager
+def usage_scope(ledger=None, **labels):
+    """Attribute the model calls made in this context to a ledger and labels.
+
+    Scopes nest: inner scopes inherit the ledger and labels of the enclosing one.
+    The yielded labels dict may be updated inside the scope (e.g. with the
+    student_id once it is known); records pick up the final values.
+
+    Yields:
+        dict: The labels of this scope
+    """
+    parent = _scope.get()
+    parent_ledger, parent_labels = parent if parent else (None, {})
+    scope_labels = dict(parent_labels, **labels)
+    token = _scope.set((ledger or parent_ledger, scope_labels))
+    try:
+        yield scope_labels
+    finally:
+        _scope.reset(token)
+
+
+def model_name(model):
+    """Return the short model name of a GenerativeModel (without the 'models/' prefix)."""
+    name = getattr(model, 'model_name', None) or type(model).__name__
+    return name.split('/', 1)[1] if name.startswith('models/') else name
+
+
+def record_call(model, stage, response, latency, retries, error=None):
+    """Record the usage of a model call in the metrics and the active ledger.
+
+    Args:
+        model: The model that was called
+        stage (str): Stage the call belongs to
+        response: The model response, or None if every attempt failed
+        latency (float): Seconds spent on the call, including retries
+        retries (int): Number of retried attempts
+        error (Exception, optional): Error of the last attempt, if the call failed
+
+    Returns:
+        dict: The call record
+    """
+    metadata = getattr(response, 'usage_metadata', None)
+    prompt_tokens = getattr(metadata, 'prompt_token_count', 0) or 0
+    output_tokens = getattr(metadata, 'candidates_token_count', 0) or 0
+    total_tokens = getattr(metadata, 'total_token_count', 0) or prompt_tokens + output_tokens
+    name = model_name(model)
+
+    MODEL_TOKENS.inc(prompt_tokens, model=name, stage=stage, kind='prompt')
+    MODEL_TOKENS.inc(output_tokens, model=name, stage=stage, kind='output')
+
+    record = {
+        'time': time.time(),
+        'stage': stage,
+        'model': name,
+        'prompt_tokens': prompt_tokens,
+        'output_tokens': output_tokens,
+        'total_tokens': total_tokens,
+        'latency': round(latency, 3),
+        'retries': retries,
+        'status': 'error' if error is not None else 'ok'
+    }
+    scope = _scope.get()
+    if scope and scope[0] is not None:
+        scope[0].add(record, scope[1])
+    return record
+
+
+def call_cost(record, prices):
+    """Return the cost of a call record.
+
+    Args:
+        record (dict): Call record with 'model', 'prompt_tokens' and 'output_tokens'
+        prices (dict): model -> {'input': price, 'output': price} per million tokens
+
+    Returns:
+        float: Cost in the currency of the price table (0.0 for unpriced models)
+    """
+    price = prices.get(record.get('model')) or {}
+    return (record.get('prompt_tokens', 0) * price.get('input', 0.0)
+            + record.get('output_tokens', 0) * price.get('output', 0.0)) / 1_000_000
+
+
+def _empty_group():
+    return {'calls': 0, 'errors': 0, 'retries': 0, 'prompt_tokens': 0, 'output_tokens': 0,
+            'total_tokens': 0, 'latency': 0.0, 'cost': 0.0}
+
+
+def _aggregate(records, prices, key):
+    groups = {}
+    for record in records:
+        group = groups.setdefault(key(record), _empty_group())
+        group['calls'] += 1
+        group['errors'] += record.get('status') == 'error'
+        group['retries'] += record.get('retries', 0)
+        group['prompt_tokens'] += record.get('prompt_tokens', 0)
+        group['output_tokens'] += record.get('output_tokens', 0)
+        group['total_tokens'] += record.get('total_tokens', 0)
+        group['latency'] += record.get('latency', 0.0)
+        group['cost'] += call_cost(record, prices)
+
+    for group in groups.values():
+        group['latency'] = round(group['latency'], 3)
+        group['cost'] = round(group['cost'], 6)
+    return groups
+
+
+def summarize_usage(records, prices):
+    """Aggregate call records into totals and per-stage, per-model, per-student and per-run usage.
+
+    Args:
+        records (list): Call records
+        prices (dict): Price table, see call_cost
+
+    Returns:
+        dict: 'totals' plus 'by_stage', 'by_model', 'by_student' and 'by_run' breakdowns,
+            each with calls, errors, retries, token counts, latency and cost
+    """
+    return {
+        'totals': _aggregate(records, prices, lambda record: 'all').get('all', _empty_group()),
+        'by_stage': _aggregate(records, prices, lambda record: record.get('stage')),
+        'by_model': _aggregate(records, prices, lambda record: record.get('model')),
+        'by_student': _aggregate(records, prices, lambda record: record.get('student_id') or SHARED),
+        'by_run': _aggregate(records, prices, lambda record: record.get('run_id') or SHARED)
+    }
+
+
+@contextmanager
+def exam_usage(config, exam_id, **labels):
+    """Record the model calls made in this context to the usage log of an exam.
+
+    The calls are appended to the log when the context exits, also when it
+    exits with an error, so failed runs are still accounted for.
+
+    Yields:
+        tuple: (UsageLedger, labels dict of the scope)
+    """
+    ledger = UsageLedger(usage_dir(config), exam_id)
+    with usage_scope(ledger, exam_id=exam_id, **labels) as scope_labels:
+        try:
+            yield ledger, scope_labels
+        finally:
+            ledger.flush()
+
+
+def usage_report(config, exam_id):
+    """Build the cost report of an exam from its usage log.
+
+    Returns:
+        dict: summarize_usage() of every recorded call, plus 'exam_id', 'currency',
+            'students' (number of students with attributed calls) and 'cost_per_student'
+    """
+    report = summarize_usage(load_usage(usage_dir(config), exam_id), config.get('GEMINI_PRICES', {}))
+    students = [student for student in report['by_student'] if student not in (SHARED, ANSWER_KEY)]
+    report.update({
+        'exam_id': exam_id,
+        'currency': config.get('GEMINI_PRICE_CURRENCY', 'USD'),
+        'students': len(students),
+        'cost_per_student': round(report['totals']['cost'] / len(students), 6) if students else 0.0
+    })
+    return report
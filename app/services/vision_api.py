@@ -3,42 +3,64 @@ import os
 import json
 import logging
 import base64
-import google.generativeai as genai
-from PIL import Image
 import sys
 
 # Add parent directory to path to import config
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from flask import current_app
+from app.services.model_calls import get_model, generate_content, retry_settings
+from app.services.pdf_metadata import stored_metadata
+from app.utils.metrics import track
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 
 class GeminiVisionAPI:
     """Wrapper for Google's Gemini Vision API."""
 
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, config=None):
         """Initialize the Gemini Vision API.
 
         Args:
             api_key (str, optional): API key for Gemini. Defaults to config value.
+            config (dict, optional): Configuration to use instead of the Flask app config,
+                so the API can be used outside a request/app context.
         """
-        self.api_key = api_key or current_app.config['GEMINI_API_KEY']
+        if config is None:
+            from flask import current_app
+            config = current_app.config
+        self.config = config
+        self.api_key = api_key or self.config['GEMINI_API_KEY']
         if not self.api_key:
             raise ValueError("Gemini API key is required. Set it in .env file.")
 
-        # Configure the Gemini API
-        genai.configure(api_key=self.api_key)
+        # Use the process-wide client of the model (configures the Gemini API on first use)
+        if api_key and api_key != self.config.get('GEMINI_API_KEY'):
+            self.config = dict(self.config, GEMINI_API_KEY=api_key)
+        self.model = get_model(self.config, self.config['GEMINI_MODEL'])
+        logger.info(f"Initialized Gemini Vision API with model: {self.config['GEMINI_MODEL']}")
 
-        # Initialize the model
-        self.model = genai.GenerativeModel(current_app.config['GEMINI_MODEL'])
-        logger.info(f"Initialized Gemini Vision API with model: {current_app.config['GEMINI_MODEL']}")
+    def _pdf_prompt(self, prompt, file_path):
+        """Add what the upload-time metadata sidecar knows about a PDF to the prompt.
+
+        Returns:
+            str: The prompt, with the page count and whether the pages are scans appended
+
+        Raises:
+            ValueError: If the sidecar shows the PDF has no pages, so no model call is made
+        """
+        metadata = stored_metadata(self.config, file_path)
+        if metadata is None:
+            return prompt
+        page_count = metadata['page_count']
+        if not page_count:
+            raise ValueError(f"{os.path.basename(file_path)} has no pages")
+
+        note = (f"The document has {page_count} page{'s' if page_count != 1 else ''}; "
+                f"page numbers in locations must be between 1 and {page_count}.")
+        if not metadata['has_text_layer']:
+            note += " The pages are scans without a text layer, so read the answers from the page images."
+        return f"{prompt}\n\n{note}"
 
     def analyze_exam(self, file_path, custom_prompt=None):
         """Analyze an exam image or PDF to extract answers and student information.
@@ -50,19 +72,21 @@ class GeminiVisionAPI:
         Returns:
             dict: Extracted exam data in JSON format
         """
-        prompt = custom_prompt or current_app.config['EXAM_ANALYSIS_PROMPT']
+        prompt = custom_prompt or self.config['EXAM_ANALYSIS_PROMPT']
 
         try:
             # Check if it's a PDF file
             if file_path.lower().endswith('.pdf'):
                 logger.info(f"Processing PDF file: {file_path}")
+                prompt = self._pdf_prompt(prompt, file_path)
 
-                # Read the PDF file
-                with open(file_path, 'rb') as f:
-                    pdf_content = f.read()
+                with track('pdf_encode'):
+                    # Read the PDF file
+                    with open(file_path, 'rb') as f:
+                        pdf_content = f.read()
 
-                # Convert to base64
-                pdf_base64 = base64.b64encode(pdf_content).decode('utf-8')
+                    # Convert to base64
+                    pdf_base64 = base64.b64encode(pdf_content).decode('utf-8')
 
                 # Create multimodal content array
                 contents = [
@@ -76,12 +100,16 @@ class GeminiVisionAPI:
                 ]
 
                 # Send to Gemini
-                response = self.model.generate_content(contents)
+                response = generate_content(self.model, contents, 'vision_call', **retry_settings(self.config))
             else:
                 # Regular image processing
-                image = Image.open(file_path)
+                from PIL import Image
+                with track('pdf_encode'):
+                    image = Image.open(file_path)
+                    image.load()
                 logger.info(f"Loaded image from {file_path}: {image.size}")
-                response = self.model.generate_content([prompt, image])
+                response = generate_content(self.model, [prompt, image], 'vision_call',
+                                            **retry_settings(self.config))
 
             raw_text = response.text
             logger.info(f"Successfully analyzed exam file: {file_path}")
@@ -94,7 +122,8 @@ class GeminiVisionAPI:
 
                 if json_start >= 0 and json_end > json_start:
                     json_str = raw_text[json_start:json_end]
-                    parsed_json = json.loads(json_str)
+                    with track('json_parse'):
+                        parsed_json = json.loads(json_str)
                     return parsed_json
                 else:
                     logger.warning("No JSON content found in response")
@@ -118,19 +147,21 @@ class GeminiVisionAPI:
         Returns:
             dict: Extracted answer key data in JSON format
         """
-        prompt = custom_prompt or current_app.config['ANSWER_KEY_PROMPT']
+        prompt = custom_prompt or self.config['ANSWER_KEY_PROMPT']
 
         try:
             # Check if it's a PDF file
             if answer_key_path.lower().endswith('.pdf'):
                 logger.info(f"Processing PDF file: {answer_key_path}")
+                prompt = self._pdf_prompt(prompt, answer_key_path)
 
-                # Read the PDF file
-                with open(answer_key_path, 'rb') as f:
-                    pdf_content = f.read()
+                with track('pdf_encode'):
+                    # Read the PDF file
+                    with open(answer_key_path, 'rb') as f:
+                        pdf_content = f.read()
 
-                # Convert to base64
-                pdf_base64 = base64.b64encode(pdf_content).decode('utf-8')
+                    # Convert to base64
+                    pdf_base64 = base64.b64encode(pdf_content).decode('utf-8')
 
                 # Create multimodal content array
                 contents = [
@@ -144,12 +175,16 @@ class GeminiVisionAPI:
                 ]
 
                 # Send to Gemini
-                response = self.model.generate_content(contents)
+                response = generate_content(self.model, contents, 'vision_call', **retry_settings(self.config))
             else:
                 # Regular image processing
-                image = Image.open(answer_key_path)
+                from PIL import Image
+                with track('pdf_encode'):
+                    image = Image.open(answer_key_path)
+                    image.load()
                 logger.info(f"Loaded image from {answer_key_path}: {image.size}")
-                response = self.model.generate_content([prompt, image])
+                response = generate_content(self.model, [prompt, image], 'vision_call',
+                                            **retry_settings(self.config))
 
             raw_text = response.text
             logger.info(f"Successfully analyzed answer key: {answer_key_path}")
@@ -162,7 +197,8 @@ class GeminiVisionAPI:
 
                 if json_start >= 0 and json_end > json_start:
                     json_str = raw_text[json_start:json_end]
-                    parsed_json = json.loads(json_str)
+                    with track('json_parse'):
+                        parsed_json = json.loads(json_str)
                     return parsed_json
                 else:
                     logger.warning("No JSON content found in response")
@@ -185,6 +221,7 @@ class GeminiVisionAPI:
         Returns:
             PIL.Image: The loaded image
         """
+        from PIL import Image
         try:
             image = Image.open(image_path)
             logger.info(f"Loaded image from {image_path}: {image.size}")
@@ -0,0 +1,334 @@
+# work_queue.py
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Task states: queued (waiting, or backing off until available_at), leased (a worker holds it
+# until available_at), done and failed (attempts exhausted)
+QUEUED, LEASED, DONE, FAILED = 'queued', 'leased', 'done', 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_key TEXT NOT NULL UNIQUE,
+    exam_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    worker_id TEXT,
+    lease_id TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_ready ON tasks (status, priority, available_at);
+CREATE INDEX IF NOT EXISTS tasks_exam ON tasks (exam_id, kind, status);
+"""
+
+
+class Task:
+    """A leased task, as handed to a worker."""
+
+    def __init__(self, task_id, task_key, exam_id, kind, payload, attempts, lease_id, worker_id):
+        self.task_id = task_id
+        self.task_key = task_key
+        self.exam_id = exam_id
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+        self.lease_id = lease_id
+        self.worker_id = worker_id
+
+
+class WorkQueue:
+    """Durable SQLite queue of grading tasks shared by worker processes and nodes.
+
+    A worker leases a task for a visibility timeout and extends the lease
+    with heartbeats while it works. A task whose lease runs out (its worker
+    died or hung) becomes visible again and is leased by another worker,
+    until it has been attempted max_attempts times. Tasks are identified by a
+    task key, so submitting the same work twice queues it once; completing a
+    task is only accepted from the worker holding its current lease.
+
+    The database can live on a filesystem shared by several nodes. WAL mode
+    needs shared memory between the processes using the database and does
+    not work over NFS; use the DELETE journal mode there (and a filesystem
+    with working POSIX locks).
+    """
+
+    def __init__(self, db_path, journal_mode='WAL', visibility_timeout=300, max_attempts=3, busy_timeout=30):
+        """Open (and create if needed) the queue database.
+
+        Args:
+            db_path (str): Path to the SQLite file
+            journal_mode (str): SQLite journal mode ('WAL', or 'DELETE' on network filesystems)
+            visibility_timeout (float): Seconds a lease lasts without a heartbeat
+            max_attempts (int): Leases a task gets before it is marked failed
+            busy_timeout (float): Seconds to wait for another process's write to finish
+        """
+        self.db_path = db_path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        # One connection shared by the worker threads, serialized by a lock; transactions are
+        # begun explicitly (BEGIN IMMEDIATE) so a lease is taken atomically across processes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=busy_timeout, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute(f'PRAGMA journal_mode={journal_mode}')
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.executescript(SCHEMA)
+
+    @classmethod
+    def from_config(cls, config):
+        """Open the queue at WORK_QUEUE_PATH with the WORK_QUEUE_* and SQLITE_JOURNAL_MODE settings."""
+        return cls(config['WORK_QUEUE_PATH'], journal_mode=config.get('SQLITE_JOURNAL_MODE', 'WAL'),
+                   visibility_timeout=config.get('WORK_QUEUE_VISIBILITY_TIMEOUT', 300),
+                   max_attempts=config.get('WORK_QUEUE_MAX_ATTEMPTS', 3))
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+    def _transaction(self, work):
+        """Run work(connection) in a write transaction and return its result."""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = work(self._conn)
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+            return result
+
+    @staticmethod
+    def _insert(conn, tasks, now, retry_failed):
+        """Insert task dicts (exam_id, kind, task_key, payload, priority), returning the number queued."""
+        queued = 0
+        for task in tasks:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO tasks (task_key, exam_id, kind, priority, payload, status, available_at, "
+                "created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (task['task_key'], task['exam_id'], task['kind'], task.get('priority', 0),
+                 json.dumps(task.get('payload', {})), QUEUED, now, now))
+            if not cursor.rowcount and retry_failed:
+                cursor = conn.execute(
+                    "UPDATE tasks SET status = ?, attempts = 0, available_at = ?, error = NULL, "
+                    "payload = ?, finished_at = NULL WHERE task_key = ? AND status = ?",
+                    (QUEUED, now, json.dumps(task.get('payload', {})), task['task_key'], FAILED))
+            queued += cursor.rowcount
+        return queued
+
+    def enqueue(self, tasks, retry_failed=True):
+        """Queue tasks, skipping those whose task key is already queued, running or done.
+
+        Args:
+            tasks (list): Dicts with 'exam_id', 'kind', 'task_key', 'payload' (JSON-serializable)
+                and optionally 'priority' (lower runs first)
+            retry_failed (bool): Queue failed tasks with the same key again
+
+        Returns:
+            int: Number of tasks queued
+        """
+        return self._transaction(lambda conn: self._insert(conn, tasks, time.time(), retry_failed))
+
+    def lease(self, worker_id, exam_id=None, kinds=None):
+        """Lease the next available task: a queued one, or one whose lease has expired.
+
+        Args:
+            worker_id (str): Identifies the worker, e.g. host, process and thread
+            exam_id (str, optional): Only lease tasks of this exam
+            kinds (list, optional): Only lease tasks of these kinds
+
+        Returns:
+            Task: The leased task, or None if no task is available
+        """
+        query = "SELECT task_id, attempts, status FROM tasks WHERE status IN (?, ?) AND available_at <= ?"
+        filters = []
+        if exam_id is not None:
+            query += " AND exam_id = ?"
+            filters.append(exam_id)
+        if kinds:
+            query += f" AND kind IN ({', '.join('?' for _ in kinds)})"
+            filters.extend(kinds)
+        query += " ORDER BY priority, available_at, task_id LIMIT 1"
+
+        def take(conn):
+            while True:
+                now = time.time()
+                row = conn.execute(query, [QUEUED, LEASED, now] + filters).fetchone()
+                if row is None:
+                    return None
+                task_id, attempts, status = row
+                if status == LEASED and attempts >= self.max_attempts:
+                    # Its workers kept dying or hanging: give up instead of handing it out forever
+                    conn.execute("UPDATE tasks SET status = ?, error = ?, finished_at = ? WHERE task_id = ?",
+                                 (FAILED, f"Lease expired {attempts} times", now, task_id))
+                    continue
+                lease_id = uuid.uuid4().hex
+                conn.execute(
+                    "UPDATE tasks SET status = ?, attempts = attempts + 1, available_at = ?, worker_id = ?, "
+                    "lease_id = ? WHERE task_id = ?",
+                    (LEASED, now + self.visibility_timeout, worker_id, lease_id, task_id))
+                task_key, task_exam_id, kind, payload, attempts = conn.execute(
+                    "SELECT task_key, exam_id, kind, payload, attempts FROM tasks WHERE task_id = ?",
+                    (task_id,)).fetchone()
+                return Task(task_id, task_key, task_exam_id, kind, json.loads(payload), attempts, lease_id,
+                            worker_id)
+
+        return self._transaction(take)
+
+    def heartbeat(self, task):
+        """Extend a task's lease by the visibility timeout.
+
+        Returns:
+            bool: False if the lease was lost (it expired and the task was leased again)
+        """
+        def extend(conn):
+            return conn.execute(
+                "UPDATE tasks SET available_at = ? WHERE task_id = ? AND status = ? AND lease_id = ?",
+                (time.time() + self.visibility_timeout, task.task_id, LEASED, task.lease_id)).rowcount == 1
+
+        return self._transaction(extend)
+
+    def _when_drained(self, conn, exam_id, drained):
+        """Queue drained['task'] if no task of drained['kinds'] is left queued or leased for the exam."""
+        kinds = drained['kinds']
+        remaining = conn.execute(
+            f"SELECT COUNT(*) FROM tasks WHERE exam_id = ? AND status IN (?, ?) "
+            f"AND kind IN ({', '.join('?' for _ in kinds)})", [exam_id, QUEUED, LEASED] + list(kinds)).fetchone()[0]
+        if not remaining:
+            self._insert(conn, [drained['task']], time.time(), retry_failed=False)
+
+    def complete(self, task, result=None, follow_ups=(), when_drained=None):
+        """Mark a leased task done and queue the tasks that follow from it, in one transaction.
+
+        Completion is idempotent: it is only accepted from the current lease, so
+        a worker whose lease expired cannot complete (or queue follow-ups for) a
+        task another worker has taken over or already finished.
+
+        Args:
+            task (Task): The leased task
+            result (dict, optional): JSON-serializable result, readable with result()
+            follow_ups (list): Task dicts to queue, as for enqueue()
+            when_drained (dict, optional): {'kinds': [...], 'task': task dict}: queue the task
+                once no task of those kinds is left for the exam
+
+        Returns:
+            bool: True if the completion was accepted
+        """
+        def finish(conn):
+            now = time.time()
+            accepted = conn.execute(
+                "UPDATE tasks SET status = ?, result = ?, error = NULL, finished_at = ? "
+                "WHERE task_id = ? AND status = ? AND lease_id = ?",
+                (DONE, json.dumps(result) if result is not None else None, now, task.task_id, LEASED,
+                 task.lease_id)).rowcount == 1
+            if accepted:
+                self._insert(conn, follow_ups, now, retry_failed=True)
+                if when_drained:
+                    self._when_drained(conn, task.exam_id, when_drained)
+            return accepted
+
+        accepted = self._transaction(finish)
+        if not accepted:
+            logger.warning(f"Ignored completion of task {task.task_key} by {task.worker_id}: lease lost")
+        return accepted
+
+    def fail(self, task, error, retry_delay=0, when_drained=None):
+        """Give a task back after an error: queue it again after retry_delay, or fail it for good.
+
+        Args:
+            task (Task): The leased task
+            error (str): What went wrong
+            retry_delay (float): Seconds before the task can be leased again
+            when_drained (dict, optional): As for complete(), checked if the task fails for good
+
+        Returns:
+            str: The task's new status (queued or failed), or None if the lease was lost
+        """
+        def give_back(conn):
+            now = time.time()
+            status = FAILED if task.attempts >= self.max_attempts else QUEUED
+            updated = conn.execute(
+                "UPDATE tasks SET status = ?, error = ?, available_at = ?, finished_at = ? "
+                "WHERE task_id = ? AND status = ? AND lease_id = ?",
+                (status, error, now + retry_delay, now if status == FAILED else None, task.task_id, LEASED,
+                 task.lease_id)).rowcount == 1
+            if not updated:
+                return None
+            if status == FAILED and when_drained:
+                self._when_drained(conn, task.exam_id, when_drained)
+            return status
+
+        return self._transaction(give_back)
+
+    def postpone(self, task, delay):
+        """Give a task back without using up an attempt, e.g. while an input it needs is not ready.
+
+        Returns:
+            bool: False if the lease was lost
+        """
+        def give_back(conn):
+            return conn.execute(
+                "UPDATE tasks SET status = ?, attempts = attempts - 1, available_at = ? "
+                "WHERE task_id = ? AND status = ? AND lease_id = ?",
+                (QUEUED, time.time() + delay, task.task_id, LEASED, task.lease_id)).rowcount == 1
+
+        return self._transaction(give_back)
+
+    def result(self, task_key):
+        """Return (status, result dict or None, error) of a task, or None if there is no such task."""
+        with self._lock:
+            row = self._conn.execute("SELECT status, result, error FROM tasks WHERE task_key = ?",
+                                     (task_key,)).fetchone()
+        if row is None:
+            return None
+        status, result, error = row
+        return status, json.loads(result) if result is not None else None, error
+
+    def counts(self, exam_id=None):
+        """Return task counts by kind and status.
+
+        Returns:
+            dict: kind -> {status: count}
+        """
+        query = "SELECT kind, status, COUNT(*) FROM tasks"
+        params = []
+        if exam_id is not None:
+            query += " WHERE exam_id = ?"
+            params.append(exam_id)
+        query += " GROUP BY kind, status"
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        counts = {}
+        for kind, status, count in rows:
+            counts.setdefault(kind, {})[status] = count
+        return counts
+
+    def failures(self, exam_id=None, limit=50):
+        """Return the failed tasks, newest first, as dicts with 'task_key', 'kind', 'attempts' and 'error'."""
+        query = "SELECT task_key, exam_id, kind, attempts, error FROM tasks WHERE status = ?"
+        params = [FAILED]
+        if exam_id is not None:
+            query += " AND exam_id = ?"
+            params.append(exam_id)
+        query += " ORDER BY finished_at DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [{'task_key': task_key, 'exam_id': task_exam_id, 'kind': kind, 'attempts': attempts, 'error': error}
+                for task_key, task_exam_id, kind, attempts, error in rows]
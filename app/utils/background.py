@@ -0,0 +1,46 @@
+# app/utils/background.py
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Create the shared background executor on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            max_workers = int(os.getenv("BACKGROUND_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='background')
+        return _executor
+
+
+def _log_failure(future, description):
+    error = future.exception()
+    if error is not None:
+        logger.error(f"Background task failed ({description}): {str(error)}")
+
+
+def submit(fn, *args, description=None, **kwargs):
+    """Run a function on the shared background thread pool.
+
+    Used to move slow work (e.g. image conversion) off the request thread.
+    Failures are logged rather than raised.
+
+    Args:
+        fn (callable): The function to run
+        *args: Positional arguments for fn
+        description (str, optional): Label used when logging failures
+        **kwargs: Keyword arguments for fn
+
+    Returns:
+        concurrent.futures.Future: Future for the task's result
+    """
+    future = _get_executor().submit(fn, *args, **kwargs)
+    future.add_done_callback(lambda f: _log_failure(f, description or getattr(fn, '__name__', 'task')))
+    return future
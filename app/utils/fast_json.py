@@ -0,0 +1,53 @@
+# fast_json.py
+"""JSON encoding and decoding with an optional faster backend.
+
+orjson is used when it is installed (it parses and writes result files
+several times faster than the standard library); otherwise the standard
+json module is used. Both produce interchangeable files.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the standard library
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def loads(data):
+    """Parse a JSON document from str or bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, indent=False):
+    """Serialize an object to a JSON string.
+
+    Args:
+        obj: JSON-serializable object
+        indent (bool): Pretty-print with two-space indentation
+
+    Returns:
+        str: The JSON document
+    """
+    if orjson is not None:
+        options = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        try:
+            return orjson.dumps(obj, option=options).decode('utf-8')
+        except TypeError:  # e.g. integers beyond 64 bits; the standard library handles these
+            pass
+    return json.dumps(obj, indent=2 if indent else None)
+
+
+def load_file(path):
+    """Read and parse a JSON file."""
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def dump_file(obj, path, indent=True):
+    """Serialize an object to a JSON file, replacing it atomically."""
+    from app.utils.file_utils import atomic_write
+    atomic_write(path, dumps(obj, indent=indent).encode('utf-8'))
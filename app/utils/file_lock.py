@@ -0,0 +1,107 @@
+# file_lock.py
+"""Advisory file locks shared by the processes working on one results folder.
+
+Locks are taken with fcntl.flock on POSIX and msvcrt.locking on Windows.
+They are held by an open file, so a lock is released when its holder closes
+it or exits, also when it crashes; a stale lock file left behind is simply
+reused. Windows has no shared locks, so shared locks are exclusive there.
+"""
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Interval at which a blocked lock is retried
+POLL_INTERVAL = 0.05
+
+
+class LockTimeout(TimeoutError):
+    """Raised when a lock could not be acquired within its timeout."""
+
+
+class FileLock:
+    """An exclusive or shared lock on a lock file, usable as a context manager.
+
+    Example:
+        with FileLock(path, timeout=30):
+            ...  # no other process holds the lock here
+    """
+
+    def __init__(self, path, shared=False, timeout=None):
+        """Initialize the lock (nothing is locked until acquire()).
+
+        Args:
+            path (str): Lock file, created (with its folder) if missing
+            shared (bool): Take a shared lock that only excludes exclusive holders
+            timeout (float, optional): Seconds acquire() waits; None waits indefinitely
+        """
+        self.path = path
+        self.shared = shared
+        self.timeout = timeout
+        self._fd = None
+
+    @property
+    def locked(self):
+        return self._fd is not None
+
+    def _try_lock(self, fd):
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, (fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def acquire(self, blocking=True):
+        """Take the lock.
+
+        Args:
+            blocking (bool): Wait up to the timeout; False returns at once
+
+        Returns:
+            bool: True if the lock is now held, False if it is held elsewhere (non-blocking only)
+
+        Raises:
+            LockTimeout: If a blocking acquire did not get the lock within the timeout
+        """
+        if self._fd is not None:
+            raise RuntimeError(f"Lock {self.path} is already held")
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while not self._try_lock(fd):
+            if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                os.close(fd)
+                if not blocking:
+                    return False
+                raise LockTimeout(f"Timed out after {self.timeout}s waiting for lock {self.path}")
+            time.sleep(POLL_INTERVAL)
+        self._fd = fd
+        return True
+
+    def release(self):
+        """Release the lock if it is held."""
+        if self._fd is None:
+            return
+        fd, self._fd = self._fd, None
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -1,13 +1,192 @@
 # app/utils/file_utils.py
 import os
+import re
 import logging
-import img2pdf
-from PIL import Image
+import hashlib
+import tempfile
 import io
-from flask import current_app
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
+# Exam IDs name folders and files, so they may not contain path separators or start with a dot
+EXAM_ID_PATTERN = re.compile(r'\w[\w .-]*')
+
+# Default number of threads used to prepare/convert images in parallel
+DEFAULT_CONVERSION_WORKERS = min(8, os.cpu_count() or 1)
+
+# Block size used when streaming uploads to disk
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def stream_to_temp_file(stream, directory, max_size=None, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Copy a stream to a temporary file while computing its SHA-256 in the same pass.
+
+    Args:
+        stream: Readable binary stream (e.g. an uploaded file's stream)
+        directory (str): Directory for the temporary file (the final destination,
+            so it can later be renamed into place atomically)
+        max_size (int, optional): Maximum allowed size in bytes
+        chunk_size (int): Size of the blocks read from the stream
+
+    Returns:
+        tuple: (temporary file path, hex SHA-256 digest, size in bytes)
+
+    Raises:
+        ValueError: If the stream is larger than max_size
+    """
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.upload')
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_size is not None and size > max_size:
+                    raise ValueError(f"File too large. Maximum size is {max_size // (1024 * 1024)}MB")
+                digest.update(chunk)
+                f.write(chunk)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return temp_path, digest.hexdigest(), size
+
+
+def atomic_write(path, data, fsync=True):
+    """Replace a file's contents atomically.
+
+    The data is written to a temporary file in the same directory, flushed to
+    disk and renamed over the destination, so readers see either the old or
+    the new file but never a partially written one.
+
+    Args:
+        path (str): Destination file
+        data (bytes): New contents
+        fsync (bool): Flush the data to disk before the rename
+
+    Returns:
+        str: The destination path
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return path
+
+
+def validate_exam_id(exam_id):
+    """Check that an exam ID is safe to use in file and folder names.
+
+    Args:
+        exam_id (str): Exam ID, e.g. from a form field or the command line
+
+    Returns:
+        str: The exam ID
+
+    Raises:
+        ValueError: If the ID is empty, starts with a dot or contains a path separator
+    """
+    if not isinstance(exam_id, str) or not EXAM_ID_PATTERN.fullmatch(exam_id):
+        raise ValueError(f"Invalid exam ID {exam_id!r}: use letters, digits, spaces, '.', '_' and '-'")
+    return exam_id
+
+
+def unique_path(directory, filename, extensions=()):
+    """Return a path for a new file that does not overwrite an existing one.
+
+    Args:
+        directory (str): Target directory
+        filename (str): Wanted filename; _1, _2, ... is added to its name while it is taken
+        extensions (tuple): Other extensions (e.g. '.pdf' for an image converted
+            later) whose file of the same name must be free as well
+
+    Returns:
+        str: Path in directory
+    """
+    name, ext = os.path.splitext(filename)
+    candidate = name
+    counter = 1
+    while any(os.path.exists(os.path.join(directory, candidate + suffix)) for suffix in (ext,) + tuple(extensions)):
+        candidate = f"{name}_{counter}"
+        counter += 1
+    return os.path.join(directory, candidate + ext)
+
+
+def fsync_directory(directory):
+    """Flush a directory entry to disk so renames into it survive a crash (no-op outside POSIX)."""
+    if os.name != 'posix':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def prepare_image_for_pdf(image_path):
+    """Return image bytes that img2pdf can embed into a PDF.
+
+    JPEGs (and plain RGB/grayscale PNGs) are passed through untouched, so phone
+    photos are embedded losslessly without being decoded and re-encoded. Other
+    images are flattened to RGB and encoded to JPEG in memory.
+
+    Args:
+        image_path (str): Path to the image file
+
+    Returns:
+        bytes: Image data suitable for img2pdf.convert
+    """
+    with open(image_path, 'rb') as f:
+        data = f.read()
+
+    # Opening only parses the header; pixel data is decoded on demand
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data))
+
+    if image.format == 'JPEG' and image.mode in ('RGB', 'L', 'CMYK'):
+        return data
+
+    if (image.format == 'PNG' and image.mode in ('RGB', 'L')
+            and 'transparency' not in image.info and not image.info.get('interlace')):
+        return data
+
+    # Convert to RGB if needed (PDF doesn't support transparency)
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[3])
+        image = background
+
+    # For CMYK or other modes that might cause issues
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    # Encode in memory instead of going through a temporary file
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def _images_to_pdf_bytes(image_data):
+    """Wrap prepared image bytes into PDF bytes, honouring valid EXIF rotation."""
+    import img2pdf
+    return img2pdf.convert(image_data, rotation=img2pdf.Rotation.ifvalid)
+
 
 def convert_image_to_pdf(image_path, output_dir=None, delete_original=True):
     """Convert an image file to PDF format.
@@ -31,30 +210,10 @@ def convert_image_to_pdf(image_path, output_dir=None, delete_original=True):
     output_path = os.path.join(output_dir, pdf_filename)
 
     try:
-        # Open image to handle any potential issues
-        image = Image.open(image_path)
-
-        # Convert to RGB if needed (PDF doesn't support transparency)
-        if image.mode in ('RGBA', 'LA'):
-            background = Image.new('RGB', image.size, (255, 255, 255))
-            background.paste(image, mask=image.split()[3] if image.mode == 'RGBA' else image.split()[1])
-            image = background
-
-        # For CMYK or other modes that might cause issues
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+        pdf_bytes = _images_to_pdf_bytes(prepare_image_for_pdf(image_path))
 
-        # Save as temporary JPG file for conversion
-        temp_path = os.path.join(output_dir, f"{name}_temp.jpg")
-        image.save(temp_path, "JPEG", quality=95)
-
-        # Convert to PDF
         with open(output_path, "wb") as f:
-            f.write(img2pdf.convert(temp_path))
-
-        # Clean up temporary file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+            f.write(pdf_bytes)
 
         # Delete original if requested
         if delete_original and os.path.exists(image_path):
@@ -70,13 +229,42 @@ def convert_image_to_pdf(image_path, output_dir=None, delete_original=True):
         raise
 
 
-def combine_images_to_pdf(image_paths, output_path, delete_originals=True):
+def convert_images_to_pdfs(image_paths, output_dir=None, delete_originals=True, max_workers=None):
+    """Convert many images to individual PDFs in parallel.
+
+    Args:
+        image_paths (list): List of paths to image files
+        output_dir (str, optional): Directory to save the PDF files. If None, uses each image's directory
+        delete_originals (bool): Whether to delete the original image files after conversion
+        max_workers (int, optional): Number of worker threads
+
+    Returns:
+        list: Paths to the generated PDF files, in the same order as image_paths
+
+    Raises:
+        Exception: The first conversion error, after all other conversions have finished
+    """
+    if not image_paths:
+        return []
+
+    with ThreadPoolExecutor(max_workers=max_workers or DEFAULT_CONVERSION_WORKERS) as executor:
+        futures = [
+            executor.submit(convert_image_to_pdf, image_path, output_dir, delete_originals)
+            for image_path in image_paths
+        ]
+
+    # Leaving the executor waits for every conversion, so errors surface after the batch is done
+    return [future.result() for future in futures]
+
+
+def combine_images_to_pdf(image_paths, output_path, delete_originals=True, max_workers=None):
     """Combine multiple images into a single PDF file.
 
     Args:
         image_paths (list): List of paths to image files
         output_path (str): Path where the PDF should be saved
         delete_originals (bool): Whether to delete the original image files after conversion
+        max_workers (int, optional): Number of threads used to prepare the images
 
     Returns:
         str: Path to the generated PDF file
@@ -85,37 +273,13 @@ def combine_images_to_pdf(image_paths, output_path, delete_originals=True):
         raise ValueError("No image paths provided")
 
     try:
-        # Prepare images for conversion
-        processed_images = []
-        temp_files = []
-
-        for img_path in image_paths:
-            # Open image
-            image = Image.open(img_path)
-
-            # Convert to RGB if needed
-            if image.mode in ('RGBA', 'LA'):
-                background = Image.new('RGB', image.size, (255, 255, 255))
-                background.paste(image, mask=image.split()[3] if image.mode == 'RGBA' else image.split()[1])
-                image = background
-
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-
-            # Create temporary file
-            temp_path = f"{img_path}_temp.jpg"
-            image.save(temp_path, "JPEG", quality=95)
-            temp_files.append(temp_path)
-            processed_images.append(temp_path)
+        # Prepare images in parallel; map keeps the page order
+        with ThreadPoolExecutor(max_workers=max_workers or DEFAULT_CONVERSION_WORKERS) as executor:
+            processed_images = list(executor.map(prepare_image_for_pdf, image_paths))
 
         # Convert all images to a single PDF
         with open(output_path, "wb") as f:
-            f.write(img2pdf.convert(processed_images))
-
-        # Clean up temporary files
-        for temp_file in temp_files:
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
+            f.write(_images_to_pdf_bytes(processed_images))
 
         # Delete originals if requested
         if delete_originals:
@@ -130,10 +294,4 @@ def combine_images_to_pdf(image_paths, output_path, delete_originals=True):
         logger.error(f"Error combining images to PDF: {str(e)}")
         if os.path.exists(output_path):
             os.remove(output_path)  # Clean up partial output
-
-        # Clean up any temporary files
-        for temp_file in temp_files:
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
-
-        raise
\ No newline at end of file
+        raise
@@ -42,4 +42,26 @@ def format_filedate(filename, base_dir=None):
             return date.strftime("%Y-%m-%d %H:%M")
         return "File not found"
     except Exception as e:
-        return "Error"
\ No newline at end of file
+        return "Error"
+
+
+def format_pagecount(filename, base_dir=None):
+    """Return the page count of a PDF from the upload-time metadata index."""
+    if not filename.lower().endswith('.pdf'):
+        return "-"
+
+    from flask import current_app
+    from app.services.pdf_metadata import metadata_index_for
+    try:
+        config = current_app.config
+    except RuntimeError:
+        # Not in Flask context
+        return "Unknown"
+
+    file_type = 'answer' if base_dir is not None and base_dir == config['ANSWERS_DIR'] else 'exam'
+
+    try:
+        metadata = metadata_index_for(config, file_type).get_or_compute(filename)
+        return metadata['page_count'] if metadata else "Unknown"
+    except Exception:
+        return "Error"
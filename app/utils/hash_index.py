@@ -0,0 +1,139 @@
+# app/utils/hash_index.py
+import os
+import json
+import logging
+import tempfile
+import threading
+
+from app.utils.file_lock import FileLock
+
+logger = logging.getLogger(__name__)
+
+
+class JsonFileIndex:
+    """Base class for small JSON index files stored next to the data they describe.
+
+    Writes are atomic (temp file + rename) and serialized per index file within
+    the process. Parsed contents are reused until the file changes on disk.
+    """
+
+    # One lock and one parsed copy per index file, shared by all instances in the process
+    _locks = {}
+    _parsed = {}
+    _locks_guard = threading.Lock()
+
+    def __init__(self, index_path, base_dir):
+        """Initialize the index.
+
+        Args:
+            index_path (str): Path to the JSON index file
+            base_dir (str): Directory the indexed filenames are relative to
+        """
+        self.index_path = index_path
+        self.base_dir = base_dir
+        with JsonFileIndex._locks_guard:
+            self._lock = JsonFileIndex._locks.setdefault(os.path.abspath(index_path), threading.Lock())
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            stat = os.stat(self.index_path)
+            stamp = (stat.st_size, stat.st_mtime_ns)
+            cached = JsonFileIndex._parsed.get(self.index_path)
+            if cached and cached[0] == stamp:
+                return dict(cached[1])
+
+            with open(self.index_path, 'r') as f:
+                entries = json.load(f)
+            JsonFileIndex._parsed[self.index_path] = (stamp, entries)
+            return dict(entries)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Could not read index {self.index_path}, starting fresh: {str(e)}")
+            return {}
+
+    def _save(self, entries):
+        directory = os.path.dirname(self.index_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f, indent=2)
+            os.replace(temp_path, self.index_path)
+            stat = os.stat(self.index_path)
+            JsonFileIndex._parsed[self.index_path] = ((stat.st_size, stat.st_mtime_ns), dict(entries))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _is_current(self, filename, entry):
+        """Check that an indexed file still exists unchanged since it was indexed."""
+        path = os.path.join(self.base_dir, filename)
+        if not os.path.exists(path):
+            return False
+        stat = os.stat(path)
+        return stat.st_size == entry.get('size') and stat.st_mtime_ns == entry.get('mtime_ns')
+
+
+class HashIndex(JsonFileIndex):
+    """Persistent SHA-256 -> stored file index used to deduplicate uploads.
+
+    Entries record the stored file's size and mtime, so an entry whose file was
+    deleted or overwritten since it was indexed is ignored and pruned.
+    """
+
+    def lock(self, timeout=None):
+        """Return a lock on the index that is shared with other processes.
+
+        Hold it from lookup() until the file is stored and add()ed, so two
+        processes storing the same content cannot both miss the lookup.
+
+        Args:
+            timeout (float, optional): Seconds to wait for the lock; None waits indefinitely
+
+        Returns:
+            FileLock: The (not yet acquired) lock, usable as a context manager
+        """
+        return FileLock(f"{self.index_path}.lock", timeout=timeout)
+
+    def lookup(self, sha256):
+        """Return the index entry for a content hash, or None if it is unknown or stale.
+
+        Args:
+            sha256 (str): Hex digest of the file content
+
+        Returns:
+            dict or None: Entry with at least 'filename'
+        """
+        with self._lock:
+            entries = self._load()
+            entry = entries.get(sha256)
+            if entry is None:
+                return None
+            if self._is_current(entry['filename'], entry):
+                return entry
+
+            # The file was removed or replaced since it was indexed
+            del entries[sha256]
+            self._save(entries)
+            return None
+
+    def add(self, sha256, filename, **extra):
+        """Record a stored file under its content hash.
+
+        Args:
+            sha256 (str): Hex digest of the file content
+            filename (str): Stored filename, relative to base_dir
+            **extra: Additional fields to keep with the entry
+
+        Returns:
+            dict: The stored entry
+        """
+        stat = os.stat(os.path.join(self.base_dir, filename))
+        entry = dict(extra, filename=filename, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        with self._lock:
+            entries = self._load()
+            entries[sha256] = entry
+            self._save(entries)
+        return entry
@@ -0,0 +1,316 @@
+# metrics.py
+"""In-process metrics for the grading hot path.
+
+Histograms, counters and gauges are kept in a process-wide registry and
+rendered in the Prometheus text exposition format for the /metrics endpoint.
+A RunMetrics recorder can additionally be activated for the duration of a
+grading run to collect the per-stage timings of just that run.
+"""
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds, sized for model calls and file I/O
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Recorder of the grading run the current thread is working for, if any
+_current_run = contextvars.ContextVar('current_run', default=None)
+
+
+def summarize_durations(durations):
+    """Summarize a list of durations in seconds.
+
+    Returns:
+        dict: 'count', 'total', 'mean', 'p50', 'p95', 'p99' and 'max' (seconds, rounded to microseconds)
+    """
+    if not durations:
+        return {'count': 0, 'total': 0.0, 'mean': 0.0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+
+    ordered = sorted(durations)
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+    total = sum(ordered)
+    return {
+        'count': len(ordered),
+        'total': round(total, 6),
+        'mean': round(total / len(ordered), 6),
+        'p50': round(percentile(0.5), 6),
+        'p95': round(percentile(0.95), 6),
+        'p99': round(percentile(0.99), 6),
+        'max': round(ordered[-1], 6)
+    }
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base class of a labelled metric; one value (or histogram state) per label combination."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Return (suffix, label values, extra label, value) tuples for rendering."""
+        with self._lock:
+            return [('', key, None, value) for key, value in sorted(self._values.items())]
+
+    def snapshot(self):
+        """Return the current values keyed by label values."""
+        with self._lock:
+            return dict(self._values)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. model calls or cache hits."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. the number of in-flight model calls."""
+
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Distribution of observed durations in cumulative buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state['buckets']):
+                    cumulative += count
+                    samples.append(('_bucket', key, ('le', _format_value(bound)), cumulative))
+                samples.append(('_sum', key, None, state['sum']))
+                samples.append(('_count', key, None, state['count']))
+        return samples
+
+
+class MetricsRegistry:
+    """Process-wide collection of metrics, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric_class, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, metric_class):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        """Return the counter with this name, registering it on first use."""
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        """Return the gauge with this name, registering it on first use."""
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """Return the histogram with this name, registering it on first use."""
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, key, extra, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(metric.labelnames, key, extra)} "
+                             f"{_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'smartassess_stage_duration_seconds', 'Time spent in a grading stage.', ('stage',))
+STAGE_CALLS = REGISTRY.counter(
+    'smartassess_stage_calls_total', 'Grading stage executions by outcome.', ('stage', 'outcome'))
+STAGE_IN_FLIGHT = REGISTRY.gauge(
+    'smartassess_stage_in_flight', 'Grading stage executions currently running.', ('stage',))
+MODEL_RETRIES = REGISTRY.counter(
+    'smartassess_model_retries_total', 'Model calls retried after an error.', ('stage',))
+CACHE_REQUESTS = REGISTRY.counter(
+    'smartassess_cache_requests_total', 'Render cache lookups by result.', ('cache', 'result'))
+RESULT_WRITES = REGISTRY.counter(
+    'smartassess_result_writes_total', 'Result file writes, written to disk or coalesced with a later write.',
+    ('result',))
+
+
+class RunMetrics:
+    """Per-stage timings and counters of a single grading run."""
+
+    def __init__(self):
+        self._durations = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, outcome):
+        with self._lock:
+            self._durations.setdefault(stage, []).append(seconds)
+            counts = self._counts.setdefault(stage, {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+    def count(self, name, label):
+        with self._lock:
+            counts = self._counts.setdefault(name, {})
+            counts[label] = counts.get(label, 0) + 1
+
+    def summary(self):
+        """Return per-stage duration summaries and outcome counts.
+
+        Returns:
+            dict: stage -> summarize_durations() result plus the outcome counts
+                ('ok', 'error'); counters without durations (retries, cache
+                lookups) map to their counts only
+        """
+        with self._lock:
+            names = sorted(set(self._durations) | set(self._counts))
+            return {
+                name: dict(summarize_durations(self._durations.get(name, [])), **self._counts.get(name, {}))
+                if name in self._durations else dict(self._counts[name])
+                for name in names
+            }
+
+
+def current_run():
+    """Return the RunMetrics of the run the current context belongs to, or None."""
+    return _current_run.get()
+
+
+@contextmanager
+def run_metrics(recorder=None):
+    """Collect the stage timings of everything done in this context into a RunMetrics.
+
+    Worker threads only see the recorder when they run inside a copy of this
+    context (contextvars.copy_context().run).
+
+    Yields:
+        RunMetrics: The active recorder
+    """
+    recorder = recorder or RunMetrics()
+    token = _current_run.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current_run.reset(token)
+
+
+@contextmanager
+def track(stage):
+    """Time a grading stage, counting its outcome and the number of executions in flight."""
+    STAGE_IN_FLIGHT.inc(stage=stage)
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_IN_FLIGHT.dec(stage=stage)
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        STAGE_CALLS.inc(stage=stage, outcome=outcome)
+        recorder = _current_run.get()
+        if recorder is not None:
+            recorder.observe(stage, elapsed, outcome)
+
+
+def record_retry(stage):
+    """Count a retried model call."""
+    MODEL_RETRIES.inc(stage=stage)
+    recorder = _current_run.get()
+    if recorder is not None:
+        recorder.count('retries', stage)
+
+
+def record_cache(cache, hit):
+    """Count a render cache lookup as a hit or miss."""
+    result = 'hit' if hit else 'miss'
+    CACHE_REQUESTS.inc(cache=cache, result=result)
+    recorder = _current_run.get()
+    if recorder is not None:
+        recorder.count(f"{cache}_cache", result)
+
+
+def record_result_write(result):
+    """Count a result write as 'written' to disk or 'coalesced' into a later write of the same result."""
+    RESULT_WRITES.inc(result=result)
+    recorder = _current_run.get()
+    if recorder is not None:
+        recorder.count('result_writes', result)
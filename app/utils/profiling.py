@@ -0,0 +1,313 @@
+# profiling.py
+"""Opt-in profiling of requests and grading runs.
+
+Two profilers are available:
+
+- 'cprofile': deterministic cProfile of the calling thread, written as a
+  .pstats file (open with `python -m pstats` or snakeviz).
+- 'sampling': a low-overhead sampler that records the stacks of every thread
+  at a fixed interval, written in the speedscope JSON format
+  (https://www.speedscope.app). Use it for grading runs, whose work happens
+  in worker threads that cProfile does not see.
+
+Profiles go to PROFILE_DIR with a sidecar .meta.json holding the route or
+command, exam_id and timing; only the newest PROFILE_MAX_FILES are kept.
+"""
+import os
+import sys
+import json
+import time
+import hmac
+import logging
+import threading
+import cProfile
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ('cprofile', 'sampling')
+
+# Deepest stack recorded by the sampler
+MAX_STACK_DEPTH = 128
+
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads from a background thread.
+
+    The profiled code is not instrumented; the cost is one stack walk per
+    thread every interval, and sampling stops after max_samples so a
+    forgotten profile cannot grow without bound.
+    """
+
+    def __init__(self, interval=0.005, max_samples=200000):
+        """Initialize the sampler.
+
+        Args:
+            interval (float): Seconds between samples
+            max_samples (int): Samples after which sampling stops
+        """
+        self.interval = interval
+        self.max_samples = max_samples
+        self.frames = []
+        self._frame_index = {}
+        # thread ident -> {'name': str, 'samples': [stack], 'weights': [seconds]}
+        self.threads = {}
+        self.sample_count = 0
+        self.started_at = None
+        self.stopped_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _frame_id(self, code):
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        index = self._frame_index.get(key)
+        if index is None:
+            index = self._frame_index[key] = len(self.frames)
+            self.frames.append({'name': code.co_name, 'file': code.co_filename, 'line': code.co_firstlineno})
+        return index
+
+    def _sample(self, elapsed):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(self._frame_id(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            thread = self.threads.setdefault(ident, {'name': names.get(ident, str(ident)),
+                                                     'samples': [], 'weights': []})
+            if thread['samples'] and thread['samples'][-1] == stack:
+                thread['weights'][-1] += elapsed
+            else:
+                thread['samples'].append(stack)
+                thread['weights'].append(elapsed)
+        self.sample_count += 1
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval) and self.sample_count < self.max_samples:
+            now = time.perf_counter()
+            self._sample(now - last)
+            last = now
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.stopped_at = time.perf_counter()
+
+    def to_speedscope(self, name):
+        """Return the samples as a speedscope file (one profile per thread)."""
+        duration = (self.stopped_at or time.perf_counter()) - self.started_at
+        profiles = [
+            {
+                'type': 'sampled',
+                'name': f"{thread['name']} ({ident})",
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': round(sum(thread['weights']), 6),
+                'samples': thread['samples'],
+                'weights': [round(weight, 6) for weight in thread['weights']]
+            }
+            for ident, thread in self.threads.items()
+        ]
+        return {
+            '$schema': SPEEDSCOPE_SCHEMA,
+            'name': f"{name} ({duration:.3f}s)",
+            'exporter': 'smart-assess',
+            'activeProfileIndex': 0,
+            'shared': {'frames': self.frames},
+            'profiles': profiles
+        }
+
+
+class Profile:
+    """A running profile of one request or command, written by stop()."""
+
+    def __init__(self, config, mode, kind, label, exam_id=None):
+        """Start profiling.
+
+        Args:
+            config (dict): Application settings (PROFILE_DIR, PROFILE_MAX_FILES, ...)
+            mode (str): 'cprofile' or 'sampling'
+            kind (str): 'request' or 'run'
+            label (str): Route or command being profiled
+            exam_id (str, optional): Exam the request or run is about
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode}")
+        self.config = config
+        self.mode = mode
+        self.kind = kind
+        self.label = label
+        self.exam_id = exam_id
+        self.started = time.perf_counter()
+
+        if mode == 'cprofile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.profiler = SamplingProfiler(interval=config.get('PROFILE_SAMPLE_INTERVAL', 0.005),
+                                             max_samples=config.get('PROFILE_MAX_SAMPLES', 200000))
+            self.profiler.start()
+
+    def stop(self, **extra):
+        """Stop profiling and write the profile, unless it was faster than PROFILE_MIN_SECONDS.
+
+        Args:
+            **extra: Additional metadata to store (e.g. method, status)
+
+        Returns:
+            str: Path to the profile, or None if it was not kept
+        """
+        if self.mode == 'cprofile':
+            self.profiler.disable()
+        else:
+            self.profiler.stop()
+        seconds = time.perf_counter() - self.started
+
+        if seconds < self.config.get('PROFILE_MIN_SECONDS', 0.0):
+            return None
+
+        profile_dir = profile_dir_for(self.config)
+        os.makedirs(profile_dir, exist_ok=True)
+        slug = ''.join(c if c.isalnum() or c in '-.' else '_' for c in self.label.strip('/'))[:60] or 'root'
+        basename = (f"{time.strftime('%Y%m%dT%H%M%S')}_{self.kind}_{slug}"
+                    f"{'_' + self.exam_id if self.exam_id else ''}_{int(seconds * 1000)}ms")
+        basename = ''.join(c if c.isalnum() or c in '-._' else '_' for c in basename)
+
+        if self.mode == 'cprofile':
+            path = os.path.join(profile_dir, f"{basename}.pstats")
+            self.profiler.dump_stats(path)
+        else:
+            path = os.path.join(profile_dir, f"{basename}.speedscope.json")
+            with open(path, 'w') as f:
+                json.dump(self.profiler.to_speedscope(f"{self.kind} {self.label}"), f)
+
+        metadata = dict(extra, kind=self.kind, label=self.label, exam_id=self.exam_id, mode=self.mode,
+                        seconds=round(seconds, 3), profile=os.path.basename(path), created_at=time.time())
+        with open(os.path.join(profile_dir, f"{basename}.meta.json"), 'w') as f:
+            json.dump(metadata, f, indent=2)
+
+        prune_profiles(profile_dir, self.config.get('PROFILE_MAX_FILES', 50))
+        logger.info(f"Wrote {self.mode} profile of {self.kind} {self.label} ({seconds:.2f}s) to {path}")
+        return path
+
+
+def profile_dir_for(config):
+    """Return the folder profiles are written to (PROFILE_DIR or DATA_DIR/profiles)."""
+    return config.get('PROFILE_DIR') or os.path.join(config['DATA_DIR'], 'profiles')
+
+
+def prune_profiles(profile_dir, max_files):
+    """Delete the oldest profiles (and their metadata) beyond max_files.
+
+    Returns:
+        int: Number of profiles deleted
+    """
+    profiles = sorted(
+        (name for name in os.listdir(profile_dir) if name.endswith(('.pstats', '.speedscope.json'))),
+        key=lambda name: os.path.getmtime(os.path.join(profile_dir, name))
+    )
+    excess = profiles[:max(0, len(profiles) - max_files)]
+    for name in excess:
+        base = name[:-len('.pstats')] if name.endswith('.pstats') else name[:-len('.speedscope.json')]
+        for path in (os.path.join(profile_dir, name), os.path.join(profile_dir, f"{base}.meta.json")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return len(excess)
+
+
+@contextmanager
+def profiled(config, mode, kind, label, exam_id=None, **extra):
+    """Profile the enclosed block if mode is set.
+
+    Args:
+        config (dict): Application settings
+        mode (str): 'cprofile', 'sampling', or None/'' to not profile
+        kind (str): 'request' or 'run'
+        label (str): Route or command being profiled
+        exam_id (str, optional): Exam the work is about
+        **extra: Additional metadata to store
+
+    Yields:
+        Profile: The running profile, or None if profiling is off
+    """
+    if not mode:
+        yield None
+        return
+
+    profile = Profile(config, mode, kind, label, exam_id)
+    try:
+        yield profile
+    finally:
+        try:
+            profile.stop(**extra)
+        except Exception as e:
+            logger.warning(f"Could not write profile of {kind} {label}: {str(e)}")
+
+
+def request_profile_mode(config, args):
+    """Decide whether and how to profile a request.
+
+    Requests are profiled when PROFILE_MODE is set, or when they carry
+    `?profile=<mode>&profile_token=<PROFILE_TOKEN>`. The query flag is
+    disabled while no PROFILE_TOKEN is configured.
+
+    Args:
+        config (dict): Application settings
+        args (Mapping): The request's query arguments
+
+    Returns:
+        str: Profile mode, or None to not profile
+    """
+    requested = args.get('profile')
+    if requested:
+        token = config.get('PROFILE_TOKEN')
+        if token and hmac.compare_digest(str(args.get('profile_token', '')), token):
+            return requested if requested in PROFILE_MODES else 'cprofile'
+        return None
+    return config.get('PROFILE_MODE') or None
+
+
+def init_app(app):
+    """Register request hooks that profile requests when asked to."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_profile():
+        mode = request_profile_mode(app.config, request.args)
+        if mode:
+            route = request.url_rule.rule if request.url_rule else request.path
+            exam_id = (request.view_args or {}).get('exam_id')
+            try:
+                g.profile = Profile(app.config, mode, 'request', route, exam_id)
+            except ValueError as e:  # e.g. another profiler is already active in this thread
+                logger.warning(f"Not profiling {route}: {str(e)}")
+
+    @app.after_request
+    def _note_response_status(response):
+        if 'profile' in g:
+            g.profile_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _stop_request_profile(error=None):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            try:
+                profile.stop(method=request.method, path=request.path, status=g.pop('profile_status', None),
+                             error=str(error) if error else None)
+            except Exception as e:
+                logger.warning(f"Could not write request profile: {str(e)}")
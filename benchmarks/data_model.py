@@ -0,0 +1,161 @@
+# benchmarks/data_model.py
+"""Memory and load time of the result data model.
+
+Builds a synthetic class in memory, checks that every model survives a
+to_dict/from_dict round trip (also through JSON), and reports the memory
+held per answer and the time to decode and rebuild a class with each
+available JSON backend. Exits with status 1 if a round trip changes a model.
+
+Usage:
+    python -m benchmarks.data_model --students 1000 --questions 20
+    python -m benchmarks.data_model --answers-in-memory 1000000
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+
+from app.models.data_model import AnswerLocation, QuestionAnswer, StudentExam, AnswerKey
+from app.utils import fast_json
+
+
+def make_class(students, questions, seed=0):
+    """Return a list of StudentExam objects with varied, partly missing fields."""
+    rng = random.Random(seed)
+    student_exams = []
+    for index in range(students):
+        answers = []
+        for number in range(1, questions + 1):
+            correct = rng.random() < 0.7
+            box = {'x1': rng.random(), 'y1': rng.random(), 'x2': rng.random(), 'y2': rng.random()}
+            answers.append(QuestionAnswer(
+                question_number=str(number),
+                answer_text=f"answer {rng.randrange(1000)} to question {number}",
+                is_correct=correct if rng.random() < 0.95 else None,
+                location=AnswerLocation(page=1 + number // 10, bounding_box=box,
+                                        text_spans=[{'text': 'answer', 'page': 1 + number // 10, 'bbox': box}]),
+                error_type=None if correct else f"error {rng.randrange(5)}",
+                evaluation_reason='Matches the reference answer' if correct else 'Does not match',
+                learning_topics=[] if correct else ['topic a', 'topic b'],
+                reference_to_answer=None if correct else 'reference',
+                misconception=None if correct else 'misconception'
+            ))
+        student_exams.append(StudentExam(student_id=f"student_{index:06d}", exam_id='bench',
+                                         student_name=f"Student {index}", answers=answers,
+                                         score=rng.random(), source_file=f"exam_{index}.pdf"))
+    return student_exams
+
+
+def check_round_trips(student_exams):
+    """Return the number of models that do not survive to_dict/from_dict, directly or through JSON."""
+    failures = 0
+    for student_exam in student_exams:
+        data = student_exam.to_dict()
+        if StudentExam.from_dict(data) != student_exam:
+            failures += 1
+        if StudentExam.from_dict(json.loads(json.dumps(data))) != student_exam:
+            failures += 1
+
+    answer_key = AnswerKey(exam_id='bench', answers={'1': 'a', '2': 'b'},
+                           answer_locations={'1': AnswerLocation(page=1), '2': AnswerLocation(page=2)})
+    if AnswerKey.from_dict(json.loads(json.dumps(answer_key.to_dict()))) != answer_key:
+        failures += 1
+    # Missing and null fields fall back to the defaults
+    if StudentExam.from_dict({'answers': [{'location': None, 'learning_topics': None}]}) != StudentExam(
+            student_id='Unknown', exam_id='', answers=[QuestionAnswer(question_number='', answer_text='')]):
+        failures += 1
+    return failures
+
+
+def bytes_per_answer(answers):
+    """Return the memory traced per answer while building `answers` answers."""
+    tracemalloc.start()
+    held = make_class(max(1, answers // 20), 20, seed=1)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    count = sum(len(student_exam.answers) for student_exam in held)
+    return round(current / count, 1)
+
+
+def best_of(repeat, function):
+    """Return the fastest of `repeat` timed calls in seconds."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def time_backends(student_exams, repeat):
+    """Time encoding and decoding the class with each JSON backend."""
+    documents = [student_exam.to_dict() for student_exam in student_exams]
+    backends = {'json': (lambda obj: json.dumps(obj, indent=2), json.loads)}
+    if fast_json.orjson is not None:
+        backends['orjson'] = (lambda obj: fast_json.dumps(obj, indent=True), fast_json.loads)
+
+    results = {
+        'to_dict_seconds': round(best_of(repeat, lambda: [s.to_dict() for s in student_exams]), 4),
+        'from_dict_seconds': round(best_of(repeat, lambda: [StudentExam.from_dict(d) for d in documents]), 4),
+    }
+    for name, (dumps, loads) in backends.items():
+        encoded = [dumps(document) for document in documents]
+        results[name] = {
+            'encode_seconds': round(best_of(repeat, lambda: [dumps(d) for d in documents]), 4),
+            'load_class_seconds': round(best_of(repeat, lambda: [StudentExam.from_dict(loads(e)) for e in encoded]), 4),
+            'bytes': sum(len(e) for e in encoded)
+        }
+    return results
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.data_model',
+                                     description='Measure memory and load time of the result data model')
+    parser.add_argument('--students', type=int, default=1000, help='Students in the timed class')
+    parser.add_argument('--questions', type=int, default=20, help='Questions per exam')
+    parser.add_argument('--answers-in-memory', type=int, default=100000,
+                        help='Answers built to measure memory per answer')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed repetitions (the fastest is reported)')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    student_exams = make_class(args.students, args.questions)
+    failures = check_round_trips(student_exams)
+    per_answer = bytes_per_answer(args.answers_in_memory)
+    timings = time_backends(student_exams, args.repeat)
+
+    report = {
+        'benchmark': 'data_model',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'slots': not hasattr(student_exams[0], '__dict__'),
+        'students': args.students,
+        'questions': args.questions,
+        'round_trip_failures': failures,
+        'bytes_per_answer': per_answer,
+        'bytes_for_1m_answers': round(per_answer * 1_000_000),
+        'timings': timings
+    }
+    print(f"round trips: {'ok' if not failures else f'{failures} failed'}; "
+          f"{per_answer:.0f} bytes per answer (~{per_answer * 1_000_000 / 2 ** 20:.0f} MiB per million); "
+          f"class of {args.students} loads in "
+          + ', '.join(f"{timings[name]['load_class_seconds'] * 1000:.0f}ms with {name}"
+                      for name in ('json', 'orjson') if name in timings), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+# benchmarks/import_time.py
+"""Cold-start import time of the application's entry points.
+
+Each entry point is imported in a fresh interpreter several times; the
+median wall time is compared against a budget and the heavy third-party
+modules (Gemini client, PyMuPDF, Pillow, img2pdf) are checked to still be
+loaded lazily. Exits with status 1 when an entry point is over budget or
+imports a heavy module eagerly, so it can guard startup time in CI.
+
+Usage:
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --repeat 10 --output import_time.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+
+# Entry point -> (statement run in the fresh interpreter, budget in milliseconds)
+ENTRY_POINTS = {
+    'cli': ('import app.cli', 100),
+    'grading_pipeline': ('import app.services.grading_pipeline', 100),
+    'services': ('import app.services', 50),
+    'web_app': ('from app import create_app; create_app()', 500),
+}
+
+# Modules that must only be imported when a feature needs them
+HEAVY_MODULES = ('google.generativeai', 'fitz', 'PIL.Image', 'img2pdf')
+
+PROBE = """
+import sys, time, json
+started = time.perf_counter()
+exec(compile({statement!r}, '<entry point>', 'exec'))
+elapsed = time.perf_counter() - started
+print(json.dumps({{'seconds': elapsed, 'heavy': [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def measure(statement, repeat):
+    """Import an entry point in `repeat` fresh interpreters.
+
+    Returns:
+        dict: 'median_ms', 'min_ms', 'max_ms' of the import and 'heavy' modules it loaded
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    probe = PROBE.format(statement=statement, heavy=HEAVY_MODULES)
+    durations = []
+    heavy = set()
+    for _ in range(repeat):
+        # Model warm-up runs in a background thread after startup and would race the heavy-module check
+        output = subprocess.run([sys.executable, '-c', probe], cwd=root, check=True, capture_output=True,
+                                text=True, env=dict(os.environ, GEMINI_WARMUP='false')).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        durations.append(result['seconds'] * 1000)
+        heavy.update(result['heavy'])
+    return {
+        'median_ms': round(statistics.median(durations), 1),
+        'min_ms': round(min(durations), 1),
+        'max_ms': round(max(durations), 1),
+        'heavy': sorted(heavy)
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.import_time',
+                                     description='Measure cold-start import time against a budget')
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters per entry point')
+    parser.add_argument('--budget-scale', type=float, default=1.0,
+                        help='Multiply every budget, e.g. 2 on slow CI machines')
+    parser.add_argument('--entry', choices=sorted(ENTRY_POINTS), nargs='+', help='Entry points to measure')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    results = {}
+    failed = False
+    for name in args.entry or ENTRY_POINTS:
+        statement, budget_ms = ENTRY_POINTS[name]
+        result = measure(statement, args.repeat)
+        result['budget_ms'] = round(budget_ms * args.budget_scale, 1)
+        result['ok'] = result['median_ms'] <= result['budget_ms'] and not result['heavy']
+        failed = failed or not result['ok']
+        results[name] = result
+
+        heavy = f"  eagerly imports {', '.join(result['heavy'])}" if result['heavy'] else ''
+        print(f"{name:<18} {result['median_ms']:7.1f}ms (budget {result['budget_ms']:.0f}ms) "
+              f"{'ok' if result['ok'] else 'OVER BUDGET'}{heavy}", file=sys.stderr)
+
+    report = {
+        'benchmark': 'import_time',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+# benchmarks/result_formats.py
+"""Size and parse time of the result file formats.
+
+Reads the student result files of a results folder (RESULTS_DIR by
+default), encodes every document in each available result format, checks
+that it decodes back to the same document, and reports total bytes and the
+time to decode and rebuild all StudentExam objects per format. Without any
+result files, a synthetic class is used instead.
+
+Usage:
+    python -m benchmarks.result_formats
+    python -m benchmarks.result_formats --results-dir data/results --exam-id midterm --output formats.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+
+from app.models.data_model import StudentExam
+from app.services.result_store import ResultStore, RESULT_FORMATS
+
+
+def load_documents(results_dir, exam_id=None):
+    """Return the student result documents found in a results folder."""
+    if not results_dir or not os.path.isdir(results_dir):
+        return []
+    store = ResultStore(results_dir)
+    documents = []
+    for filename in sorted(os.listdir(results_dir)):
+        result_format = store.format_of(filename)
+        if result_format is None or not result_format.available or filename.startswith(('analysis_', 'key_')):
+            continue
+        if exam_id is not None and not filename.endswith(f"_{exam_id}{result_format.extension}"):
+            continue
+        documents.append(store.read_file(os.path.join(results_dir, filename)))
+    return documents
+
+
+def best_of(repeat, function):
+    """Return the fastest of `repeat` timed calls in seconds."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def measure(documents, repeat):
+    """Encode, check and time every available format.
+
+    Returns:
+        dict: format name -> 'bytes', 'encode_seconds', 'parse_seconds', 'lossless'
+    """
+    results = {}
+    for name, result_format in RESULT_FORMATS.items():
+        if not result_format.available:
+            results[name] = {'available': False, 'requires': result_format.requires}
+            continue
+        encoded = [result_format.encode(document) for document in documents]
+        decode = result_format.decode
+        results[name] = {
+            'available': True,
+            'bytes': sum(len(data) for data in encoded),
+            'lossless': all(decode(data) == document for data, document in zip(encoded, documents)),
+            'encode_seconds': round(best_of(repeat, lambda: [result_format.encode(d) for d in documents]), 4),
+            'parse_seconds': round(best_of(repeat, lambda: [StudentExam.from_dict(decode(d)) for d in encoded]), 4)
+        }
+    return results
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.result_formats',
+                                     description='Compare size and parse time of the result formats')
+    parser.add_argument('--results-dir', help='Folder with result files (default RESULTS_DIR)')
+    parser.add_argument('--exam-id', help='Only use the results of this exam')
+    parser.add_argument('--synthetic-students', type=int, default=500,
+                        help='Size of the synthetic class used when there are no result files')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed repetitions (the fastest is reported)')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    results_dir = args.results_dir
+    if results_dir is None:
+        from config import load_config
+        results_dir = load_config()['RESULTS_DIR']
+
+    documents = load_documents(results_dir, args.exam_id)
+    source = results_dir
+    if not documents:
+        from benchmarks.data_model import make_class
+        documents = [student_exam.to_dict() for student_exam in make_class(args.synthetic_students, 20)]
+        source = 'synthetic'
+
+    formats = measure(documents, args.repeat)
+    report = {
+        'benchmark': 'result_formats',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'source': source,
+        'files': len(documents),
+        'formats': formats
+    }
+
+    baseline = formats['json']
+    for name, result in formats.items():
+        if not result['available']:
+            print(f"{name:<8} unavailable (pip install {result['requires']})", file=sys.stderr)
+            continue
+        print(f"{name:<8} {result['bytes'] / 2 ** 20:8.2f} MiB ({result['bytes'] / baseline['bytes']:.0%} of json), "
+              f"parse {result['parse_seconds'] * 1000:7.1f}ms, encode {result['encode_seconds'] * 1000:7.1f}ms"
+              f"{'' if result['lossless'] else '  NOT LOSSLESS'}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 0 if all(result.get('lossless', True) for result in formats.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,261 @@
+# benchmarks/run_benchmark.py
+"""End-to-end grading benchmark on synthetic exams.
+
+Generates a synthetic class for each requested size, grades it with the
+full GradingPipeline against the offline model stand-in and reports
+throughput, per-stage percentiles, peak RSS and on-disk bytes as JSON.
+Each class size runs in its own process so peak RSS is measured per size.
+
+Usage:
+    python -m benchmarks.run_benchmark --students 10 100 1000 --questions 20 --workers 8
+    python -m benchmarks.run_benchmark --students 10000 --latency-ms 50 --output bench.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+# Subfolders of the work directory, mirroring data/
+DATA_SUBDIRS = ('exams', 'answers', 'results', 'index', 'cache/highlighted', 'cache/pages', 'uploads')
+
+
+def peak_rss_bytes():
+    """Return the peak resident set size of this process in bytes, or None if unavailable."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def directory_bytes(path):
+    """Return the total size of the files below a directory."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def offline_config(data_dir, workers, latency_ms=0.0, jitter_ms=0.0, seed=0, journal=True):
+    """Return settings that keep all data below data_dir and answer model calls offline."""
+    from benchmarks.synthetic import OfflineModelFactory
+    from config import load_config
+
+    return load_config(
+        'testing',
+        DATA_DIR=data_dir,
+        EXAMS_DIR=os.path.join(data_dir, 'exams'),
+        ANSWERS_DIR=os.path.join(data_dir, 'answers'),
+        RESULTS_DIR=os.path.join(data_dir, 'results'),
+        INDEX_DIR=os.path.join(data_dir, 'index'),
+        UPLOADS_DIR=os.path.join(data_dir, 'uploads'),
+        CACHE_DIR=os.path.join(data_dir, 'cache'),
+        HIGHLIGHT_CACHE_DIR=os.path.join(data_dir, 'cache', 'highlighted'),
+        PAGE_CACHE_DIR=os.path.join(data_dir, 'cache', 'pages'),
+        RUN_JOURNAL_PATH=os.path.join(data_dir, 'index', 'run_journal.sqlite3') if journal else '',
+        RUN_METRICS_DIR=None,
+        USAGE_DIR=None,
+        GEMINI_API_KEY='offline',
+        GEMINI_MODEL_FACTORY=OfflineModelFactory(latency_ms / 1000, jitter_ms / 1000, seed),
+        GEMINI_MAX_RETRIES=0,
+        GRADING_WORKERS=workers,
+    )
+
+
+def run_size(args, students, workdir):
+    """Generate and grade one synthetic class.
+
+    Returns:
+        dict: Benchmark result for this class size
+    """
+    from benchmarks.synthetic import generate_exam_set
+
+    data_dir = os.path.join(workdir, 'data')
+    for subdir in DATA_SUBDIRS:
+        os.makedirs(os.path.join(data_dir, subdir), exist_ok=True)
+
+    started = time.perf_counter()
+    answer_key_path, exam_paths = generate_exam_set(
+        os.path.join(data_dir, 'exams'), os.path.join(data_dir, 'answers'),
+        students, args.questions, error_rate=args.error_rate, seed=args.seed)
+    generate_seconds = time.perf_counter() - started
+    input_bytes = directory_bytes(os.path.join(data_dir, 'exams')) + directory_bytes(os.path.join(data_dir, 'answers'))
+
+    config = offline_config(data_dir, args.workers, args.latency_ms, args.jitter_ms, args.seed, args.journal)
+
+    from app.services.grading_pipeline import GradingPipeline
+    from app.services.pdf_highlighter import PDFHighlighter
+    from app.services.render_cache import HighlightCache
+    from app.utils.metrics import run_metrics, summarize_durations
+
+    pipeline = GradingPipeline(config, workers=args.workers)
+    result = pipeline.run('synthetic', answer_key_path, exam_paths, 'General Knowledge', resume=False)
+    stats = result['stats']
+
+    # Highlight rendering is not part of a grading run; time it on a sample of the class
+    highlight_durations = []
+    cache = HighlightCache(config['HIGHLIGHT_CACHE_DIR'])
+    with run_metrics():
+        for exam_path, student_exam in result['graded'][:args.highlight_sample]:
+            answer_locations = PDFHighlighter.format_answers_for_highlighting(student_exam.to_dict())
+            started = time.perf_counter()
+            cache.get_or_render(exam_path, answer_locations, errors_only=True)
+            highlight_durations.append(time.perf_counter() - started)
+
+    stages = dict(stats['metrics'])
+    stages['student_extraction'] = stats['stages']['extraction']
+    stages['student_evaluation'] = stats['stages']['evaluation']
+    stages['highlight_render'] = summarize_durations(highlight_durations)
+
+    return {
+        'students': students,
+        'questions': args.questions,
+        'workers': stats['workers'],
+        'latency_ms': args.latency_ms,
+        'graded': stats['graded'],
+        'failed': stats['failed'],
+        'answers': stats['answers'],
+        'generate_seconds': round(generate_seconds, 3),
+        'wall_seconds': stats['wall_seconds'],
+        'exams_per_minute': stats['exams_per_minute'],
+        'answers_per_second': round(stats['answers'] / stats['wall_seconds'], 2) if stats['wall_seconds'] else 0.0,
+        'stages': stages,
+        'usage': stats.get('usage', {}).get('totals'),
+        'peak_rss_bytes': peak_rss_bytes(),
+        'disk_bytes': {
+            'inputs': input_bytes,
+            'results': directory_bytes(config['RESULTS_DIR']),
+            'index': directory_bytes(config['INDEX_DIR']),
+            'highlight_cache': directory_bytes(config['HIGHLIGHT_CACHE_DIR'])
+        }
+    }
+
+
+def run_isolated(args, students):
+    """Run one class size in a fresh interpreter so its peak RSS is not shared with other sizes."""
+    with tempfile.NamedTemporaryFile('r', suffix='.json', delete=False) as output:
+        output_path = output.name
+    command = [sys.executable, '-m', 'benchmarks.run_benchmark', '--single', str(students),
+               '--single-output', output_path] + forwarded_args(args)
+    try:
+        subprocess.run(command, check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        with open(output_path, 'r') as f:
+            return json.load(f)
+    finally:
+        os.remove(output_path)
+
+
+def forwarded_args(args):
+    """Return the command line options shared by every class size."""
+    forwarded = ['--questions', str(args.questions), '--workers', str(args.workers),
+                 '--latency-ms', str(args.latency_ms), '--jitter-ms', str(args.jitter_ms),
+                 '--error-rate', str(args.error_rate), '--seed', str(args.seed),
+                 '--highlight-sample', str(args.highlight_sample)]
+    if args.workdir:
+        forwarded += ['--workdir', args.workdir]
+    if args.keep:
+        forwarded.append('--keep')
+    if not args.journal:
+        forwarded.append('--no-journal')
+    return forwarded
+
+
+def single(args):
+    """Run one class size in this process and write its result to --single-output."""
+    workdir = tempfile.mkdtemp(prefix=f"bench_{args.single}_", dir=args.workdir)
+    try:
+        result = run_size(args, args.single, workdir)
+        if args.keep:
+            result['workdir'] = workdir
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.single_output, 'w') as f:
+        json.dump(result, f)
+    return 0
+
+
+def format_result(result):
+    """Render one class size as a short human-readable report."""
+    lines = [
+        f"{result['students']} students x {result['questions']} questions, {result['workers']} workers: "
+        f"{result['exams_per_minute']} exams/min, {result['wall_seconds']:.2f}s "
+        f"(generation {result['generate_seconds']:.2f}s)"
+    ]
+    for stage, summary in sorted(result['stages'].items()):
+        if 'p50' in summary and summary['count']:
+            lines.append(f"  {stage:<20} n={summary['count']:<6} p50 {summary['p50'] * 1000:8.1f}ms  "
+                         f"p95 {summary['p95'] * 1000:8.1f}ms  p99 {summary['p99'] * 1000:8.1f}ms")
+    rss = result['peak_rss_bytes']
+    disk = result['disk_bytes']
+    lines.append(f"  peak RSS {rss / 2 ** 20:.1f} MiB" if rss else "  peak RSS unavailable")
+    lines.append(f"  disk: inputs {disk['inputs'] / 2 ** 20:.1f} MiB, results {disk['results'] / 2 ** 20:.1f} MiB, "
+                 f"index {disk['index'] / 2 ** 20:.1f} MiB, highlights {disk['highlight_cache'] / 2 ** 20:.1f} MiB")
+    return '\n'.join(lines)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run_benchmark',
+                                     description='Grade synthetic classes offline and report performance')
+    parser.add_argument('--students', type=int, nargs='+', default=[10, 100],
+                        help='Class sizes to benchmark (e.g. 10 100 1000 10000)')
+    parser.add_argument('--questions', type=int, default=20, help='Questions per exam')
+    parser.add_argument('--workers', type=int, default=4, help='Exams graded concurrently')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Simulated latency of every model call')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='Random extra latency per model call')
+    parser.add_argument('--error-rate', type=float, default=0.2, help='Share of wrong student answers')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for answers and latency jitter')
+    parser.add_argument('--highlight-sample', type=int, default=10,
+                        help='Number of graded exams to render highlighted PDFs for')
+    parser.add_argument('--no-journal', dest='journal', action='store_false',
+                        help='Grade without the checkpoint journal')
+    parser.add_argument('--workdir', help='Folder for the generated data (default: system temp)')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated data')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--single-output', help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.single is not None:
+        return single(args)
+
+    results = []
+    for students in args.students:
+        result = run_isolated(args, students)
+        print(format_result(result), file=sys.stderr)
+        results.append(result)
+
+    report = {
+        'benchmark': 'grading_pipeline',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
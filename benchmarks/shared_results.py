@@ -0,0 +1,165 @@
+# benchmarks/shared_results.py
+"""Several grading processes sharing one results folder.
+
+Generates a synthetic class (some students sharing a name), then starts
+several processes that each run the full GradingPipeline on the whole
+class against the same data folder, like CLI graders or web workers on one
+node. Checks that every exam file ends up in exactly one result, that no
+two students overwrote each other, and that the analysis covers the whole
+class, and reports how the exams were divided between the processes and
+how many model calls were made in total. Exits with status 1 if a check
+fails.
+
+Usage:
+    python -m benchmarks.shared_results --students 40 --processes 3
+    python -m benchmarks.shared_results --students 200 --processes 4 --workers 4 --latency-ms 50
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from benchmarks.run_benchmark import DATA_SUBDIRS, offline_config
+
+EXAM_ID = 'shared'
+
+
+def grade(args):
+    """Grade the class once in this process and write the run's stats to --worker-output."""
+    from app.services.grading_pipeline import GradingPipeline
+
+    data_dir = args.worker
+    config = offline_config(data_dir, args.workers, args.latency_ms, seed=args.seed, journal=args.journal)
+    exam_paths = sorted(os.path.join(config['EXAMS_DIR'], name) for name in os.listdir(config['EXAMS_DIR']))
+    answer_key_path = os.path.join(config['ANSWERS_DIR'], 'synthetic_key.pdf')
+
+    result = GradingPipeline(config, workers=args.workers).run(EXAM_ID, answer_key_path, exam_paths,
+                                                               'General Knowledge')
+    stats = result['stats']
+    summary = {key: stats.get(key) for key in ('graded', 'failed', 'claimed', 'resumed', 'wall_seconds')}
+    summary['model_calls'] = stats['usage']['totals']['calls']
+    summary['model_calls_by_stage'] = {stage: usage['calls'] for stage, usage in stats['usage']['by_stage'].items()}
+    with open(args.worker_output, 'w') as f:
+        json.dump(summary, f)
+    return 0
+
+
+def check_results(results_dir, students, exam_id=EXAM_ID):
+    """Return the problems found in the shared results folder (empty if there are none)."""
+    from app.services.result_store import ResultStore
+
+    store = ResultStore(results_dir)
+    problems = []
+    sources = {}
+    for filename, data in store.iter_student_data(exam_id):
+        sources.setdefault(data.get('source_file'), []).append(filename)
+    if len(sources) != students:
+        problems.append(f"{len(sources)} exam files have results, expected {students}")
+    for source, filenames in sources.items():
+        if len(filenames) > 1:
+            problems.append(f"{source} has {len(filenames)} results: {', '.join(filenames)}")
+
+    analysis = store.load_analysis(exam_id)
+    if analysis is None:
+        problems.append("No analysis was saved")
+    elif analysis['student_count'] != students:
+        problems.append(f"The analysis covers {analysis['student_count']} students, expected {students}")
+    return problems
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.shared_results',
+                                     description='Grade one class with several processes sharing a results folder')
+    parser.add_argument('--students', type=int, default=40, help='Students in the class')
+    parser.add_argument('--questions', type=int, default=5, help='Questions per exam')
+    parser.add_argument('--duplicate-names', type=int, default=4, help='Students named like another student')
+    parser.add_argument('--processes', type=int, default=3, help='Grading processes started at once')
+    parser.add_argument('--workers', type=int, default=2, help='Exams graded concurrently per process')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='Simulated latency of every model call')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic answers')
+    parser.add_argument('--no-journal', dest='journal', action='store_false',
+                        help='Run without the shared run journal')
+    parser.add_argument('--workdir', help='Parent folder for the temporary data folder')
+    parser.add_argument('--keep', action='store_true', help='Keep the data folder')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--worker-output', help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.worker:
+        return grade(args)
+
+    from benchmarks.synthetic import generate_exam_set
+
+    workdir = tempfile.mkdtemp(prefix='shared_results_', dir=args.workdir)
+    data_dir = os.path.join(workdir, 'data')
+    try:
+        for subdir in DATA_SUBDIRS:
+            os.makedirs(os.path.join(data_dir, subdir), exist_ok=True)
+        generate_exam_set(os.path.join(data_dir, 'exams'), os.path.join(data_dir, 'answers'), args.students,
+                          args.questions, seed=args.seed, duplicate_names=args.duplicate_names)
+
+        command = [sys.executable, '-m', 'benchmarks.shared_results', '--worker', data_dir,
+                   '--workers', str(args.workers), '--latency-ms', str(args.latency_ms), '--seed', str(args.seed)]
+        if not args.journal:
+            command.append('--no-journal')
+        outputs = [os.path.join(workdir, f"worker_{index}.json") for index in range(args.processes)]
+        started = time.perf_counter()
+        processes = [subprocess.Popen(command + ['--worker-output', output],
+                                      cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+                     for output in outputs]
+        exit_codes = [process.wait() for process in processes]
+        wall_seconds = time.perf_counter() - started
+
+        workers = []
+        for output, exit_code in zip(outputs, exit_codes):
+            if exit_code == 0 and os.path.exists(output):
+                with open(output, 'r') as f:
+                    workers.append(json.load(f))
+            else:
+                workers.append({'exit_code': exit_code})
+        problems = [f"A grading process exited with status {code}" for code in exit_codes if code]
+        problems += check_results(os.path.join(data_dir, 'results'), args.students)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'benchmark': 'shared_results',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'students': args.students,
+        'processes': args.processes,
+        'workers': args.workers,
+        'journal': args.journal,
+        'wall_seconds': round(wall_seconds, 3),
+        'model_calls': sum(worker.get('model_calls', 0) for worker in workers),
+        'per_process': workers,
+        'problems': problems
+    }
+    if args.keep:
+        report['workdir'] = workdir
+    print(f"{args.processes} processes graded {args.students} students in {wall_seconds:.2f}s "
+          f"with {report['model_calls']} model calls; "
+          + ('all checks passed' if not problems else f"{len(problems)} problems"), file=sys.stderr)
+    for problem in problems:
+        print(f"  {problem}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
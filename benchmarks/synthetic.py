@@ -0,0 +1,218 @@
+# benchmarks/synthetic.py
+"""Synthetic exam generator and an offline stand-in for the Gemini models.
+
+Exams are real PDFs written with PyMuPDF: a name line, then one question
+prompt and one "Answer:" line per question. The stand-in model reads the
+text layer and word coordinates back with PyMuPDF, so extraction produces
+the same JSON (answers with page and bounding boxes) the pipeline expects
+from Gemini, without any network calls.
+"""
+import re
+import json
+import time
+import base64
+import random
+import threading
+
+import fitz  # PyMuPDF
+
+PAGE_WIDTH = 595  # A4 in points
+PAGE_HEIGHT = 842
+MARGIN = 56
+LINE_HEIGHT = 16
+FONT_SIZE = 11
+
+# Tokens Gemini charges per PDF page, used for the stand-in's usage metadata
+TOKENS_PER_PAGE = 258
+
+WORDS = (
+    'photosynthesis', 'gravity', 'equation', 'river', 'democracy', 'molecule', 'triangle', 'poem', 'energy',
+    'continent', 'fraction', 'novel', 'climate', 'circuit', 'protein', 'empire', 'vector', 'metaphor', 'orbit',
+    'enzyme', 'parliament', 'harbor', 'theorem', 'migration', 'volcano', 'ratio', 'sonnet', 'glacier', 'atom',
+    'revolution', 'catalyst', 'latitude', 'algebra', 'narrative', 'ecosystem', 'friction', 'treaty', 'isotope',
+)
+
+
+def _phrase(rng, length=4):
+    return ' '.join(rng.choice(WORDS) for _ in range(length))
+
+
+def make_answer_key(questions, seed=0):
+    """Return the reference answers of a synthetic exam, keyed by question number."""
+    rng = random.Random(seed)
+    return {str(number): _phrase(rng) for number in range(1, questions + 1)}
+
+
+def _write_exam_pdf(path, title, name, answers):
+    lines = [title] + ([f"Name: {name}"] if name else []) + ['']
+    for number, answer in answers.items():
+        lines += [f"Q{number}. Explain the key idea of topic {number}.", f"Answer: {answer}", '']
+
+    # One text insertion per page; inserting line by line is several times slower
+    lines_per_page = int((PAGE_HEIGHT - 2 * MARGIN) // LINE_HEIGHT)
+    doc = fitz.open()
+    for start in range(0, len(lines), lines_per_page):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        page.insert_text((MARGIN, MARGIN), '\n'.join(lines[start:start + lines_per_page]),
+                         fontsize=FONT_SIZE, lineheight=LINE_HEIGHT / FONT_SIZE)
+    doc.save(path, deflate=True)
+    doc.close()
+
+
+def generate_exam_set(exams_dir, answers_dir, students, questions, error_rate=0.2, seed=0, duplicate_names=0):
+    """Write an answer key PDF and one exam PDF per student.
+
+    Args:
+        exams_dir (str): Folder the student exams are written to
+        answers_dir (str): Folder the answer key is written to
+        students (int): Number of student exams
+        questions (int): Questions per exam
+        error_rate (float): Probability that a student's answer differs from the key
+        seed (int): Seed for reproducible answers
+        duplicate_names (int): Number of students (the last ones) named like one of the first students
+
+    Returns:
+        tuple: (answer key path, list of exam paths)
+    """
+    key = make_answer_key(questions, seed)
+    answer_key_path = f"{answers_dir}/synthetic_key.pdf"
+    _write_exam_pdf(answer_key_path, 'Synthetic Exam - Answer Key', None, key)
+
+    exam_paths = []
+    for index in range(1, students + 1):
+        rng = random.Random(seed * 1_000_003 + index)
+        answers = {number: (_phrase(rng) if rng.random() < error_rate else answer)
+                   for number, answer in key.items()}
+        path = f"{exams_dir}/synthetic_{index:05d}.pdf"
+        name_index = index - (students - duplicate_names) if index > students - duplicate_names else index
+        _write_exam_pdf(path, 'Synthetic Exam', f"Student {name_index:05d}", answers)
+        exam_paths.append(path)
+
+    return answer_key_path, exam_paths
+
+
+class _Usage:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class _Response:
+    def __init__(self, text, prompt_tokens):
+        self.text = text
+        self.usage_metadata = _Usage(prompt_tokens, max(1, len(text) // 4))
+
+
+class OfflineModel:
+    """Answers the pipeline's prompts locally, like Gemini would for synthetic exams.
+
+    Handles the three prompt shapes the pipeline sends: a PDF with the exam or
+    answer key prompt, the evaluation prompt and the error grouping prompt.
+    """
+
+    def __init__(self, model_name, latency=0.0, jitter=0.0, seed=0):
+        """Initialize the stand-in.
+
+        Args:
+            model_name (str): Name reported in usage records
+            latency (float): Seconds each call sleeps, to simulate network time
+            jitter (float): Maximum extra random seconds added to the latency
+            seed (int): Seed of the latency jitter
+        """
+        self.model_name = f"models/{model_name}"
+        self.latency = latency
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _sleep(self):
+        if self.latency or self.jitter:
+            with self._lock:
+                extra = self._rng.uniform(0, self.jitter) if self.jitter else 0.0
+            time.sleep(self.latency + extra)
+
+    def generate_content(self, contents):
+        self._sleep()
+        if isinstance(contents, list):
+            prompt, document = contents[0], contents[1]
+            pdf_bytes = base64.b64decode(document['inline_data']['data'])
+            return self._extract(prompt, pdf_bytes)
+        if 'Reference answer:' in contents:
+            return self._evaluate(contents)
+        return self._group(contents)
+
+    def _extract(self, prompt, pdf_bytes):
+        name = None
+        current = None
+        entries = []
+        with fitz.open(stream=pdf_bytes, filetype='pdf') as doc:
+            pages = len(doc)
+            for page_number, page in enumerate(doc, start=1):
+                width, height = page.rect.width, page.rect.height
+                for block in page.get_text('dict')['blocks']:
+                    for line in block.get('lines', []):
+                        text = ''.join(span['text'] for span in line['spans']).strip()
+                        x1, y1, x2, y2 = line['bbox']
+                        if text.startswith('Name: '):
+                            name = text[len('Name: '):]
+                        elif re.match(r'^Q(\d+)\.', text):
+                            current = re.match(r'^Q(\d+)\.', text).group(1)
+                        elif text.startswith('Answer: ') and current is not None:
+                            box = {'x1': round(x1 / width, 4), 'y1': round(y1 / height, 4),
+                                   'x2': round(x2 / width, 4), 'y2': round(y2 / height, 4)}
+                            answer = text[len('Answer: '):]
+                            entries.append((current, answer, {
+                                'page': page_number,
+                                'bounding_box': box,
+                                'text_spans': [{'text': answer, 'page': page_number, 'bbox': box}]
+                            }))
+
+        if 'answer key' in prompt.lower():
+            result = {'answers': [{'number': number, 'correct_answer': answer, 'location': location}
+                                  for number, answer, location in entries]}
+        else:
+            result = {'student_name': name or '',
+                      'questions': [{'number': number, 'answer': answer, 'location': location}
+                                    for number, answer, location in entries]}
+        return _Response(json.dumps(result), len(prompt) // 4 + pages * TOKENS_PER_PAGE)
+
+    @staticmethod
+    def _evaluate(prompt):
+        results = {}
+        pattern = r'Question (\S+):\s*- Reference answer: "(.*?)"\s*- Student answer: "(.*?)"'
+        for number, reference, answer in re.findall(pattern, prompt, re.DOTALL):
+            if ' '.join(reference.split()).lower() == ' '.join(answer.split()).lower():
+                results[number] = {'is_correct': True, 'reason': 'Matches the reference answer'}
+            else:
+                results[number] = {
+                    'is_correct': False,
+                    'reason': 'Does not match the reference answer',
+                    'error_type': f"confused {answer.split()[0] if answer.split() else 'blank'}",
+                    'misconception': 'Answered a different topic',
+                    'reference_to_answer': reference,
+                    'learning_topics': reference.split()[:3]
+                }
+        return _Response(f"```json\n{json.dumps(results)}\n```", len(prompt) // 4)
+
+    @staticmethod
+    def _group(prompt):
+        grouped = {}
+        match = re.search(r'Error types:\s*(.*?)\n', prompt)
+        for item in (match.group(1).split(', ') if match else []):
+            label, _, count = item.rpartition(': ')
+            if label:
+                grouped[label] = grouped.get(label, 0) + int(count)
+        return _Response(json.dumps({'grouped_errors': grouped}), len(prompt) // 4)
+
+
+class OfflineModelFactory:
+    """GEMINI_MODEL_FACTORY that returns OfflineModel stand-ins."""
+
+    def __init__(self, latency=0.0, jitter=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.seed = seed
+
+    def __call__(self, model_name):
+        return OfflineModel(model_name, self.latency, self.jitter, self.seed)
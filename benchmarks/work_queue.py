@@ -0,0 +1,185 @@
+# benchmarks/work_queue.py
+"""Grading a class through the shared work queue with several worker processes.
+
+Generates a synthetic class, submits it to a fresh WorkQueue and starts
+several queue worker processes against the same data folder, as separate
+nodes would run them on a shared mount. Optionally kills one worker
+mid-run to check that its leased tasks are picked up by the others once
+their visibility timeout passes. Checks that every exam file ends up in
+exactly one result and that the analysis covers the whole class, and
+reports throughput, task counts and model calls. Exits with status 1 if a
+check fails or tasks are left unfinished.
+
+Usage:
+    python -m benchmarks.work_queue --students 40 --processes 3
+    python -m benchmarks.work_queue --students 100 --processes 4 --kill-one --visibility-timeout 3
+    python -m benchmarks.work_queue --journal-mode DELETE
+"""
+import os
+import sys
+import json
+import time
+import signal
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from benchmarks.run_benchmark import DATA_SUBDIRS, offline_config
+from benchmarks.shared_results import check_results
+
+EXAM_ID = 'queued'
+
+
+def queue_config(data_dir, args):
+    """Return the offline settings with the work queue options of this benchmark."""
+    config = offline_config(data_dir, args.threads, args.latency_ms, seed=args.seed, journal=False)
+    config.update(WORK_QUEUE_PATH=os.path.join(data_dir, 'index', 'work_queue.sqlite3'),
+                  SQLITE_JOURNAL_MODE=args.journal_mode,
+                  WORK_QUEUE_VISIBILITY_TIMEOUT=args.visibility_timeout,
+                  WORK_QUEUE_POLL_INTERVAL=0.2)
+    return config
+
+
+def work(args):
+    """Run a queue worker until the queue stays idle, writing its task counts to --worker-output."""
+    from app.services.queue_worker import QueueWorker
+    from app.utils.metrics import REGISTRY
+
+    queue_worker = QueueWorker(queue_config(args.worker, args))
+    stats = queue_worker.run(threads=args.threads, idle_exit=args.idle_exit)
+    calls = REGISTRY.counter('smartassess_stage_calls_total', '', ('stage', 'outcome')).snapshot()
+    stats['model_calls'] = sum(count for (stage, _), count in calls.items() if stage.endswith('_call'))
+    with open(args.worker_output, 'w') as f:
+        json.dump(stats, f)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.work_queue',
+                                     description='Grade one class through the work queue with several workers')
+    parser.add_argument('--students', type=int, default=40, help='Students in the class')
+    parser.add_argument('--questions', type=int, default=5, help='Questions per exam')
+    parser.add_argument('--duplicate-names', type=int, default=4, help='Students named like another student')
+    parser.add_argument('--processes', type=int, default=3, help='Worker processes')
+    parser.add_argument('--threads', type=int, default=2, help='Tasks run concurrently per worker')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='Simulated latency of every model call')
+    parser.add_argument('--journal-mode', default='WAL', help='SQLite journal mode of the queue (WAL or DELETE)')
+    parser.add_argument('--visibility-timeout', type=float, default=3.0, help='Seconds a lease lasts without a heartbeat')
+    parser.add_argument('--kill-one', action='store_true', help='Kill one worker while it holds leases')
+    parser.add_argument('--idle-exit', type=float, default=None,
+                        help='Seconds a worker waits for new tasks before exiting (default 2x the visibility timeout)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic answers')
+    parser.add_argument('--workdir', help='Parent folder for the temporary data folder')
+    parser.add_argument('--keep', action='store_true', help='Keep the data folder')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--worker-output', help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.idle_exit is None:
+        args.idle_exit = 2 * args.visibility_timeout
+    if args.worker:
+        return work(args)
+
+    from benchmarks.synthetic import generate_exam_set
+    from app.services.work_queue import WorkQueue
+    from app.services.queue_worker import submit_exam
+
+    workdir = tempfile.mkdtemp(prefix='work_queue_', dir=args.workdir)
+    data_dir = os.path.join(workdir, 'data')
+    try:
+        for subdir in DATA_SUBDIRS:
+            os.makedirs(os.path.join(data_dir, subdir), exist_ok=True)
+        answer_key_path, exam_paths = generate_exam_set(
+            os.path.join(data_dir, 'exams'), os.path.join(data_dir, 'answers'), args.students, args.questions,
+            seed=args.seed, duplicate_names=args.duplicate_names)
+
+        queue = WorkQueue.from_config(queue_config(data_dir, args))
+        started = time.perf_counter()
+        submitted = submit_exam(queue, EXAM_ID, answer_key_path, exam_paths, 'General Knowledge')
+        resubmitted = submit_exam(queue, EXAM_ID, answer_key_path, exam_paths, 'General Knowledge')
+
+        command = [sys.executable, '-m', 'benchmarks.work_queue', '--worker', data_dir,
+                   '--threads', str(args.threads), '--latency-ms', str(args.latency_ms), '--seed', str(args.seed),
+                   '--journal-mode', args.journal_mode, '--visibility-timeout', str(args.visibility_timeout),
+                   '--idle-exit', str(args.idle_exit)]
+        outputs = [os.path.join(workdir, f"worker_{index}.json") for index in range(args.processes)]
+        processes = [subprocess.Popen(command + ['--worker-output', output],
+                                      cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+                     for output in outputs]
+        killed = None
+        if args.kill_one:
+            # Wait until the first worker has leased something, then kill it without any cleanup
+            while not any(statuses.get('leased') for statuses in queue.counts(EXAM_ID).values()):
+                time.sleep(0.05)
+            processes[0].send_signal(signal.SIGKILL)
+            killed = 0
+        exit_codes = [process.wait() for process in processes]
+        wall_seconds = time.perf_counter() - started
+
+        workers = []
+        for index, (output, exit_code) in enumerate(zip(outputs, exit_codes)):
+            if index != killed and exit_code == 0 and os.path.exists(output):
+                with open(output, 'r') as f:
+                    workers.append(json.load(f))
+            else:
+                workers.append({'exit_code': exit_code, 'killed': index == killed})
+        counts = queue.counts(EXAM_ID)
+        failures = queue.failures(EXAM_ID)
+        queue.close()
+
+        problems = [f"Worker {index} exited with status {code}" for index, code in enumerate(exit_codes)
+                    if code and index != killed]
+        if resubmitted['queued']:
+            problems.append(f"Submitting the class again queued {resubmitted['queued']} tasks")
+        unfinished = {kind: statuses for kind, statuses in counts.items() if set(statuses) - {'done'}}
+        if unfinished:
+            problems.append(f"Unfinished tasks: {unfinished}")
+        problems += check_results(os.path.join(data_dir, 'results'), args.students, EXAM_ID)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'benchmark': 'work_queue',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'students': args.students,
+        'processes': args.processes,
+        'threads': args.threads,
+        'journal_mode': args.journal_mode,
+        'visibility_timeout': args.visibility_timeout,
+        'killed_worker': killed is not None,
+        'submitted_tasks': submitted['queued'],
+        'wall_seconds': round(wall_seconds, 3),
+        'exams_per_minute': round(args.students * 60 / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+        'model_calls': sum(worker.get('model_calls', 0) for worker in workers),
+        'tasks': counts,
+        'failed_tasks': failures,
+        'per_process': workers,
+        'problems': problems
+    }
+    if args.keep:
+        report['workdir'] = workdir
+    print(f"{args.processes} workers graded {args.students} students through the queue in {wall_seconds:.2f}s "
+          f"({report['exams_per_minute']} exams/min, includes the {args.idle_exit:.0f}s idle exit)"
+          f"{', one killed' if killed is not None else ''}; "
+          + ('all checks passed' if not problems else f"{len(problems)} problems"), file=sys.stderr)
+    for problem in problems:
+        print(f"  {problem}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,11 +11,43 @@ class Config:
     # Flask configuration
     SECRET_KEY = os.getenv("SECRET_KEY") or "your-secret-key"  # Use a secure key in production
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # 100MB max request size (batch uploads carry many files)
+    MAX_UPLOAD_FILE_SIZE = 10 * 1024 * 1024  # 10MB max size per uploaded file
+
+    # Chunked/resumable uploads for large class scan batches
+    MAX_CHUNKED_UPLOAD_SIZE = 1024 * 1024 * 1024  # 1GB max total size
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Chunk size advertised to clients
+    CHUNKED_UPLOAD_EXPIRY = 24 * 60 * 60  # Discard unfinished uploads after a day
+
+    # Number of worker processes used to render highlighted PDFs (None = CPU count), shared by the whole app
+    RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "0")) or None
+    # Render highlighted PDFs for the whole class in the background after grading
+    PRERENDER_HIGHLIGHTS = os.getenv("PRERENDER_HIGHLIGHTS", "false").lower() == "true"
+    # Graded classes waiting to be pre-rendered; further classes are skipped while it is full
+    PRERENDER_QUEUE_SIZE = int(os.getenv("PRERENDER_QUEUE_SIZE", "4"))
 
     # API Configuration
     GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
     GEMINI_MODEL = "gemini-1.5-flash"
+    GEMINI_EVALUATION_MODEL = "gemini-1.5-pro"  # Compares answers with the answer key
+    GEMINI_GROUPING_MODEL = "gemini-1.5-pro"  # Groups similar error patterns
+    GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "2"))  # Extra attempts after a failed model call
+    GEMINI_RETRY_BACKOFF = 1.0  # Seconds before the first retry, doubled after each retry
+    # Price per million tokens, used by the cost report (update when the price list changes)
+    GEMINI_PRICES = {
+        "gemini-1.5-flash": {"input": 0.075, "output": 0.30},
+        "gemini-1.5-pro": {"input": 1.25, "output": 5.00},
+    }
+    GEMINI_PRICE_CURRENCY = "USD"
+    # Callable model_name -> model used instead of Gemini (e.g. the offline stand-in of the benchmarks)
+    GEMINI_MODEL_FACTORY = None
+    # Create the model clients and open their connections in the background at startup
+    GEMINI_WARMUP = os.getenv("GEMINI_WARMUP", "true").lower() == "true"
+
+    # Number of exams extracted and evaluated concurrently
+    GRADING_WORKERS = int(os.getenv("GRADING_WORKERS", "4"))
+    # Maximum number of answers re-evaluated per model call by a regrade
+    REGRADE_BATCH_SIZE = 20
 
     # Directory paths
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -23,10 +55,68 @@ class Config:
     EXAMS_DIR = os.path.join(DATA_DIR, "exams")
     ANSWERS_DIR = os.path.join(DATA_DIR, "answers")
     RESULTS_DIR = os.path.join(DATA_DIR, "results")
-
-    # Ensure directories exist
-    for directory in [DATA_DIR, EXAMS_DIR, ANSWERS_DIR, RESULTS_DIR]:
-        os.makedirs(directory, exist_ok=True)
+    INDEX_DIR = os.path.join(DATA_DIR, "index")
+    UPLOADS_DIR = os.path.join(DATA_DIR, "uploads")
+    CACHE_DIR = os.path.join(DATA_DIR, "cache")
+    HIGHLIGHT_CACHE_DIR = os.path.join(CACHE_DIR, "highlighted")
+    PAGE_CACHE_DIR = os.path.join(CACHE_DIR, "pages")
+
+    # Format new results are written in: "json" or "msgpack" (smaller and faster, needs the msgpack package)
+    RESULT_FORMAT = os.getenv("RESULT_FORMAT", "json")
+    # Flush each result file to disk before it atomically replaces the old one
+    RESULT_FSYNC = os.getenv("RESULT_FSYNC", "true").lower() == "true"
+    # Batch runs buffer result writes and write them together once this many are pending
+    # (or the oldest is RESULT_GROUP_COMMIT_SECONDS old); 0 writes every result immediately
+    RESULT_GROUP_COMMIT_SIZE = int(os.getenv("RESULT_GROUP_COMMIT_SIZE", "50"))
+    RESULT_GROUP_COMMIT_SECONDS = float(os.getenv("RESULT_GROUP_COMMIT_SECONDS", "2.0"))
+    # Seconds a run waits for the lease on an exam's shared results (answer key, analysis)
+    # held by another process sharing RESULTS_DIR
+    RESULT_LOCK_TIMEOUT = float(os.getenv("RESULT_LOCK_TIMEOUT", "600"))
+
+    # Per-run stage timing summaries (defaults to a "runs" folder next to the results)
+    RUN_METRICS_DIR = os.getenv("RUN_METRICS_DIR")
+    # Token usage logs per exam (defaults to a "usage" folder next to the results)
+    USAGE_DIR = os.getenv("USAGE_DIR")
+    # Expose Prometheus metrics at /metrics
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+    # Profiling: PROFILE_MODE ('cprofile' or 'sampling') profiles every request and CLI run;
+    # with PROFILE_TOKEN set, single requests can be profiled with ?profile=<mode>&profile_token=<token>
+    PROFILE_MODE = os.getenv("PROFILE_MODE", "")
+    PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+    PROFILE_DIR = os.getenv("PROFILE_DIR")  # Defaults to data/profiles
+    PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))  # Older profiles are deleted
+    PROFILE_MIN_SECONDS = float(os.getenv("PROFILE_MIN_SECONDS", "0"))  # Only keep profiles slower than this
+    PROFILE_SAMPLE_INTERVAL = 0.005  # Seconds between stack samples of the sampling profiler
+    PROFILE_MAX_SAMPLES = 200000  # Sampling stops after this many samples
+
+    # Checkpoint journal that lets interrupted grading runs resume (empty to disable)
+    RUN_JOURNAL_PATH = os.getenv("RUN_JOURNAL_PATH", os.path.join(INDEX_DIR, "run_journal.sqlite3"))
+    # Journal mode of the SQLite run journal and work queue. WAL is fastest but needs the processes
+    # using a database to share memory, so set DELETE when the databases are on NFS
+    SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+
+    # Shared work queue: with WORK_QUEUE_ENABLED, /analysis/process queues exams for
+    # `python -m app.cli worker` processes (on this or other nodes) instead of grading them itself
+    WORK_QUEUE_ENABLED = os.getenv("WORK_QUEUE_ENABLED", "false").lower() == "true"
+    WORK_QUEUE_PATH = os.getenv("WORK_QUEUE_PATH", os.path.join(INDEX_DIR, "work_queue.sqlite3"))
+    WORK_QUEUE_VISIBILITY_TIMEOUT = float(os.getenv("WORK_QUEUE_VISIBILITY_TIMEOUT", "300"))  # Lease without heartbeat
+    WORK_QUEUE_MAX_ATTEMPTS = int(os.getenv("WORK_QUEUE_MAX_ATTEMPTS", "3"))
+    WORK_QUEUE_POLL_INTERVAL = float(os.getenv("WORK_QUEUE_POLL_INTERVAL", "2"))  # Idle workers check this often
+
+    # Watch-folder ingestion (python -m app.cli watch). The inbox must only receive papers of the watched
+    # exam; if it is set to EXAMS_DIR, only files arriving after the watcher started are graded
+    WATCH_INBOX_DIR = os.getenv("WATCH_INBOX_DIR") or os.path.join(DATA_DIR, "inbox")
+    WATCH_EXAM_ID = os.getenv("WATCH_EXAM_ID")
+    WATCH_ANSWER_KEY = os.getenv("WATCH_ANSWER_KEY")
+    WATCH_SETTLE_SECONDS = float(os.getenv("WATCH_SETTLE_SECONDS", "2"))  # Unchanged time before a file is graded
+    WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", "1"))
+    WATCH_MAX_ATTEMPTS = int(os.getenv("WATCH_MAX_ATTEMPTS", "3"))  # Gradings of a file before giving up
+    WATCH_RETRY_SECONDS = float(os.getenv("WATCH_RETRY_SECONDS", "60"))  # First retry delay, doubled per attempt
+
+    # Page preview rendering
+    PREVIEW_DPI = 72
+    MAX_PREVIEW_DPI = 200
 
     # Model prompts
     EXAM_ANALYSIS_PROMPT = """
@@ -105,6 +195,7 @@ class DevelopmentConfig(Config):
 class TestingConfig(Config):
     DEBUG = True
     TESTING = True
+    GEMINI_WARMUP = False
 
 
 class ProductionConfig(Config):
@@ -123,4 +214,39 @@ config = {
 
 def get_config():
     config_name = os.getenv('FLASK_ENV', 'default')
-    return config[config_name]
\ No newline at end of file
+    return config[config_name]
+
+def load_config(config_name=None, **overrides):
+    """Build a plain configuration dict for running services without a Flask app.
+
+    Args:
+        config_name (str, optional): Key in `config`, defaults to FLASK_ENV
+        **overrides: Settings to replace (e.g. RESULTS_DIR)
+
+    Returns:
+        dict: Upper-case settings, as Flask's app.config would hold them
+    """
+    config_class = config[config_name] if config_name else get_config()
+    settings = {key: getattr(config_class, key) for key in dir(config_class) if key.isupper()}
+    settings.update(overrides)
+    ensure_directories(settings)
+    return settings
+
+
+# Data folders created by ensure_directories()
+DATA_DIRECTORY_KEYS = ('DATA_DIR', 'EXAMS_DIR', 'ANSWERS_DIR', 'RESULTS_DIR', 'INDEX_DIR', 'UPLOADS_DIR',
+                       'CACHE_DIR', 'HIGHLIGHT_CACHE_DIR', 'PAGE_CACHE_DIR')
+
+
+def ensure_directories(settings):
+    """Create the data folders named in the settings if they do not exist yet.
+
+    Called when an app or a service configuration is built rather than when
+    this module is imported, so importing the config has no side effects.
+
+    Args:
+        settings (Mapping): Flask app.config or a dict from load_config()
+    """
+    for key in DATA_DIRECTORY_KEYS:
+        if settings.get(key):
+            os.makedirs(settings[key], exist_ok=True)